@@ -0,0 +1,144 @@
+"""Numba-compiled kernels for batches of polygon vertex and edge signs.
+
+This module is only imported by polygon if Numba (and hence NumPy) is
+installed.  Vertex signs are computed by direct comparisons, which are exact
+for float64 and int64 values alike.  Edge signs are computed by the same
+floating-point evaluation and error bound as polygon.orientation for float64
+inputs, and in int64 arithmetic for ints small enough that it can't
+overflow.  Float edge signs that the error bound can't certify are marked
+UNCERTAIN, for the caller to compute exactly.
+
+"""
+import numba
+import numpy
+
+
+# Largest coordinate magnitude for which the int64 kernel can't overflow:
+# with coordinates bounded by 2**29, differences are bounded by 2**30 and
+# the determinant in orientation by 2**61.
+INT64_BOUND = 2 ** 29
+
+# Largest magnitude of an int that converts exactly to float64, so that ints
+# mixed with floats can be compared exactly after conversion.
+FLOAT_INT_BOUND = 2 ** 53
+
+# Error bound for the floating-point evaluation of the orientation
+# determinant, and the smallest bound trusted, as in polygon.
+EPSILON = 2.0 ** -53
+ORIENTATION_ERROR_BOUND = (3.0 + 16.0 * EPSILON) * EPSILON
+UNDERFLOW_GUARD = 2.0 ** -900
+
+# Marker for an edge sign that the error bound can't certify.
+UNCERTAIN = 2
+
+
+@numba.njit(cache=True)
+def _compare(a, b):
+    if a > b:
+        return 1
+    elif a < b:
+        return -1
+    else:
+        return 0
+
+
+@numba.njit(parallel=True, cache=True)
+def _vertex_signs(P, O, out):
+    for i in numba.prange(P.shape[0]):
+        result = _compare(P[i, 0], O[i, 0])
+        if not result:
+            result = _compare(P[i, 1], O[i, 1])
+        out[i] = result
+
+
+@numba.njit(parallel=True, cache=True)
+def _int_edge_signs(P, Q, O, out):
+    for i in numba.prange(P.shape[0]):
+        out[i] = _compare(
+            (P[i, 0] - O[i, 0]) * (Q[i, 1] - O[i, 1]),
+            (P[i, 1] - O[i, 1]) * (Q[i, 0] - O[i, 0]))
+
+
+@numba.njit(parallel=True, cache=True)
+def _float_edge_signs(P, Q, O, out):
+    for i in numba.prange(P.shape[0]):
+        left = (P[i, 0] - O[i, 0]) * (Q[i, 1] - O[i, 1])
+        right = (P[i, 1] - O[i, 1]) * (Q[i, 0] - O[i, 0])
+        bound = ORIENTATION_ERROR_BOUND * (abs(left) + abs(right))
+        result = left - right
+        if bound > UNDERFLOW_GUARD and abs(result) > bound:
+            out[i] = 1 if result > 0 else -1
+        else:
+            out[i] = UNCERTAIN
+
+
+def _as_arrays(point_arrays):
+    """
+    Convert arrays of 2D points to a common int64 or float64 array type.
+
+    Return a pair (arrays, floats), where floats is True if all the inputs
+    were float64, or None if the conversion can't be done faithfully: for
+    example for Fractions, NumPy float32 values, or ints too large for the
+    int64 kernel or to convert to float exactly.
+
+    """
+    arrays = []
+    for points in point_arrays:
+        array = numpy.asarray(points)
+        if array.size == 0:
+            array = numpy.zeros((0, 2), dtype=numpy.float64)
+        elif array.ndim != 2 or array.shape[1] != 2:
+            return None
+        elif array.dtype.kind in "iu":
+            array = array.astype(numpy.int64)
+        elif array.dtype != numpy.float64:
+            return None
+        arrays.append(array)
+    floats = all(array.dtype == numpy.float64 for array in arrays)
+    if all(array.dtype.kind == "i" for array in arrays):
+        bound = INT64_BOUND
+    else:
+        # A list mixing large ints and floats becomes a float64 array
+        # with the ints rounded, so large values are left to Python.
+        bound = FLOAT_INT_BOUND
+        arrays = [array.astype(numpy.float64) for array in arrays]
+    if any(numpy.abs(array).max(initial=0) > bound for array in arrays):
+        return None
+    return arrays, floats
+
+
+def vertex_signs(P, O):
+    """
+    Signs of the vertices P[i] with respect to the points O[i], as an int8
+    array, or None if the kernel can't reproduce the pure Python results.
+
+    """
+    converted = _as_arrays((P, O))
+    if converted is None:
+        return None
+    (P, O), _ = converted
+    out = numpy.zeros(P.shape[0], dtype=numpy.int8)
+    _vertex_signs(P, O, out)
+    return out
+
+
+def edge_signs(P, Q, O):
+    """
+    Signs of the edges P[i]Q[i] with respect to the points O[i].
+
+    Return a pair (signs, floats) of an int8 array, with UNCERTAIN marking
+    signs to be computed exactly, and a flag that's True if all the inputs
+    were float64; or None if the kernel can't reproduce the pure Python
+    results.
+
+    """
+    converted = _as_arrays((P, Q, O))
+    if converted is None:
+        return None
+    (P, Q, O), floats = converted
+    out = numpy.zeros(P.shape[0], dtype=numpy.int8)
+    if P.dtype == numpy.int64:
+        _int_edge_signs(P, Q, O, out)
+    else:
+        _float_edge_signs(P, Q, O, out)
+    return out, floats
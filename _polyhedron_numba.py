@@ -0,0 +1,463 @@
+"""Numba-compiled kernels for batch winding number computations.
+
+This module is only imported by polyhedron if Numba (and hence NumPy) is
+installed.  The kernels evaluate exactly the same arithmetic expressions, in
+exactly the same order, as the pure Python functions vertex_sign, edge_sign
+and triangle_sign in polyhedron, so that for float64 inputs, and for int64
+inputs small enough that no intermediate result overflows, they give results
+identical to the pure Python code.
+
+"""
+import numba
+import numpy
+
+
+# Largest coordinate magnitude for which the int64 kernel can't overflow:
+# with coordinates bounded by 2**19, differences are bounded by 2**20 and
+# the determinant in triangle_sign by 6 * 2**60 < 2**63.
+INT64_BOUND = 2 ** 19
+
+# Error bound for the floating-point evaluation of the triangle_sign
+# determinant, and the smallest bound trusted, as in polyhedron.
+EPSILON = 2.0 ** -53
+TRIANGLE_ERROR_BOUND = (7.0 + 56.0 * EPSILON) * EPSILON
+UNDERFLOW_GUARD = 2.0 ** -900
+
+# Error codes reported by the kernel, and the corresponding messages, which
+# match those raised by the pure Python code.
+ERROR_MESSAGES = {
+    1: "vertex coincides with origin",
+    2: "vertices collinear with origin",
+    3: "vertices coplanar with origin",
+}
+
+
+@numba.njit(cache=True)
+def _sign(x):
+    if x > 0:
+        return 1
+    elif x < 0:
+        return -1
+    else:
+        return 0
+
+
+@numba.njit(cache=True)
+def _vertex_sign(P, O):
+    result = _sign(P[0] - O[0])
+    if not result:
+        result = _sign(P[1] - O[1])
+        if not result:
+            result = _sign(P[2] - O[2])
+    return result
+
+
+@numba.njit(cache=True)
+def _edge_sign(P, Q, O):
+    result = _sign((P[1] - O[1]) * (Q[0] - O[0]) -
+                   (P[0] - O[0]) * (Q[1] - O[1]))
+    if not result:
+        result = _sign((P[2] - O[2]) * (Q[0] - O[0]) -
+                       (P[0] - O[0]) * (Q[2] - O[2]))
+        if not result:
+            result = _sign((P[2] - O[2]) * (Q[1] - O[1]) -
+                           (P[1] - O[1]) * (Q[2] - O[2]))
+    return result
+
+
+@numba.njit(cache=True)
+def _triangle_sign(P, Q, R, O):
+    m1_0 = P[0] - O[0]
+    m1_1 = P[1] - O[1]
+    m2_0 = Q[0] - O[0]
+    m2_1 = Q[1] - O[1]
+    m3_0 = R[0] - O[0]
+    m3_1 = R[1] - O[1]
+    return _sign(
+        (m1_0 * m2_1 - m1_1 * m2_0) * (R[2] - O[2]) +
+        (m2_0 * m3_1 - m2_1 * m3_0) * (P[2] - O[2]) +
+        (m3_0 * m1_1 - m3_1 * m1_0) * (Q[2] - O[2]))
+
+
+@numba.njit(cache=True)
+def _outside_hull(faces, lower, upper, exact, O):
+    """
+    Return True if O is certainly strictly outside a convex hull.
+
+    The hull has bounding box given by lower and upper, and outward-facing
+    faces given by faces.  For int64 data (*exact* true) the face signs
+    are exact; for float64 data only signs certified by the error bound
+    are used, so a point very close to the plane of a face isn't rejected,
+    and is left to the full computation.
+
+    """
+    for i in range(3):
+        if not lower[i] <= O[i] <= upper[i]:
+            return True
+    for f in range(faces.shape[0]):
+        P = faces[f, 0]
+        Q = faces[f, 1]
+        R = faces[f, 2]
+        m1_0 = P[0] - O[0]
+        m1_1 = P[1] - O[1]
+        m1_2 = P[2] - O[2]
+        m2_0 = Q[0] - O[0]
+        m2_1 = Q[1] - O[1]
+        m2_2 = Q[2] - O[2]
+        m3_0 = R[0] - O[0]
+        m3_1 = R[1] - O[1]
+        m3_2 = R[2] - O[2]
+        det = (
+            (m1_0 * m2_1 - m1_1 * m2_0) * m3_2 +
+            (m2_0 * m3_1 - m2_1 * m3_0) * m1_2 +
+            (m3_0 * m1_1 - m3_1 * m1_0) * m2_2)
+        if det >= 0:
+            continue
+        if exact:
+            return True
+        permanent = (
+            (abs(m1_0 * m2_1) + abs(m1_1 * m2_0)) * abs(m3_2) +
+            (abs(m2_0 * m3_1) + abs(m2_1 * m3_0)) * abs(m1_2) +
+            (abs(m3_0 * m1_1) + abs(m3_1 * m1_0)) * abs(m2_2))
+        bound = TRIANGLE_ERROR_BOUND * permanent
+        if bound > UNDERFLOW_GUARD and -det > bound:
+            return True
+    return False
+
+
+@numba.njit(cache=True)
+def _point_total(triangles, lower, upper, ranges, O):
+    """
+    Twice the winding number around a point, as a pair (error, total).
+
+    The triangles are grouped into closed shells, with bounding boxes given
+    by lower and upper and triangle ranges given by ranges; shells whose
+    box excludes the point are skipped.  If the point lies on the surface,
+    error is a nonzero error code.
+
+    """
+    total = 0
+    for s in range(ranges.shape[0]):
+        if not (lower[s, 0] <= O[0] <= upper[s, 0] and
+                lower[s, 1] <= O[1] <= upper[s, 1] and
+                lower[s, 2] <= O[2] <= upper[s, 2]):
+            continue
+        error, shell_total = _shell_total(
+            triangles, ranges[s, 0], ranges[s, 1], O)
+        if error:
+            return error, total
+        total += shell_total
+    return 0, total
+
+
+@numba.njit(cache=True)
+def _point_result(surface, O):
+    """
+    Return a triple (rejected, error, total) for a point: rejected is True
+    if the hull prefilter rejected the point, and otherwise error and total
+    are as for _point_total.
+
+    """
+    (triangles, lower, upper, ranges,
+     hull_faces, hull_lower, hull_upper, use_hull, exact) = surface
+    if use_hull and _outside_hull(
+            hull_faces, hull_lower, hull_upper, exact, O):
+        return True, 0, 0
+    error, total = _point_total(triangles, lower, upper, ranges, O)
+    return False, error, total
+
+
+@numba.njit(parallel=True, cache=True)
+def _winding_totals(surface, points, totals, errors, rejected):
+    """
+    Compute _point_result for each point, in parallel over the points.
+
+    """
+    for i in numba.prange(points.shape[0]):
+        rejected[i], errors[i], totals[i] = _point_result(surface, points[i])
+
+
+@numba.njit(nogil=True, cache=True)
+def _winding_totals_nogil(surface, points, totals, errors, rejected):
+    """
+    Compute _point_result for each point serially, without holding the GIL.
+
+    Unlike _winding_totals, this is safe to call from several Python
+    threads at once.
+
+    """
+    for i in range(points.shape[0]):
+        rejected[i], errors[i], totals[i] = _point_result(surface, points[i])
+
+
+@numba.njit(cache=True)
+def _shell_total(triangles, start, stop, O):
+    """
+    Sum of the triangle_chain contributions of a range of triangles.
+
+    Return a pair (error, total), where error is a nonzero error code if O
+    lies on one of the triangles.
+
+    """
+    total = 0
+    for t in range(start, stop):
+        v1 = triangles[t, 0]
+        v2 = triangles[t, 1]
+        v3 = triangles[t, 2]
+        v1sign = _vertex_sign(v1, O)
+        v2sign = _vertex_sign(v2, O)
+        v3sign = _vertex_sign(v3, O)
+        if not v1sign or not v2sign or not v3sign:
+            return 1, total
+
+        face_boundary = 0
+        if v1sign != v2sign:
+            s = _edge_sign(v1, v2, O)
+            if not s:
+                return 2, total
+            face_boundary += s
+        if v2sign != v3sign:
+            s = _edge_sign(v2, v3, O)
+            if not s:
+                return 2, total
+            face_boundary += s
+        if v3sign != v1sign:
+            s = _edge_sign(v3, v1, O)
+            if not s:
+                return 2, total
+            face_boundary += s
+        if not face_boundary:
+            continue
+
+        s = _triangle_sign(v1, v2, v3, O)
+        if not s:
+            return 3, total
+        total += s
+    return 0, total
+
+
+@numba.njit(parallel=True, cache=True)
+def _vertex_signs(P, O, out):
+    for i in numba.prange(P.shape[0]):
+        out[i] = _vertex_sign(P[i], O[i])
+
+
+@numba.njit(parallel=True, cache=True)
+def _edge_signs(P, Q, O, out):
+    for i in numba.prange(P.shape[0]):
+        out[i] = _edge_sign(P[i], Q[i], O[i])
+
+
+@numba.njit(parallel=True, cache=True)
+def _triangle_signs(P, Q, R, O, out):
+    for i in numba.prange(P.shape[0]):
+        out[i] = _triangle_sign(P[i], Q[i], R[i], O[i])
+
+
+SIGN_KERNELS = {
+    "vertex": _vertex_signs,
+    "edge": _edge_signs,
+    "triangle": _triangle_signs,
+}
+
+
+def _as_array(values, width):
+    """
+    Convert to an int64 or float64 array if that can be done faithfully.
+
+    Return None for other data (for example Fractions, or NumPy float32
+    values, whose pure Python arithmetic wouldn't be float64 arithmetic).
+
+    """
+    array = numpy.asarray(values)
+    if array.size == 0:
+        return numpy.zeros((0,) + width, dtype=numpy.float64)
+    if array.dtype.kind in "iu":
+        return array.astype(numpy.int64)
+    if array.dtype == numpy.float64:
+        return array
+    return None
+
+
+def prepare(triangle_positions, shells, hull=None):
+    """
+    Convert a surface to arrays suitable for the kernels.
+
+    *triangle_positions* is a list of triples of vertex positions, grouped
+    by shell, and *shells* a list of (lower, upper, start, stop) tuples
+    giving the bounding box and triangle range of each shell.  *hull*, if
+    given, is a triple (lower, upper, faces) giving the bounding box and
+    outward-facing faces of a convex hull of the surface, used to reject
+    points before the triangles are scanned.  Return None if the backend
+    can't reproduce the pure Python results for this surface.
+
+    """
+    triangles = _as_array(
+        [[tuple(vertex) for vertex in triangle]
+         for triangle in triangle_positions],
+        (3, 3),
+    )
+    lower = _as_array([tuple(shell[0]) for shell in shells], (3,))
+    upper = _as_array([tuple(shell[1]) for shell in shells], (3,))
+    if hull is None:
+        hull_lower = hull_upper = numpy.zeros(3, dtype=numpy.float64)
+        hull_faces = numpy.zeros((0, 3, 3), dtype=numpy.float64)
+    else:
+        hull_lower = _as_array(tuple(hull[0]), (3,))
+        hull_upper = _as_array(tuple(hull[1]), (3,))
+        hull_faces = _as_array(
+            [[tuple(vertex) for vertex in face] for face in hull[2]],
+            (3, 3),
+        )
+    if any(array is None for array in (
+            triangles, lower, upper, hull_lower, hull_upper, hull_faces)):
+        return None
+    ranges = numpy.array(
+        [shell[2:] for shell in shells], dtype=numpy.int64).reshape(-1, 2)
+    return (triangles, lower, upper, ranges, hull_faces, hull_lower,
+            hull_upper, hull is not None)
+
+
+def winding_numbers(surface, points, parallel=True):
+    """
+    Winding numbers around the given points of a prepared surface.
+
+    Return a pair (winding_numbers, rejections), where rejections is the
+    number of points rejected by the hull prefilter, or None if the
+    backend can't reproduce the pure Python results for these points.
+    Raise ValueError if any point lies on the surface.
+
+    If *parallel* is true, the points are shared between Numba's own worker
+    threads.  Otherwise they're processed serially, with the GIL released,
+    so that the caller can run several batches in its own threads.
+
+    """
+    points = _as_array([tuple(point) for point in points], (3,))
+    if surface is None or points is None:
+        return None
+    arrays = list(surface[:-1])
+    coordinates = [points] + [
+        array for n, array in enumerate(arrays) if n != 3]
+    if all(array.dtype.kind == "i" for array in coordinates
+           if array.size):
+        if max(numpy.abs(array).max(initial=0)
+               for array in coordinates) > INT64_BOUND:
+            return None
+        exact = True
+    else:
+        # Mixed int and float inputs: the pure Python code converts the
+        # ints to float before doing any arithmetic with them.
+        points = points.astype(numpy.float64, copy=False)
+        arrays = [
+            array if n == 3 else array.astype(numpy.float64, copy=False)
+            for n, array in enumerate(arrays)]
+        exact = False
+
+    totals, rejected = _run(
+        tuple(arrays) + (surface[-1], exact), points, parallel)
+    return [int(total) // 2 for total in totals], int(rejected.sum())
+
+
+def point_array(points):
+    """
+    Convert a sequence of points for chain_totals, or return None if that
+    can't be done faithfully.
+
+    """
+    return _as_array([tuple(point) for point in points], (3,))
+
+
+def chain_totals(triangle_positions, points):
+    """
+    Sums of the triangle_chain contributions of a chunk of triangles around
+    each of the points, as an int64 array.
+
+    *points* is an array returned by point_array.  The chunk needn't form a
+    closed surface, so the sums may be odd.  Return None if the backend
+    can't reproduce the pure Python results for these data.  Raise
+    ValueError if any point lies on one of the triangles.
+
+    """
+    triangles = _as_array(triangle_positions, (3, 3))
+    if triangles is None or points is None:
+        return None
+    arrays = _common_arrays([triangles.reshape(-1, 3), points])
+    if arrays is None:
+        return None
+    vertices, points = arrays
+    if not vertices.shape[0]:
+        return numpy.zeros(points.shape[0], dtype=numpy.int64)
+    triangles = vertices.reshape(-1, 3, 3)
+    # A single shell, and no hull prefilter.  The chunk isn't closed, so
+    # only points outside its xy footprint can be skipped: the box of the
+    # shell spans the z-range of the points as well.
+    lower = vertices.min(axis=0).reshape(1, 3)
+    upper = vertices.max(axis=0).reshape(1, 3)
+    if points.shape[0]:
+        lower[0, 2] = min(lower[0, 2], points[:, 2].min())
+        upper[0, 2] = max(upper[0, 2], points[:, 2].max())
+    surface = (
+        triangles,
+        lower,
+        upper,
+        numpy.array([[0, triangles.shape[0]]], dtype=numpy.int64),
+        numpy.zeros((0, 3, 3), dtype=vertices.dtype),
+        numpy.zeros(3, dtype=vertices.dtype),
+        numpy.zeros(3, dtype=vertices.dtype),
+        False, vertices.dtype.kind == "i",
+    )
+    totals, _ = _run(surface, points, True)
+    return totals
+
+
+def _run(surface, points, parallel):
+    """
+    Run the winding number kernel on converted arrays, returning the arrays
+    of totals and of hull rejections.  Raise ValueError if any point lies
+    on the surface.
+
+    """
+    totals = numpy.zeros(points.shape[0], dtype=numpy.int64)
+    errors = numpy.zeros(points.shape[0], dtype=numpy.int8)
+    rejected = numpy.zeros(points.shape[0], dtype=numpy.bool_)
+    kernel = _winding_totals if parallel else _winding_totals_nogil
+    kernel(surface, points, totals, errors, rejected)
+    failures = numpy.flatnonzero(errors)
+    if failures.size:
+        raise ValueError(ERROR_MESSAGES[int(errors[failures[0]])])
+    return totals, rejected
+
+
+def _common_arrays(arrays):
+    """
+    Convert arrays of points to a common kernel dtype, as winding_numbers
+    does.  Return None if that can't be done faithfully.
+
+    """
+    if any(array is None for array in arrays):
+        return None
+    if all(array.dtype.kind == "i" for array in arrays):
+        if max(numpy.abs(array).max(initial=0)
+               for array in arrays) > INT64_BOUND:
+            return None
+        return arrays
+    return [array.astype(numpy.float64) for array in arrays]
+
+
+def signs(kind, point_arrays):
+    """
+    Signs of a batch of vertices, edges or triangles, as an int8 array.
+
+    *kind* is "vertex", "edge" or "triangle", and *point_arrays* holds the
+    corresponding arrays of points P, (Q, (R,)) and O.  Zero marks a
+    degenerate case.  Return None if the backend can't reproduce the pure
+    Python results for these data.
+
+    """
+    arrays = _common_arrays(
+        [_as_array(points, (3,)) for points in point_arrays])
+    if arrays is None:
+        return None
+    out = numpy.zeros(arrays[0].shape[0], dtype=numpy.int8)
+    SIGN_KERNELS[kind](*(list(arrays) + [out]))
+    return out
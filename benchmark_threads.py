@@ -0,0 +1,85 @@
+"""
+Benchmark threaded batch winding number computations.
+
+Times Polyhedron.winding_numbers on a batch of random points for a range of
+thread counts, for each available backend, and prints the speedup relative
+to a single thread.  Run as:
+
+    python benchmark_threads.py [--points N] [--max-threads N]
+
+The "numba" backend releases the GIL, so it should scale with the number of
+cores.  The "python" backend only scales on a free-threaded build of Python.
+
+"""
+import argparse
+import random
+import timeit
+
+from polyhedron import BACKENDS, Polyhedron
+
+
+def cube_grid(n):
+    """
+    Polyhedron made up of an n x n x n grid of separated unit cubes.
+
+    """
+    corners = [(x, y, z) for x in (0, 1) for y in (0, 1) for z in (0, 1)]
+    faces = [
+        [1, 3, 2], [1, 0, 4], [1, 5, 7],
+        [2, 0, 1], [2, 6, 4], [2, 3, 7],
+        [4, 5, 1], [4, 0, 2], [4, 6, 7],
+        [7, 3, 1], [7, 6, 2], [7, 5, 4],
+    ]
+    vertex_positions = []
+    triangles = []
+    for i in range(n):
+        for j in range(n):
+            for k in range(n):
+                offset = len(vertex_positions)
+                vertex_positions.extend(
+                    (2.0 * i + x, 2.0 * j + y, 2.0 * k + z)
+                    for x, y, z in corners)
+                triangles.extend(
+                    [offset + v for v in face] for face in faces)
+    return Polyhedron(triangles=triangles, vertex_positions=vertex_positions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--points", type=int, default=20000)
+    parser.add_argument("--max-threads", type=int, default=8)
+    parser.add_argument("--grid", type=int, default=6)
+    args = parser.parse_args()
+
+    poly = cube_grid(args.grid)
+    random.seed(12345)
+    size = 2.0 * args.grid
+    points = [
+        (random.uniform(0, size), random.uniform(0, size),
+         random.uniform(0, size))
+        for _ in range(args.points)]
+
+    thread_counts = [1]
+    while thread_counts[-1] * 2 <= args.max_threads:
+        thread_counts.append(thread_counts[-1] * 2)
+
+    print("{} triangles, {} points".format(len(poly.triangles), len(points)))
+    for backend in BACKENDS:
+        # Warm up: analysis, and compilation for the numba backend.
+        expected = poly.winding_numbers(points[:100], backend=backend)
+        expected = poly.winding_numbers(points, backend=backend, threads=1)
+
+        baseline = None
+        for threads in thread_counts:
+            start = timeit.default_timer()
+            results = poly.winding_numbers(
+                points, backend=backend, threads=threads)
+            elapsed = timeit.default_timer() - start
+            assert results == expected
+            baseline = baseline or elapsed
+            print("{:>6} {:>3} threads: {:8.3f}s  speedup {:5.2f}".format(
+                backend, threads, elapsed, baseline / elapsed))
+
+
+if __name__ == "__main__":
+    main()
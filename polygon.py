@@ -1,5 +1,5 @@
-"""Simple point-in-polygon algorithm based on winding number, with robustness
-depending only on the underlying arithmetic.
+"""Simple point-in-polygon algorithm based on winding number, with exact
+predicates, so that the result is correct for any input coordinates.
 
 We've got a closed, possibly non-simple polygon described as a list of vertices
 in R^2, and we're given a point that doesn't lie directly on the path of the
@@ -8,7 +8,8 @@ point.
 
 There are two sources of difficulty: (1) dealing with numerical errors that
 might result in an incorrect answer, and (2) dealing with degenerate cases.
-We'll ignore the numerical issues for the moment.
+The numerical errors are dealt with by computing every decision exactly (see
+"Exact predicates" below), so for now we concentrate on the degenerate cases.
 
 Strategy: without loss of generality, let's place the point at the origin.
 Divide the remainder of the plane (i.e., R^2 minus the origin) into two
@@ -30,7 +31,33 @@ we also need to compute whether the edge passes *above* or *below* the origin,
 to compute its contribution to the total winding number.  From the comment
 above, we can safely ignore all edges that lie entirely within either L or R.
 
+Exact predicates
+----------------
+Both decisions above are made exactly, whatever the input types.  Vertex
+classification uses direct comparisons, which Python performs exactly even
+between floats and Fractions.  The edge test is the sign of a 2x2
+determinant.  For integer coordinates (including NumPy integers) it's
+computed in Python's unbounded integers, so it can't overflow.  For float
+coordinates it's first evaluated in floating-point and checked against a
+rigorous error bound; only when the bound can't certify the sign is it
+recomputed in exact rational arithmetic.  The module-level dictionary
+predicate_counts records how often the filter succeeds and how often the
+exact fallback is needed.
+
 """
+import array
+import fractions
+import math
+import numbers
+import struct
+import sys
+
+from processes import process_pool
+
+try:
+    import _polygon_numba
+except ImportError:
+    _polygon_numba = None
 
 
 def sign(x):
@@ -46,21 +73,149 @@ def sign(x):
         return 0
 
 
+def exact(x):
+    """
+    Convert x to an int or Fraction with exactly the same value.
+
+    """
+    if isinstance(x, numbers.Integral):
+        return int(x)
+    return fractions.Fraction(x)
+
+
+# Error bound for the floating-point evaluation of the determinant in
+# orientation, from Shewchuk's "Adaptive Precision Floating-Point Arithmetic
+# and Fast Robust Geometric Predicates".  It assumes that no intermediate
+# result underflows, so the filter isn't trusted for tiny values.
+EPSILON = 2.0 ** -53
+ORIENTATION_ERROR_BOUND = (3.0 + 16.0 * EPSILON) * EPSILON
+UNDERFLOW_GUARD = 2.0 ** -900
+
+# Number of float determinants whose sign was certified by the error bound
+# ("filtered"), and number that needed the exact fallback ("exact").
+predicate_counts = {"filtered": 0, "exact": 0}
+
+
+def reset_predicate_counts():
+    """
+    Reset the counts in predicate_counts to zero.
+
+    """
+    for key in predicate_counts:
+        predicate_counts[key] = 0
+
+
+def orientation(P, Q, O):
+    """
+    Sign of (P[0] - O[0]) * (Q[1] - O[1]) - (P[1] - O[1]) * (Q[0] - O[0]).
+
+    The sign is computed exactly; see "Exact predicates" above.
+
+    """
+    coordinates = P[0], P[1], Q[0], Q[1], O[0], O[1]
+    if all(isinstance(c, float) for c in coordinates):
+        left = (P[0] - O[0]) * (Q[1] - O[1])
+        right = (P[1] - O[1]) * (Q[0] - O[0])
+        bound = ORIENTATION_ERROR_BOUND * (abs(left) + abs(right))
+        result = left - right
+        if bound > UNDERFLOW_GUARD and abs(result) > bound:
+            predicate_counts["filtered"] += 1
+            return sign(result)
+        predicate_counts["exact"] += 1
+    px, py, qx, qy, ox, oy = [exact(c) for c in coordinates]
+    return sign((px - ox) * (qy - oy) - (py - oy) * (qx - ox))
+
+
+def compare(a, b):
+    """
+    Return 1 if a > b, -1 if a < b, and 0 if they're equal.
+
+    """
+    if a > b:
+        return 1
+    elif a < b:
+        return -1
+    else:
+        return 0
+
+
 def vertex_sign(P, O):
-    result = sign(P[0] - O[0]) or sign(P[1] - O[1])
+    result = compare(P[0], O[0]) or compare(P[1], O[1])
     if not result:
         raise ValueError("vertex coincides with origin")
     return result
 
 
 def edge_sign(P, Q, O):
-    result = sign(
-        (P[0] - O[0]) * (Q[1] - O[1]) - (P[1] - O[1]) * (Q[0] - O[0]))
+    result = orientation(P, Q, O)
     if not result:
         raise ValueError("vertices collinear with origin")
     return result
 
 
+def _check_lengths(*point_arrays):
+    """
+    Return the common length of the point arrays, or raise ValueError.
+
+    """
+    count = len(point_arrays[0])
+    if any(len(points) != count for points in point_arrays):
+        raise ValueError("point arrays have different lengths")
+    return count
+
+
+def vertex_signs(P, O):
+    """
+    Signs of the vertices P[i] with respect to the points O[i].
+
+    *P* and *O* are sequences (or (N, 2) arrays) of points of equal length.
+    Return an array.array of int8 values, computed as by vertex_sign, except
+    that a vertex coinciding with its origin gives 0 instead of raising.
+    If Numba is available, int64 and float64 data are handled by a compiled
+    kernel.
+
+    """
+    count = _check_lengths(P, O)
+    if _polygon_numba is not None:
+        signs = _polygon_numba.vertex_signs(P, O)
+        if signs is not None:
+            return array.array("b", signs.tobytes())
+    result = array.array("b", [0]) * count
+    for i, (p, o) in enumerate(zip(P, O)):
+        result[i] = compare(p[0], o[0]) or compare(p[1], o[1])
+    return result
+
+
+def edge_signs(P, Q, O):
+    """
+    Signs of the edges P[i]Q[i] with respect to the points O[i].
+
+    As vertex_signs, but computed exactly as by edge_sign; 0 marks an edge
+    collinear with its origin.  The compiled kernel applies the same error
+    bound as orientation to float64 data, and the signs it can't certify
+    are recomputed exactly by orientation.
+
+    """
+    count = _check_lengths(P, Q, O)
+    if _polygon_numba is not None:
+        converted = _polygon_numba.edge_signs(P, Q, O)
+        if converted is not None:
+            signs, floats = converted
+            result = array.array("b", signs.tobytes())
+            uncertain = [
+                int(i) for i in
+                (signs == _polygon_numba.UNCERTAIN).nonzero()[0]]
+            if floats:
+                predicate_counts["filtered"] += count - len(uncertain)
+            for i in uncertain:
+                result[i] = orientation(P[i], Q[i], O[i])
+            return result
+    result = array.array("b", [0]) * count
+    for i, (p, q, o) in enumerate(zip(P, Q, O)):
+        result[i] = orientation(p, q, o)
+    return result
+
+
 def half_turn(point1, point2, origin):
     """
     Return the contribution to the total winding number about 'origin' from a
@@ -83,15 +238,49 @@ class Polygon(object):
         """
         Pairs of vertex positions corresponding to the polygon edges.
 
+        The vertices are accessed by index, so the vertex positions (which
+        may be a list, or an (N, 2) NumPy array) are never copied.
+
         """
         points = self.vertex_positions
         first_point = previous_point = points[0]
-        for point in points[1:]:
+        for i in range(1, len(points)):
+            point = points[i]
             yield previous_point, point
             previous_point = point
         yield previous_point, first_point
 
-    def area(self):
+    def _moments(self, exact_arithmetic):
+        """
+        Twice the signed area, and six times its first moments about
+        vertical and horizontal lines through the first vertex, accumulated
+        in a single pass over the edges.
+
+        Working relative to the first vertex keeps the floating-point
+        computation accurate for polygons far from the origin.  Return
+        those four values and the first vertex.
+
+        """
+        x0, y0 = self.vertex_positions[0][0], self.vertex_positions[0][1]
+        if exact_arithmetic:
+            x0, y0 = exact(x0), exact(y0)
+            edges = (
+                ((exact(p1[0]), exact(p1[1])), (exact(p2[0]), exact(p2[1])))
+                for p1, p2 in self.edge_positions())
+            area = x_moment = y_moment = 0
+        else:
+            edges = self.edge_positions()
+            area = x_moment = y_moment = 0.0
+        for p1, p2 in edges:
+            x1, y1 = p1[0] - x0, p1[1] - y0
+            x2, y2 = p2[0] - x0, p2[1] - y0
+            cross = x1 * y2 - x2 * y1
+            area += cross
+            x_moment += (x1 + x2) * cross
+            y_moment += (y1 + y2) * cross
+        return area, x_moment, y_moment, (x0, y0)
+
+    def area(self, exact=False):
         """
         Area enclosed by this polygon.
 
@@ -99,11 +288,41 @@ class Polygon(object):
         enclosed by the polygon.  More generally, return the integral
         of the winding number of the polygon over R^2.
 
+        If *exact* is true, the area is computed in exact arithmetic and
+        returned as a Fraction; that's appropriate for integer or Fraction
+        coordinates.
+
+        """
+        area = self._moments(exact)[0]
+        return fractions.Fraction(area, 2) if exact else area / 2.0
+
+    def centroid(self, exact=False):
+        """
+        Centroid of the region enclosed by this polygon, as a pair (x, y).
+
+        More generally, the centroid of the winding number of the polygon
+        regarded as a density on R^2.  If *exact* is true, the centroid is
+        computed in exact arithmetic, as for area.  Raise ValueError if the
+        area is zero.
+
+        """
+        area, x_moment, y_moment, (x0, y0) = self._moments(exact)
+        if not area:
+            raise ValueError("polygon has zero area")
+        if exact:
+            return (x0 + fractions.Fraction(x_moment, 3 * area),
+                    y0 + fractions.Fraction(y_moment, 3 * area))
+        return (x0 + x_moment / (3.0 * area),
+                y0 + y_moment / (3.0 * area))
+
+    def perimeter(self):
         """
-        acc = 0.0
-        for p1, p2 in self.edge_positions():
-            acc += (p1[0] - p2[0]) * (p1[1] + p2[1])
-        return acc / 2.0
+        Total length of the edges of this polygon.
+
+        """
+        return math.fsum(
+            math.hypot(p2[0] - p1[0], p2[1] - p1[1])
+            for p1, p2 in self.edge_positions())
 
     def winding_number(self, origin):
         """
@@ -118,3 +337,304 @@ class Polygon(object):
             half_turn(point1, point2, origin)
             for point1, point2 in self.edge_positions()
         ) // 2
+
+
+def _pack_boxes(boxes, capacity):
+    """
+    Group boxes for a packed R-tree, using Sort-Tile-Recursive packing.
+
+    *boxes* is a list of (xmin, ymin, xmax, ymax) tuples.  Return a list of
+    groups of at most *capacity* indices into *boxes*, with boxes in the
+    same group close to one another.
+
+    """
+    group_count = -(-len(boxes) // capacity)
+    slice_size = capacity * max(1, int(math.ceil(math.sqrt(group_count))))
+    order = sorted(
+        range(len(boxes)), key=lambda i: boxes[i][0] + boxes[i][2])
+    groups = []
+    for start in range(0, len(order), slice_size):
+        part = sorted(
+            order[start:start + slice_size],
+            key=lambda i: boxes[i][1] + boxes[i][3])
+        for group_start in range(0, len(part), capacity):
+            groups.append(part[group_start:group_start + capacity])
+    return groups
+
+
+def _union(boxes):
+    """
+    Smallest box containing all of the given boxes.
+
+    """
+    return (
+        min(box[0] for box in boxes), min(box[1] for box in boxes),
+        max(box[2] for box in boxes), max(box[3] for box in boxes))
+
+
+# Identifies the on-disk format written by PolygonLayer.save.
+LAYER_MAGIC = b"PYPLAYR1"
+LAYER_HEADER = struct.Struct("<8sqqqq")
+
+
+def _int64_typecode():
+    """
+    An array typecode for 64-bit signed integers.
+
+    The "q" typecode is missing on Python 2, where "l" is 64 bits wide on
+    LP64 platforms.  Elsewhere "l" is the widest type available, and layer
+    files written there can't be read on other platforms.
+
+    """
+    for typecode in ("q", "l"):
+        try:
+            if array.array(typecode).itemsize == 8:
+                return typecode
+        except ValueError:
+            pass
+    return "l"
+
+
+# Typecode of the integer arrays of a PolygonLayer.
+INDEX_TYPECODE = _int64_typecode()
+
+
+# The polygon layer used by worker processes in PolygonLayer.containing_batch.
+_worker_layer = None
+
+
+def _set_worker_layer(layer):
+    """
+    Initializer for worker processes: record the layer to be queried.
+
+    """
+    global _worker_layer
+    _worker_layer = layer
+
+
+def _worker_containing(points):
+    """
+    Query a chunk of points against the worker's layer.
+
+    """
+    return [_worker_layer.containing(point) for point in points]
+
+
+class PolygonLayer(object):
+    def __init__(self, polygons, node_capacity=16):
+        """
+        Initialize from a collection of polygons.
+
+        *polygons* is an iterable of Polygon objects, or of sequences of
+        vertex positions; polygon ids are positions in this iterable.  The
+        vertices of all the polygons are stored as float64 values in shared
+        ragged arrays, and a packed R-tree with nodes of up to
+        *node_capacity* entries is built over the polygon bounding boxes.
+
+        """
+        self.offsets = array.array(INDEX_TYPECODE, [0])
+        self.coordinates = array.array("d")
+        self.boxes = array.array("d")
+        for polygon in polygons:
+            if isinstance(polygon, Polygon):
+                polygon = polygon.vertex_positions
+            vertices = [(float(x), float(y)) for x, y in polygon]
+            if not vertices:
+                raise ValueError("polygon has no vertices")
+            for vertex in vertices:
+                self.coordinates.extend(vertex)
+            self.offsets.append(self.offsets[-1] + len(vertices))
+            xs, ys = zip(*vertices)
+            self.boxes.extend((min(xs), min(ys), max(xs), max(ys)))
+        self._build_tree(node_capacity)
+
+    def _build_tree(self, capacity):
+        """
+        Build the packed R-tree over the polygon bounding boxes.
+
+        The tree is stored in flat arrays.  Node i has bounding box
+        node_boxes[4*i:4*i+4] and children given by the range
+        node_ranges[2*i:2*i+2].  Nodes below leaf_count are leaves, whose
+        ranges index items, the polygon ids in leaf order; other nodes'
+        ranges index nodes.  The root is the last node.
+
+        """
+        self.items = array.array(INDEX_TYPECODE)
+        self.node_boxes = array.array("d")
+        self.node_ranges = array.array(INDEX_TYPECODE)
+
+        # Pending nodes of the current level, as pairs (box, range); they're
+        # emitted in the order of their parents' groups, so that the
+        # children of each parent are contiguous.
+        boxes = [
+            tuple(self.boxes[4 * i:4 * i + 4]) for i in range(len(self))]
+        pending = []
+        for group in _pack_boxes(boxes, capacity):
+            start = len(self.items)
+            self.items.extend(group)
+            pending.append((
+                _union([boxes[i] for i in group]),
+                (start, len(self.items))))
+        self.leaf_count = len(pending)
+        while len(pending) > 1:
+            parents = []
+            for group in _pack_boxes([box for box, _ in pending], capacity):
+                start = len(self.node_ranges) // 2
+                for i in group:
+                    self._append_node(*pending[i])
+                parents.append((
+                    _union([pending[i][0] for i in group]),
+                    (start, start + len(group))))
+            pending = parents
+        for node in pending:
+            self._append_node(*node)
+
+    def _append_node(self, box, children):
+        self.node_boxes.extend(box)
+        self.node_ranges.extend(children)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def polygon(self, polygon_id):
+        """
+        The polygon with the given id.
+
+        """
+        start = self.offsets[polygon_id]
+        stop = self.offsets[polygon_id + 1]
+        coordinates = self.coordinates
+        return Polygon([
+            (coordinates[2 * k], coordinates[2 * k + 1])
+            for k in range(start, stop)])
+
+    def winding_number(self, polygon_id, origin):
+        """
+        Winding number of the polygon with the given id around a point.
+
+        Raise ValueError if the point lies directly on the path of the
+        polygon.
+
+        """
+        start = self.offsets[polygon_id]
+        stop = self.offsets[polygon_id + 1]
+        coordinates = self.coordinates
+        previous = coordinates[2 * stop - 2], coordinates[2 * stop - 1]
+        total = 0
+        for k in range(start, stop):
+            point = coordinates[2 * k], coordinates[2 * k + 1]
+            total += half_turn(previous, point, origin)
+            previous = point
+        return total // 2
+
+    def containing(self, point):
+        """
+        Ids of the polygons with nonzero winding number around a point.
+
+        Return a sorted list.  Raise ValueError if the point lies directly
+        on the path of one of the polygons whose bounding box contains it.
+
+        """
+        x, y = point[0], point[1]
+        node_boxes, node_ranges = self.node_boxes, self.node_ranges
+        boxes = self.boxes
+        found = []
+        stack = [len(node_ranges) // 2 - 1] if node_ranges else []
+        while stack:
+            node = stack.pop()
+            if not (node_boxes[4 * node] <= x <= node_boxes[4 * node + 2] and
+                    node_boxes[4 * node + 1] <= y <= node_boxes[4 * node + 3]):
+                continue
+            start, stop = node_ranges[2 * node], node_ranges[2 * node + 1]
+            if node >= self.leaf_count:
+                stack.extend(range(start, stop))
+                continue
+            for i in self.items[start:stop]:
+                if (boxes[4 * i] <= x <= boxes[4 * i + 2] and
+                        boxes[4 * i + 1] <= y <= boxes[4 * i + 3] and
+                        self.winding_number(i, point)):
+                    found.append(i)
+        return sorted(found)
+
+    def containing_batch(self, points, processes=None, chunk_size=10000):
+        """
+        Ids of the polygons containing each of the points, as for containing.
+
+        If *processes* is given and greater than 1, the points are split
+        into chunks of *chunk_size* points, which are shared between that
+        many worker processes, each holding its own copy of the layer.
+        Where workers are spawned rather than forked, a calling script
+        needs an ``if __name__ == "__main__":`` guard; see the processes
+        module.
+
+        """
+        if processes is None or processes <= 1:
+            return [self.containing(point) for point in points]
+        points = list(points)
+        chunks = [
+            points[start:start + chunk_size]
+            for start in range(0, len(points), chunk_size)]
+        pool = process_pool(
+            processes, initializer=_set_worker_layer, initargs=(self,))
+        try:
+            results = pool.map(_worker_containing, chunks)
+        finally:
+            pool.close()
+            pool.join()
+        return [ids for chunk in results for ids in chunk]
+
+    def _arrays(self):
+        """
+        The arrays making up the layer, in the order they're saved.
+
+        """
+        return [
+            self.offsets, self.coordinates, self.boxes, self.items,
+            self.node_boxes, self.node_ranges]
+
+    def save(self, path):
+        """
+        Write the layer to a file in a compact binary format.
+
+        The file holds a fixed header followed by the raw little-endian
+        contents of the layer's arrays, so that loading needs no parsing.
+
+        """
+        with open(path, "wb") as f:
+            f.write(LAYER_HEADER.pack(
+                LAYER_MAGIC, len(self), len(self.coordinates) // 2,
+                len(self.node_ranges) // 2, self.leaf_count))
+            for values in self._arrays():
+                if sys.byteorder == "big":
+                    values = array.array(values.typecode, values)
+                    values.byteswap()
+                values.tofile(f)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a layer written by save.
+
+        """
+        layer = cls.__new__(cls)
+        with open(path, "rb") as f:
+            magic, polygon_count, vertex_count, node_count, leaf_count = (
+                LAYER_HEADER.unpack(f.read(LAYER_HEADER.size)))
+            if magic != LAYER_MAGIC:
+                raise ValueError("not a polygon layer file")
+            layer.leaf_count = leaf_count
+            sizes = [
+                ("offsets", INDEX_TYPECODE, polygon_count + 1),
+                ("coordinates", "d", 2 * vertex_count),
+                ("boxes", "d", 4 * polygon_count),
+                ("items", INDEX_TYPECODE, polygon_count),
+                ("node_boxes", "d", 4 * node_count),
+                ("node_ranges", INDEX_TYPECODE, 2 * node_count),
+            ]
+            for name, typecode, size in sizes:
+                values = array.array(typecode)
+                values.fromfile(f, size)
+                if sys.byteorder == "big":
+                    values.byteswap()
+                setattr(layer, name, values)
+        return layer
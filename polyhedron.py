@@ -222,6 +222,41 @@ in second homology, we end up with (winding number)*([U] + [D]).
 
 """
 
+import array
+import bisect
+import fractions
+import heapq
+import itertools
+import math
+import numbers
+import os
+import random
+import shutil
+import struct
+import tempfile
+import threading
+
+from polygon import Polygon, compare, exact, orientation
+from processes import process_pool
+
+try:
+    import _polyhedron_numba
+except ImportError:
+    _polyhedron_numba = None
+
+# Backends available for batch winding number computations.  The pure Python
+# backend is the reference implementation; the optional Numba backend gives
+# identical results, and is used by default when it's available.
+BACKENDS = ("python",) if _polyhedron_numba is None else ("python", "numba")
+DEFAULT_BACKEND = BACKENDS[-1]
+
+# Classification of points lying on the surface, returned by classify.
+ON_SURFACE = "on surface"
+
+# Number of int64 results that fit in a typical 64-byte cache line.  Batches
+# split between threads are cut into chunks of a multiple of this size.
+CACHE_LINE_ITEMS = 8
+
 
 def sign(x):
     """
@@ -282,11 +317,126 @@ def triangle_sign(P, Q, R, O):
     return result
 
 
-def triangle_chain(v1, v2, v3, origin):
+def _sign_array(kind, point_arrays):
+    """
+    Shared implementation of vertex_signs, edge_signs and triangle_signs.
+
+    """
+    point_arrays = [
+        points if hasattr(points, "__len__") else list(points)
+        for points in point_arrays]
+    count = len(point_arrays[0])
+    if any(len(points) != count for points in point_arrays):
+        raise ValueError("point arrays have different lengths")
+    if _polyhedron_numba is not None:
+        result = _polyhedron_numba.signs(kind, point_arrays)
+        if result is not None:
+            return array.array("b", result.tobytes())
+
+    result = array.array("b", [0]) * count
+    if kind == "vertex":
+        for i, (P, O) in enumerate(zip(*point_arrays)):
+            result[i] = (
+                sign(P[0] - O[0]) or sign(P[1] - O[1]) or sign(P[2] - O[2]))
+    elif kind == "edge":
+        for i, (P, Q, O) in enumerate(zip(*point_arrays)):
+            result[i] = (
+                sign((P[1] - O[1]) * (Q[0] - O[0]) -
+                     (P[0] - O[0]) * (Q[1] - O[1])) or
+                sign((P[2] - O[2]) * (Q[0] - O[0]) -
+                     (P[0] - O[0]) * (Q[2] - O[2])) or
+                sign((P[2] - O[2]) * (Q[1] - O[1]) -
+                     (P[1] - O[1]) * (Q[2] - O[2])))
+    else:
+        for i, (P, Q, R, O) in enumerate(zip(*point_arrays)):
+            result[i] = sign(determinant(P, Q, R, O))
+    return result
+
+
+def vertex_signs(P, O):
+    """
+    Signs of the vertices P[i] with respect to the points O[i].
+
+    *P* and *O* are sequences (or (N, 3) arrays) of points of equal length.
+    Return an array.array of int8 values, computed as by vertex_sign, except
+    that a vertex coinciding with its origin gives 0 instead of raising.
+
+    """
+    return _sign_array("vertex", (P, O))
+
+
+def edge_signs(P, Q, O):
+    """
+    Signs of the edges P[i]Q[i] with respect to the points O[i].
+
+    As vertex_signs, but computed as by edge_sign, with the same ordering
+    of minors; 0 marks an edge collinear with its origin.
+
+    """
+    return _sign_array("edge", (P, Q, O))
+
+
+def triangle_signs(P, Q, R, O):
+    """
+    Signs of the triangles P[i]Q[i]R[i] with respect to the points O[i].
+
+    As vertex_signs, but computed as by triangle_sign; 0 marks a triangle
+    coplanar with its origin.
+
+    """
+    return _sign_array("triangle", (P, Q, R, O))
+
+
+def _squared_distance_to_segment(P, Q, O):
+    """
+    Squared distance from O to the segment PQ.
+
+    """
+    d = [Q[i] - P[i] for i in range(3)]
+    w = [O[i] - P[i] for i in range(3)]
+    length = sum(c * c for c in d)
+    t = 0 if not length else max(0, min(1, divide(
+        sum(d[i] * w[i] for i in range(3)), length)))
+    return sum((w[i] - t * d[i]) ** 2 for i in range(3))
+
+
+def squared_distance_to_triangle(P, Q, R, O):
+    """
+    Squared distance from the point O to the (closed) triangle PQR.
+
+    """
+    u = [Q[i] - P[i] for i in range(3)]
+    v = [R[i] - P[i] for i in range(3)]
+    w = [O[i] - P[i] for i in range(3)]
+    n = [u[1] * v[2] - u[2] * v[1],
+         u[2] * v[0] - u[0] * v[2],
+         u[0] * v[1] - u[1] * v[0]]
+    norm = sum(c * c for c in n)
+    if norm:
+        # Barycentric coordinates of the projection of O onto the plane.
+        beta = (
+            (w[1] * v[2] - w[2] * v[1]) * n[0] +
+            (w[2] * v[0] - w[0] * v[2]) * n[1] +
+            (w[0] * v[1] - w[1] * v[0]) * n[2])
+        gamma = (
+            (u[1] * w[2] - u[2] * w[1]) * n[0] +
+            (u[2] * w[0] - u[0] * w[2]) * n[1] +
+            (u[0] * w[1] - u[1] * w[0]) * n[2])
+        if beta >= 0 and gamma >= 0 and beta + gamma <= norm:
+            height = sum(w[i] * n[i] for i in range(3))
+            return divide(height * height, norm)
+    return min(
+        _squared_distance_to_segment(P, Q, O),
+        _squared_distance_to_segment(Q, R, O),
+        _squared_distance_to_segment(R, P, O))
+
+
+def triangle_chain(v1, v2, v3, origin, plane=None):
     """
     Return the contribution of this triangle to the winding number.
 
-    Raise ValueError if the face contains the origin.
+    Raise ValueError if the face contains the origin.  *plane*, if given,
+    is the triangle_plane of the triangle, used to compute its sign.
 
     """
     v1sign = vertex_sign(v1, origin)
@@ -303,43 +453,1952 @@ def triangle_chain(v1, v2, v3, origin):
     if not face_boundary:
         return 0
 
+    if plane is not None:
+        return plane_triangle_sign(v1, v2, v3, plane, origin)
     return triangle_sign(v1, v2, v3, origin)
 
 
-class Polyhedron(object):
-    def __init__(self, triangles, vertex_positions):
-        """
-        Initialize from list of triangles and vertex positions.
+# Error bounds for the floating-point evaluation of the edge and triangle
+# sign expressions, from Shewchuk's "Adaptive Precision Floating-Point
+# Arithmetic and Fast Robust Geometric Predicates".  They assume that no
+# intermediate result underflows, so the filter isn't trusted for tiny
+# values.
+EPSILON = 2.0 ** -53
+EDGE_ERROR_BOUND = (3.0 + 16.0 * EPSILON) * EPSILON
+TRIANGLE_ERROR_BOUND = (7.0 + 56.0 * EPSILON) * EPSILON
+UNDERFLOW_GUARD = 2.0 ** -900
 
-        """
-        # Validate: check the combinatorial data.
-        edges = set()
-        vertices = set()
-        for triangle in triangles:
-            vertices.update(triangle)
-            P, Q, R = triangle
+
+# Largest magnitude of an int that converts exactly to float.
+FLOAT_INT_BOUND = 2 ** 53
+
+
+def _filterable(*points):
+    """
+    Return True if all the coordinates of the points are floats, or ints
+    that convert to float exactly, so that floating-point evaluation of the
+    predicates is covered by the error bounds.
+
+    """
+    for point in points:
+        for c in point:
+            if not (isinstance(c, float) or (
+                    type(c) is int and
+                    -FLOAT_INT_BOUND <= c <= FLOAT_INT_BOUND)):
+                return False
+    return True
+
+
+def _filtered_minor(P, Q, O, i, j):
+    """
+    Sign of (P[i] - O[i]) * (Q[j] - O[j]) - (P[j] - O[j]) * (Q[i] - O[i]).
+
+    """
+    if _filterable(P, Q, O):
+        left = (P[i] - O[i]) * (Q[j] - O[j])
+        right = (P[j] - O[j]) * (Q[i] - O[i])
+        bound = EDGE_ERROR_BOUND * (abs(left) + abs(right))
+        result = left - right
+        if bound > UNDERFLOW_GUARD and abs(result) > bound:
+            return sign(result)
+    P, Q, O = [[exact(c) for c in point] for point in (P, Q, O)]
+    return sign(
+        (P[i] - O[i]) * (Q[j] - O[j]) - (P[j] - O[j]) * (Q[i] - O[i]))
+
+
+def filtered_edge_sign(P, Q, O):
+    """
+    Sign of the edge PQ with respect to O, computed exactly.
+
+    Like edge_sign, but for float coordinates (and ints that convert to
+    float exactly) the expressions are evaluated in floating-point and the
+    result is checked against a rigorous error bound, falling back to exact
+    arithmetic only when the sign is in doubt.  Other coordinates are
+    handled exactly throughout.
+
+    """
+    result = (
+        _filtered_minor(P, Q, O, 1, 0) or
+        _filtered_minor(P, Q, O, 2, 0) or
+        _filtered_minor(P, Q, O, 2, 1)
+    )
+    if not result:
+        raise ValueError("vertices collinear with origin")
+    return result
+
+
+def filtered_orientation(P, Q, R, O):
+    """
+    Sign of determinant(P, Q, R, O), computed exactly.
+
+    Float coordinates are filtered as for filtered_edge_sign.
+
+    """
+    result = _orientation_filter(P, Q, R, O)
+    if result is None:
+        result = sign(determinant(
+            *[[exact(c) for c in point] for point in (P, Q, R, O)]))
+    return result
+
+
+def _orientation_filter(P, Q, R, O):
+    """
+    Sign of determinant(P, Q, R, O) if floating-point evaluation certifies
+    it, and None otherwise.
+
+    """
+    if _filterable(P, Q, R, O):
+        m1_0 = P[0] - O[0]
+        m1_1 = P[1] - O[1]
+        m1_2 = P[2] - O[2]
+        m2_0 = Q[0] - O[0]
+        m2_1 = Q[1] - O[1]
+        m2_2 = Q[2] - O[2]
+        m3_0 = R[0] - O[0]
+        m3_1 = R[1] - O[1]
+        m3_2 = R[2] - O[2]
+        result = (
+            (m1_0 * m2_1 - m1_1 * m2_0) * m3_2 +
+            (m2_0 * m3_1 - m2_1 * m3_0) * m1_2 +
+            (m3_0 * m1_1 - m3_1 * m1_0) * m2_2)
+        permanent = (
+            (abs(m1_0 * m2_1) + abs(m1_1 * m2_0)) * abs(m3_2) +
+            (abs(m2_0 * m3_1) + abs(m2_1 * m3_0)) * abs(m1_2) +
+            (abs(m3_0 * m1_1) + abs(m3_1 * m1_0)) * abs(m2_2))
+        bound = TRIANGLE_ERROR_BOUND * permanent
+        if bound > UNDERFLOW_GUARD and abs(result) > bound:
+            return sign(result)
+    return None
+
+
+def filtered_triangle_sign(P, Q, R, O):
+    """
+    Sign of the triangle PQR with respect to O, computed exactly.
+
+    """
+    result = filtered_orientation(P, Q, R, O)
+    if not result:
+        raise ValueError("vertices coplanar with origin")
+    return result
+
+
+def filtered_triangle_chain(v1, v2, v3, origin, plane=None):
+    """
+    Like triangle_chain, but with all signs computed exactly.
+
+    Vertex signs come from direct comparisons, which are exact even for a
+    mixture of floats and other numbers; edge and triangle signs come from
+    the filtered predicates.
+
+    """
+    v1sign = v2sign = v3sign = 0
+    for i in range(3):
+        v1sign = v1sign or compare(v1[i], origin[i])
+        v2sign = v2sign or compare(v2[i], origin[i])
+        v3sign = v3sign or compare(v3[i], origin[i])
+    if not v1sign or not v2sign or not v3sign:
+        raise ValueError("vertex coincides with origin")
+
+    face_boundary = 0
+    if v1sign != v2sign:
+        face_boundary += filtered_edge_sign(v1, v2, origin)
+    if v2sign != v3sign:
+        face_boundary += filtered_edge_sign(v2, v3, origin)
+    if v3sign != v1sign:
+        face_boundary += filtered_edge_sign(v3, v1, origin)
+    if not face_boundary:
+        return 0
+
+    if plane is not None:
+        return plane_triangle_sign(
+            v1, v2, v3, plane, origin, filtered_triangle_sign)
+    return filtered_triangle_sign(v1, v2, v3, origin)
+
+
+# For a fixed triangle PQR, the determinant computed by triangle_sign is an
+# affine function of O: it's n.(P - O), where n = (Q - P) x (R - P) is a
+# normal to the triangle.  So with n computed once per triangle, each
+# triangle sign costs a single dot product.  For floats, the dot product is
+# computed in floating-point, and its sign is trusted only when it exceeds
+# PLANE_ERROR_BOUND * (extent + distance)**3, where extent is the largest
+# coordinate difference between vertices of the triangle, and distance the
+# sum of the absolute values of the coordinates of P - O.  That bound
+# covers both the error of the dot product and the error bound for the
+# direct evaluation of the determinant, so a trusted sign is the sign that
+# triangle_sign (or filtered_triangle_sign) would give.
+PLANE_ERROR_BOUND = 2.0 ** -42
+
+# Types of exact numbers that plane_sign can use without conversion.
+EXACT_TYPES = tuple(set([int, type(2 ** 64), fractions.Fraction]))
+
+
+def triangle_plane(P, Q, R):
+    """
+    Normal and offset of the plane of a triangle, for plane_sign.
+
+    Return a pair (exact_plane, float_plane).  exact_plane is a tuple
+    (n0, n1, n2, d), with d = n.P, of ints or Fractions if all the
+    coordinates are rational, and None otherwise.  float_plane is a tuple
+    (P0, P1, P2, n0, n1, n2, extent) of floats, or None if the coordinates
+    can't be converted to float.  Return None for coordinates of other
+    types.
+
+    """
+    coordinates = tuple(P) + tuple(Q) + tuple(R)
+    if all(isinstance(c, numbers.Rational) for c in coordinates):
+        exact_plane = _plane_normal(*[exact(c) for c in coordinates])
+        exact_plane += (sum(
+            n * exact(c) for n, c in zip(exact_plane, coordinates)),)
+    elif all(isinstance(c, (float, numbers.Rational)) for c in coordinates):
+        exact_plane = None
+    else:
+        return None
+    try:
+        floats = [float(c) for c in coordinates]
+    except OverflowError:
+        float_plane = None
+    else:
+        extent = max(
+            abs(floats[i] - floats[j])
+            for i in range(3) for j in (i + 3, i + 6))
+        float_plane = (
+            tuple(floats[:3]) + _plane_normal(*floats) + (extent,))
+    return exact_plane, float_plane
+
+
+def _plane_normal(P0, P1, P2, Q0, Q1, Q2, R0, R1, R2):
+    """
+    Normal (Q - P) x (R - P) to a triangle, as a tuple.
+
+    """
+    a0, a1, a2 = Q0 - P0, Q1 - P1, Q2 - P2
+    b0, b1, b2 = R0 - P0, R1 - P1, R2 - P2
+    return a1 * b2 - a2 * b1, a2 * b0 - a0 * b2, a0 * b1 - a1 * b0
+
+
+def plane_sign(plane, O):
+    """
+    Sign of determinant(P, Q, R, O), from the triangle_plane of PQR.
+
+    The result is exact, and agrees with triangle_sign, except that zero is
+    returned rather than raising ValueError.  Return None if the sign can't
+    be certified from the plane data, in which case it should be computed
+    directly.
+
+    """
+    if plane is None:
+        return None
+    exact_plane, float_plane = plane
+    o0, o1, o2 = O[0], O[1], O[2]
+    if exact_plane is not None and not (
+            isinstance(o0, float) or isinstance(o1, float) or
+            isinstance(o2, float)):
+        if not (type(o0) in EXACT_TYPES and type(o1) in EXACT_TYPES and
+                type(o2) in EXACT_TYPES):
+            if not all(isinstance(c, numbers.Rational) for c in O):
+                return None
+            o0, o1, o2 = exact(o0), exact(o1), exact(o2)
+        n0, n1, n2, d = exact_plane
+        return sign(d - (n0 * o0 + n1 * o1 + n2 * o2))
+    if float_plane is None:
+        return None
+    # Subtracting other numbers from floats converts them to float first,
+    # just as in triangle_sign.
+    p0, p1, p2, n0, n1, n2, extent = float_plane
+    m0, m1, m2 = p0 - o0, p1 - o1, p2 - o2
+    value = n0 * m0 + n1 * m1 + n2 * m2
+    scale = extent + abs(m0) + abs(m1) + abs(m2)
+    bound = PLANE_ERROR_BOUND * scale * scale * scale
+    if bound > UNDERFLOW_GUARD and abs(value) > bound:
+        return 1 if value > 0 else -1
+    return None
+
+
+def plane_triangle_sign(P, Q, R, plane, O, fallback=triangle_sign):
+    """
+    Sign of the triangle PQR with respect to O, using its triangle_plane.
+
+    Signs that can't be certified from the plane data are computed with
+    *fallback*, which should be triangle_sign or filtered_triangle_sign.
+
+    """
+    result = plane_sign(plane, O)
+    if result is None:
+        return fallback(P, Q, R, O)
+    if not result:
+        raise ValueError("vertices coplanar with origin")
+    return result
+
+
+def divide(a, b):
+    """
+    Quotient a / b, computed exactly if a and b are both rational.
+
+    """
+    if isinstance(a, numbers.Rational) and isinstance(b, numbers.Rational):
+        return fractions.Fraction(exact(a)) / exact(b)
+    return a / b
+
+
+def shells(triangles):
+    """
+    Partition triangles into edge-connected shells.
+
+    Return a list of lists of triangle indices.  For a valid surface, each
+    shell is itself a closed surface.
+
+    """
+    edge_triangle = {}
+    for index, (P, Q, R) in enumerate(triangles):
+        for edge in ((P, Q), (Q, R), (R, P)):
+            edge_triangle[edge] = index
+
+    seen = [False] * len(triangles)
+    components = []
+    for start in range(len(triangles)):
+        if seen[start]:
+            continue
+        seen[start] = True
+        component, stack = [], [start]
+        while stack:
+            index = stack.pop()
+            component.append(index)
+            P, Q, R = triangles[index]
+            for edge in ((Q, P), (R, Q), (P, R)):
+                neighbour = edge_triangle[edge]
+                if not seen[neighbour]:
+                    seen[neighbour] = True
+                    stack.append(neighbour)
+        components.append(sorted(component))
+    return components
+
+
+def convex_faces(triangles, vertex_positions):
+    """
+    Return the nondegenerate faces of a convex surface, or None.
+
+    A surface is considered convex if it's the outward-oriented boundary of
+    a convex body with nonempty interior, so that its winding number is 1
+    inside the body and 0 outside.  The check is exact, with the signs
+    computed by the filtered predicates: the surface must be edge-connected
+    and locally convex at each edge, and the centroid of its vertices must
+    lie strictly on the inner side of every nondegenerate face and have
+    winding number 1.  Together those conditions imply that the surface is
+    star-shaped about the centroid and wraps around it exactly once, and so
+    bounds a convex body.
+
+    The returned faces are triples of vertex positions, as given.
+
+    """
+    faces, _ = _convex_triangles(triangles, vertex_positions)
+    if faces is None:
+        return None
+    return [tuple(vertex_positions[vx] for vx in face) for face in faces]
+
+
+def _convex_triangles(triangles, vertex_positions):
+    """
+    Check convexity as for convex_faces, with faces as vertex indices.
+
+    Return a pair (faces, reflex).  faces is the list of nondegenerate
+    triangles of a convex surface, or None.  reflex is None, or a pair of
+    adjacent triangles at which the surface isn't locally convex; that
+    certifies that it isn't convex for as long as both are present.
+
+    """
+    triangles = [tuple(triangle) for triangle in triangles]
+    if not triangles or len(shells(triangles)) != 1:
+        return None, None
+
+    vertices = sorted(set(vx for triangle in triangles for vx in triangle))
+    positions = dict((vx, tuple(vertex_positions[vx])) for vx in vertices)
+
+    # Python ints are already exact, and faster than the filter.  Other
+    # coordinates are filtered, and for the signs the filter leaves in
+    # doubt, converted to exact numbers at most once per vertex.  Floats
+    # become ints scaled by a common power of two, which doesn't change the
+    # signs, since int arithmetic is much faster than Fraction arithmetic.
+    coordinates = [c for position in positions.values() for c in position]
+    all_ints = all(type(c) is int for c in coordinates)
+    exact_positions = positions if all_ints else {}
+    convert = exact
+    if not all_ints and all(
+            isinstance(c, float) or type(c) is int for c in coordinates):
+        scale = max(
+            c.as_integer_ratio()[1] for c in coordinates
+            if isinstance(c, float))
+
+        def convert(c):
+            if type(c) is int:
+                return c * scale
+            numerator, denominator = c.as_integer_ratio()
+            return numerator * (scale // denominator)
+
+    def orientation(P, Q, R, S):
+        if not all_ints:
+            result = _orientation_filter(
+                positions[P], positions[Q], positions[R], positions[S])
+            if result is not None:
+                return result
+            for vx in (P, Q, R, S):
+                if vx not in exact_positions:
+                    exact_positions[vx] = tuple(
+                        convert(c) for c in positions[vx])
+        return sign(determinant(
+            exact_positions[P], exact_positions[Q], exact_positions[R],
+            exact_positions[S]))
+
+    # Local convexity: the far vertex of the triangle across each edge
+    # must not lie strictly outside the plane of the triangle.
+    opposite = {}
+    for P, Q, R in triangles:
+        opposite[P, Q], opposite[Q, R], opposite[R, P] = R, P, Q
+    for P, Q, R in triangles:
+        for A, B in ((Q, P), (R, Q), (P, R)):
+            S = opposite[A, B]
+            if orientation(P, Q, R, S) < 0:
+                return None, ((P, Q, R), (A, B, S))
+
+    faces = []
+    for triangle in triangles:
+        P, Q, R = [positions[vx] for vx in triangle]
+        try:
+            filtered_edge_sign(Q, R, P)
+        except ValueError:
+            # Collinear vertices.
+            continue
+        faces.append(triangle)
+
+    def inside(centroid):
+        return all(
+            filtered_orientation(
+                positions[P], positions[Q], positions[R], centroid) > 0
+            for P, Q, R in faces)
+
+    # The centroid rounded to float usually settles the question with the
+    # filtered predicates alone; only if it doesn't is the exact centroid
+    # needed.
+    try:
+        centroid = tuple(
+            math.fsum(float(positions[vx][i]) for vx in vertices) /
+            len(vertices)
+            for i in range(3))
+    except OverflowError:
+        centroid = None
+    if centroid is None or not inside(centroid):
+        centroid = tuple(
+            fractions.Fraction(
+                sum(exact(positions[vx][i]) for vx in vertices),
+                len(vertices))
+            for i in range(3))
+        if not inside(centroid):
+            return None, None
+
+    winding_number = sum(
+        filtered_triangle_chain(
+            positions[P], positions[Q], positions[R], centroid)
+        for P, Q, R in triangles) // 2
+    if winding_number != 1:
+        return None, None
+    return faces, None
+
+
+def convex_winding_number(faces, point, predicate=triangle_sign,
+                          planes=None):
+    """
+    Winding number of a convex surface with the given faces around a point.
+
+    Return None if the point lies in the plane of one of the faces without
+    being strictly outside some other face, in which case the general
+    algorithm should be used to detect whether it lies on the surface.
+    *predicate* computes the triangle signs, unless the triangle_plane of
+    each face is given in *planes*.
+
+    """
+    if planes is None:
+        planes = [None] * len(faces)
+    ambiguous = False
+    for (P, Q, R), plane in zip(faces, planes):
+        result = plane_sign(plane, point)
+        if result is None:
+            try:
+                result = predicate(P, Q, R, point)
+            except ValueError:
+                result = 0
+        if result < 0:
+            return 0
+        if not result:
+            ambiguous = True
+    return None if ambiguous else 1
+
+
+def determinant(P, Q, R, O):
+    """
+    The determinant whose sign is computed by triangle_sign.
+
+    """
+    m1_0 = P[0] - O[0]
+    m1_1 = P[1] - O[1]
+    m2_0 = Q[0] - O[0]
+    m2_1 = Q[1] - O[1]
+    m3_0 = R[0] - O[0]
+    m3_1 = R[1] - O[1]
+    return (
+        (m1_0 * m2_1 - m1_1 * m2_0) * (R[2] - O[2]) +
+        (m2_0 * m3_1 - m2_1 * m3_0) * (P[2] - O[2]) +
+        (m3_0 * m1_1 - m3_1 * m1_0) * (Q[2] - O[2]))
+
+
+def convex_hull(points):
+    """
+    Faces of the convex hull of a collection of points in R^3.
+
+    Return a list of triples of indices into *points*, each oriented
+    counterclockwise when viewed from outside the hull, or None if the
+    points are coplanar.  The hull is computed incrementally.  Every
+    orientation test is exact, using the same determinant as triangle_sign
+    (evaluated by filtered_orientation, so in floating-point where that can
+    be certified), so a point is strictly outside the hull if and only if
+    triangle_sign is negative for at least one of the returned faces.
+
+    """
+    points = [
+        tuple(c if isinstance(c, float) else exact(c) for c in point)
+        for point in points]
+    if not points:
+        return None
+    # Approximate coordinates, used only to pick the farthest of the points
+    # known to be outside a face; any of them would give the right hull.
+    approximate = [tuple(float(c) for c in point) for point in points]
+
+    # Python ints are already exact, and faster than the filter.
+    predicate = filtered_orientation
+    if all(type(c) is int for point in points for c in point):
+        def predicate(P, Q, R, O):
+            return sign(determinant(P, Q, R, O))
+
+    def orientation(face, vx):
+        P, Q, R = face
+        return predicate(points[P], points[Q], points[R], points[vx])
+
+    def distance(face, vx):
+        P, Q, R = face
+        return determinant(
+            approximate[P], approximate[Q], approximate[R], approximate[vx])
+
+    # Find four affinely independent points for the initial simplex.
+    A = min(range(len(points)), key=points.__getitem__)
+    B = max(range(len(points)), key=points.__getitem__)
+    if points[A] == points[B]:
+        return None
+    for C in range(len(points)):
+        try:
+            filtered_edge_sign(points[A], points[B], points[C])
+        except ValueError:
+            continue
+        break
+    else:
+        return None
+    for D in range(len(points)):
+        if orientation((A, B, C), D):
+            break
+    else:
+        return None
+    if orientation((A, B, C), D) < 0:
+        B, C = C, B
+
+    # Faces are keyed by an integer id.  edge_face maps each directed edge
+    # to the face containing it, and outside maps each face to the points
+    # assigned to it that lie strictly outside it.
+    faces, edge_face, outside = {}, {}, {}
+    face_ids = itertools.count()
+
+    def add_face(face, candidates):
+        face_id = next(face_ids)
+        faces[face_id] = face
+        P, Q, R = face
+        for edge in ((P, Q), (Q, R), (R, P)):
+            edge_face[edge] = face_id
+        outside[face_id], remaining = [], []
+        for vx in candidates:
+            if orientation(face, vx) < 0:
+                outside[face_id].append(vx)
+            else:
+                remaining.append(vx)
+        return face_id, remaining
+
+    pending = []
+    candidates = [vx for vx in range(len(points)) if vx not in (A, B, C, D)]
+    for face in [(A, B, C), (A, D, B), (B, D, C), (C, D, A)]:
+        face_id, candidates = add_face(face, candidates)
+        pending.append(face_id)
+
+    while pending:
+        face_id = pending.pop()
+        if face_id not in faces or not outside[face_id]:
+            continue
+
+        # The outside point farthest from the face plane is a hull vertex.
+        face = faces[face_id]
+        eye = min(outside[face_id], key=lambda vx: distance(face, vx))
+
+        # Find the connected region of faces strictly visible from the eye,
+        # and the horizon edges bounding it.
+        visible, stack, horizon = {face_id}, [face_id], []
+        while stack:
+            P, Q, R = faces[stack.pop()]
             for edge in ((P, Q), (Q, R), (R, P)):
-                if edge[0] == edge[1]:
-                    raise ValueError("Self edge: {!r}".format(edge))
+                neighbour = edge_face[edge[::-1]]
+                if neighbour in visible:
+                    continue
+                if orientation(faces[neighbour], eye) < 0:
+                    visible.add(neighbour)
+                    stack.append(neighbour)
+
+        candidates = []
+        for visible_id in visible:
+            P, Q, R = faces[visible_id]
+            candidates.extend(
+                vx for vx in outside.pop(visible_id) if vx != eye)
+            for edge in ((P, Q), (Q, R), (R, P)):
+                if edge_face[edge[::-1]] not in visible:
+                    horizon.append(edge)
+        for visible_id in visible:
+            P, Q, R = faces.pop(visible_id)
+            for edge in ((P, Q), (Q, R), (R, P)):
+                del edge_face[edge]
+
+        # Replace the visible region with a cone from the horizon to the eye.
+        for P, Q in horizon:
+            face_id, candidates = add_face((P, Q, eye), candidates)
+            pending.append(face_id)
+
+    return list(faces.values())
+
+
+def validate_surface(triangles, vertex_count):
+    """
+    Check that triangles describe a closed oriented surface.
+
+    Raise ValueError if any triangle has a repeated vertex, if any directed
+    edge appears more than once or without its reverse, or if the set of
+    vertices used isn't range(vertex_count).
+
+    """
+    edges = set()
+    vertices = set()
+    for triangle in triangles:
+        vertices.update(triangle)
+        P, Q, R = triangle
+        for edge in ((P, Q), (Q, R), (R, P)):
+            if edge[0] == edge[1]:
+                raise ValueError("Self edge: {!r}".format(edge))
+            if edge in edges:
+                raise ValueError("Duplicate edge: {!r}".format(edge))
+            edges.add(edge)
+
+    # For each edge that appears, the reverse edge should also appear.
+    for P, Q in edges:
+        if not (Q, P) in edges:
+            raise ValueError("Unmatched edge: {!r}".format((P, Q)))
+
+    # Vertex set should match indices in vertex_positions.
+    if vertices != set(range(vertex_count)):
+        raise ValueError("Vertex set doesn't match position indices.")
+
+
+def validate_surface_external(triangles, vertex_count, buckets=64,
+                              directory=None):
+    """
+    Check that triangles describe a closed oriented surface, out of core.
+
+    Make the same checks as validate_surface, but without holding the set
+    of edges in memory.  The triangles are streamed over once, and each
+    edge is written to one of *buckets* temporary files in *directory*,
+    chosen by hashing the edge's unordered pair of vertices, so that an
+    edge and its reverse land in the same file.  The files are then
+    checked one at a time.
+
+    """
+    edge_format = struct.Struct("<qq")
+    used = bytearray(vertex_count)
+    workdir = tempfile.mkdtemp(dir=directory)
+    try:
+        paths = [
+            os.path.join(workdir, "edges{}.bin".format(bucket))
+            for bucket in range(buckets)]
+        files = [open(path, "wb") for path in paths]
+        try:
+            for triangle in triangles:
+                P, Q, R = triangle
+                for vertex in triangle:
+                    if not 0 <= vertex < vertex_count:
+                        raise ValueError(
+                            "Vertex set doesn't match position indices.")
+                    used[vertex] = 1
+                for edge in ((P, Q), (Q, R), (R, P)):
+                    if edge[0] == edge[1]:
+                        raise ValueError("Self edge: {!r}".format(edge))
+                    key = edge if edge[0] < edge[1] else edge[::-1]
+                    files[hash(key) % buckets].write(edge_format.pack(*edge))
+        finally:
+            for f in files:
+                f.close()
+
+        for path in paths:
+            with open(path, "rb") as f:
+                data = f.read()
+            edges = set()
+            for offset in range(0, len(data), edge_format.size):
+                edge = edge_format.unpack_from(data, offset)
                 if edge in edges:
                     raise ValueError("Duplicate edge: {!r}".format(edge))
                 edges.add(edge)
+            for P, Q in edges:
+                if not (Q, P) in edges:
+                    raise ValueError("Unmatched edge: {!r}".format((P, Q)))
+            os.remove(path)
+    finally:
+        shutil.rmtree(workdir)
 
-        # For each edge that appears, the reverse edge should also appear.
-        for P, Q in edges:
-            if not (Q, P) in edges:
-                raise ValueError("Unmatched edge: {!r}".format((P, Q)))
+    if not all(used):
+        raise ValueError("Vertex set doesn't match position indices.")
+
+
+def choose_ray_axis(triangle_positions):
+    """
+    Choose the direction of the rays used to compute winding numbers.
 
-        # Vertex set should match indices in vertex_positions.
-        if vertices != set(range(len(vertex_positions))):
-            raise ValueError("Vertex set doesn't match position indices.")
+    For each coordinate axis, estimate the expected number of triangles
+    whose projection along that axis contains a point chosen uniformly
+    from the bounding box: that's the total area of the projections of the
+    triangles, divided by the area of the projection of the bounding box.
+    Return the axis (0, 1 or 2) that minimises the estimate, preferring the
+    z-axis in the case of ties.
+
+    """
+    totals = [0, 0, 0]
+    lower = upper = None
+    for P, Q, R in triangle_positions:
+        totals[0] += abs((Q[1] - P[1]) * (R[2] - P[2]) -
+                         (Q[2] - P[2]) * (R[1] - P[1]))
+        totals[1] += abs((Q[2] - P[2]) * (R[0] - P[0]) -
+                         (Q[0] - P[0]) * (R[2] - P[2]))
+        totals[2] += abs((Q[0] - P[0]) * (R[1] - P[1]) -
+                         (Q[1] - P[1]) * (R[0] - P[0]))
+        if lower is None:
+            lower, upper = list(P), list(P)
+        for vertex in (P, Q, R):
+            for i in range(3):
+                lower[i] = min(lower[i], vertex[i])
+                upper[i] = max(upper[i], vertex[i])
+
+    best_axis, best_cost = 2, None
+    if lower is None:
+        return best_axis
+    for axis in (2, 0, 1):
+        i, j = (axis + 1) % 3, (axis + 2) % 3
+        area = float(upper[i] - lower[i]) * float(upper[j] - lower[j])
+        if area:
+            cost = float(totals[axis]) / area
+            if best_cost is None or cost < best_cost:
+                best_axis, best_cost = axis, cost
+    return best_axis
+
+
+def chunked(iterable, size):
+    """
+    Split an iterable into lists of at most *size* items.
+
+    Suitable for reading a large array of triangle positions (for example a
+    memory-mapped array of shape (n, 3, 3)) in pieces.
+
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def threaded_map(function, chunks, threads):
+    """
+    Apply a function to each of a list of chunks, using a pool of threads.
+
+    Thread k handles chunks k, k + threads, k + 2*threads, and so on, so the
+    threads need no coordination beyond storing each result in its own slot
+    of the output list.  If any call raises, the exception from the first
+    failing chunk is re-raised, as it would be for a sequential loop.
+
+    """
+    results = [None] * len(chunks)
+    errors = [None] * len(chunks)
+
+    def work(start):
+        for i in range(start, len(chunks), threads):
+            try:
+                results[i] = function(chunks[i])
+            except Exception as e:
+                errors[i] = e
+                return
+
+    workers = [
+        threading.Thread(target=work, args=(k,))
+        for k in range(min(threads, len(chunks)))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    for error in errors:
+        if error is not None:
+            raise error
+    return results
+
+
+def stream_winding_numbers(points, triangle_chunks, backend=None):
+    """
+    Winding numbers around a batch of points of a surface read in chunks.
+
+    *triangle_chunks* is an iterable of chunks, each of which is a sequence
+    of triples of vertex positions.  Together the chunks should describe a
+    closed oriented surface, as for Polyhedron; the combinatorial data
+    isn't needed or checked.  The chunks are read once, and the contribution
+    of each chunk to the winding number around each point is accumulated,
+    so memory use is bounded by the size of a chunk plus the size of the
+    batch.
+
+    *backend* is one of BACKENDS, defaulting to DEFAULT_BACKEND.  With the
+    "numba" backend each chunk is handed to the compiled kernel, in
+    parallel over the points, for the same data as Polyhedron.winding_numbers
+    accepts; other chunks are handled by the pure Python loop, which
+    examines, for each triangle, only the points whose vertical line might
+    cross it.
+
+    Raise ValueError if any of the points lies on the surface.
+
+    """
+    if backend is None:
+        backend = DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError("Unavailable backend: {!r}".format(backend))
+    points = list(points)
+    # Sort the points by x-coordinate, so that for each triangle only
+    # the points whose vertical line might cross it need be examined.
+    order = sorted(range(len(points)), key=lambda i: points[i][0])
+    xs = [points[i][0] for i in order]
+    totals = [0] * len(points)
+    # Sum of the int64 arrays returned by the kernel, if any.
+    kernel_totals = None
+    if backend == "numba":
+        kernel_points = _polyhedron_numba.point_array(points)
+    for chunk in triangle_chunks:
+        if backend == "numba":
+            chunk_totals = _polyhedron_numba.chain_totals(
+                chunk, kernel_points)
+            if chunk_totals is not None:
+                if kernel_totals is None:
+                    kernel_totals = chunk_totals
+                else:
+                    kernel_totals += chunk_totals
+                continue
+        for v1, v2, v3 in chunk:
+            lo = bisect.bisect_left(xs, min(v1[0], v2[0], v3[0]))
+            hi = bisect.bisect_right(xs, max(v1[0], v2[0], v3[0]))
+            ymin, ymax = min(v1[1], v2[1], v3[1]), max(v1[1], v2[1], v3[1])
+            for k in range(lo, hi):
+                i = order[k]
+                point = points[i]
+                if ymin <= point[1] <= ymax:
+                    totals[i] += triangle_chain(v1, v2, v3, point)
+    if kernel_totals is not None:
+        totals = [
+            total + int(kernel_total)
+            for total, kernel_total in zip(totals, kernel_totals)]
+    return [total // 2 for total in totals]
+
+
+def sweep_winding_numbers(points, triangle_positions, chain=triangle_chain):
+    """
+    Winding numbers around a batch of points, computed by a plane sweep.
+
+    The points and the x-extents of the triangles are sorted, and a plane
+    perpendicular to the x-axis is swept through them.  The triangles whose
+    x-extent contains the current point are kept in an active set, bucketed
+    by y-extent, so that each point only examines the triangles whose
+    footprint in the xy-plane might contain it.  For well-distributed data
+    the total cost is close to O((N + T) log(N + T) + K) for N points, T
+    triangles and K footprint hits.  *chain* computes the contribution of
+    each triangle, as for triangle_chain.
+
+    Raise ValueError if any of the points lies on the surface.
+
+    """
+    points = list(points)
+    triangles = [tuple(triangle) for triangle in triangle_positions]
+    totals = [0] * len(points)
+    if not points or not triangles:
+        return totals
+
+    # Buckets over the y-range of the points.
+    ys = [point[1] for point in points]
+    ylo, yhi = min(ys), max(ys)
+    bucket_count = int(math.sqrt(len(triangles))) + 1
+    width = float(yhi - ylo) / bucket_count or 1.0
+
+    def bucket(y):
+        return max(0, min(bucket_count - 1, int(float(y - ylo) / width)))
+
+    extents = [
+        (min(v1[0], v2[0], v3[0]), max(v1[0], v2[0], v3[0]),
+         min(v1[1], v2[1], v3[1]), max(v1[1], v2[1], v3[1]))
+        for v1, v2, v3 in triangles]
+    by_xmin = sorted(range(len(triangles)), key=lambda t: extents[t][0])
+    order = sorted(range(len(points)), key=lambda i: points[i][0])
+
+    buckets = [set() for _ in range(bucket_count)]
+    expiry = []
+    next_triangle = 0
+    for i in order:
+        point = points[i]
+        x, y = point[0], point[1]
+
+        # Activate triangles starting at or before x.
+        while (next_triangle < len(by_xmin) and
+               extents[by_xmin[next_triangle]][0] <= x):
+            t = by_xmin[next_triangle]
+            next_triangle += 1
+            _, xmax, ymin, ymax = extents[t]
+            if ymax < ylo or ymin > yhi:
+                continue
+            for b in range(bucket(ymin), bucket(ymax) + 1):
+                buckets[b].add(t)
+            heapq.heappush(expiry, (xmax, t))
+
+        # Deactivate triangles ending before x.
+        while expiry and expiry[0][0] < x:
+            _, t = heapq.heappop(expiry)
+            _, _, ymin, ymax = extents[t]
+            for b in range(bucket(ymin), bucket(ymax) + 1):
+                buckets[b].discard(t)
+
+        total = 0
+        for t in buckets[bucket(y)]:
+            if extents[t][2] <= y <= extents[t][3]:
+                v1, v2, v3 = triangles[t]
+                total += chain(v1, v2, v3, point)
+        totals[i] = total // 2
+    return totals
+
+
+def _spread_bits(n):
+    """
+    Spread the bits of a 16-bit integer out to the even bit positions.
+
+    """
+    n = (n | (n << 8)) & 0x00FF00FF
+    n = (n | (n << 4)) & 0x0F0F0F0F
+    n = (n | (n << 2)) & 0x33333333
+    n = (n | (n << 1)) & 0x55555555
+    return n
+
+
+def morton_order(points):
+    """
+    Indices of the points, sorted along a Z-order (Morton) curve.
+
+    The curve is taken through the x and y coordinates of the points,
+    quantized to a 2**16 by 2**16 grid over their bounding rectangle, so
+    that points that are close in the order are close in the xy-plane.
+
+    """
+    points = list(points)
+    if not points:
+        return []
+    keys = []
+    for axis in range(2):
+        values = [point[axis] for point in points]
+        low, high = min(values), max(values)
+        scale = 65535.0 / float(high - low) if high > low else 0.0
+        keys.append([int(float(value - low) * scale) for value in values])
+    codes = [
+        _spread_bits(x) | _spread_bits(y) << 1 for x, y in zip(*keys)]
+    return sorted(range(len(points)), key=codes.__getitem__)
+
+
+class FootprintIndex(object):
+    def __init__(self, triangle_positions):
+        """
+        Grid index of the footprints of triangles in the xy-plane.
+
+        Each triangle is recorded in every cell of a uniform grid that its
+        xy bounding box meets.  A triangle whose xy bounding box excludes a
+        point contributes nothing to the winding number around that point,
+        so the index gives the candidate triangles for vertical rays.
+
+        """
+        self.triangles = [tuple(triangle) for triangle in triangle_positions]
+        self.extents = [
+            (min(v1[0], v2[0], v3[0]), max(v1[0], v2[0], v3[0]),
+             min(v1[1], v2[1], v3[1]), max(v1[1], v2[1], v3[1]))
+            for v1, v2, v3 in self.triangles]
+
+        # Roughly one cell per triangle.  Cell coordinates are computed in
+        # floating-point, but monotonically, so that the cells found for
+        # a query rectangle include those of every overlapping footprint.
+        self.size = int(math.sqrt(len(self.triangles))) + 1
+        if self.triangles:
+            self.xlo = min(extent[0] for extent in self.extents)
+            self.ylo = min(extent[2] for extent in self.extents)
+            xhi = max(extent[1] for extent in self.extents)
+            yhi = max(extent[3] for extent in self.extents)
+            self.xwidth = float(xhi - self.xlo) / self.size or 1.0
+            self.ywidth = float(yhi - self.ylo) / self.size or 1.0
+        self.cells = {}
+        for t, (xmin, xmax, ymin, ymax) in enumerate(self.extents):
+            for i in range(self._column(xmin), self._column(xmax) + 1):
+                for j in range(self._row(ymin), self._row(ymax) + 1):
+                    self.cells.setdefault((i, j), []).append(t)
+
+    def _column(self, x):
+        column = int(float(x - self.xlo) / self.xwidth)
+        return max(0, min(self.size - 1, column))
+
+    def _row(self, y):
+        row = int(float(y - self.ylo) / self.ywidth)
+        return max(0, min(self.size - 1, row))
+
+    def candidates(self, xmin, xmax, ymin, ymax):
+        """
+        Indices of the triangles whose xy bounding box meets a rectangle.
+
+        """
+        if not self.triangles:
+            return []
+        found = set()
+        for i in range(self._column(xmin), self._column(xmax) + 1):
+            for j in range(self._row(ymin), self._row(ymax) + 1):
+                found.update(self.cells.get((i, j), ()))
+        extents = self.extents
+        return sorted(
+            t for t in found
+            if extents[t][0] <= xmax and xmin <= extents[t][1] and
+            extents[t][2] <= ymax and ymin <= extents[t][3])
+
+
+def coherent_winding_numbers(points, index, group_size=64,
+                             chain=triangle_chain):
+    """
+    Winding numbers around a batch of points, in spatially coherent groups.
+
+    The points are sorted along a Z-order curve and cut into groups of
+    *group_size* consecutive points.  For each group the candidate
+    triangles are gathered from the FootprintIndex *index* just once, for
+    the bounding rectangle of the group, and shared between its points.
+    The results are returned in the original order of the points.  *chain*
+    computes the contribution of each triangle, as for triangle_chain.
+
+    Raise ValueError if any of the points lies on the surface.
+
+    """
+    points = list(points)
+    order = morton_order(points)
+    totals = [0] * len(points)
+    for start in range(0, len(order), group_size):
+        group = order[start:start + group_size]
+        xs = [points[i][0] for i in group]
+        ys = [points[i][1] for i in group]
+        candidates = [
+            index.extents[t] + index.triangles[t]
+            for t in index.candidates(min(xs), max(xs), min(ys), max(ys))]
+        for i in group:
+            point = points[i]
+            x, y = point[0], point[1]
+            total = 0
+            for xmin, xmax, ymin, ymax, v1, v2, v3 in candidates:
+                if xmin <= x <= xmax and ymin <= y <= ymax:
+                    total += chain(v1, v2, v3, point)
+            totals[i] = total // 2
+    return totals
+
+
+def changed_triangles(old_triangle_positions, new_triangle_positions):
+    """
+    The triangles removed and added by an edit of a surface.
+
+    Triangles are compared by the positions of their vertices, so a moved
+    vertex shows up as the removal and re-addition of the triangles around
+    it.  Return a pair (removed, added) of lists of triangle positions,
+    with the multiplicity of repeated triangles respected.
+
+    """
+    counts = {}
+    for triangle in old_triangle_positions:
+        triangle = tuple(triangle)
+        counts[triangle] = counts.get(triangle, 0) + 1
+    added = []
+    for triangle in new_triangle_positions:
+        triangle = tuple(triangle)
+        if counts.get(triangle, 0):
+            counts[triangle] -= 1
+        else:
+            added.append(triangle)
+    removed = [
+        triangle for triangle, count in counts.items()
+        for _ in range(count)]
+    return removed, added
+
+
+def winding_number_changes(points, removed, added,
+                           chain=filtered_triangle_chain):
+    """
+    Change in the winding number around each of the points when the
+    triangles in *removed* are replaced by those in *added*.
+
+    If both the old and the new surface are closed, the added triangles
+    together with the reversed removed triangles form a closed surface,
+    and its winding number is the change.  Only the changed triangles are
+    examined, and a point outside all of their xy footprints is not
+    examined at all.  The default *chain* is exact, so the change is exact
+    whatever ray axis the original winding numbers were computed with.
+
+    Return a list containing the change for each point, or None for a
+    point that lies on one of the changed triangles.
+
+    """
+    triangles = [tuple(triangle) for triangle in removed]
+    signs = [-1] * len(triangles)
+    triangles.extend(tuple(triangle) for triangle in added)
+    signs.extend([1] * (len(triangles) - len(signs)))
+    index = FootprintIndex(triangles)
+    changes = []
+    for point in points:
+        x, y = point[0], point[1]
+        total = 0
+        try:
+            for t in index.candidates(x, x, y, y):
+                v1, v2, v3 = triangles[t]
+                total += signs[t] * chain(v1, v2, v3, point)
+        except ValueError:
+            changes.append(None)
+        else:
+            changes.append(total // 2)
+    return changes
+
+
+def column_crossings(triangle_positions, x, y, exact_heights=True):
+    """
+    Crossings of the vertical line through (x, y) with a closed surface.
+
+    Return a list of pairs (height, step), sorted by height: the line meets
+    a triangle of the surface at z = height, and the winding number around
+    a point moving up the line changes by step (1 or -1) as it passes that
+    height.  So the winding number around (x, y, z) is the sum of the steps
+    below z, and the point lies on the surface if z is one of the heights.
+
+    Only the triangles whose footprints contain (x, y) need to be given.
+    The classification follows triangle_chain, with all signs computed
+    exactly, and the heights too unless *exact_heights* is false, in which
+    case they're floats.  Return None if the line passes through a vertex
+    or runs along an edge of the surface; winding numbers along such a line
+    have to be computed point by point.
+
+    """
+    column = (x, y, 0.0 if isinstance(x, float) else 0)
+    filterable_column = _filterable(column)
+    crossings = []
+    for triangle in triangle_positions:
+        signs = []
+        for V in triangle:
+            s = compare(V[0], x) or compare(V[1], y)
+            if not s:
+                return None
+            signs.append(s)
+
+        # The edge signs are filtered as in _filtered_minor, with the
+        # filterability checked once for the whole triangle.
+        filterable = filterable_column and _filterable(*triangle)
+        face_boundary = 0
+        for a, b in ((0, 1), (1, 2), (2, 0)):
+            if signs[a] != signs[b]:
+                s = 0
+                if filterable:
+                    P, Q = triangle[a], triangle[b]
+                    left = (P[1] - y) * (Q[0] - x)
+                    right = (P[0] - x) * (Q[1] - y)
+                    result = left - right
+                    if (abs(result) > EDGE_ERROR_BOUND * (
+                            abs(left) + abs(right)) > UNDERFLOW_GUARD):
+                        s = 1 if result > 0 else -1
+                if not s:
+                    s = _filtered_minor(
+                        triangle[a], triangle[b], column, 1, 0)
+                if not s:
+                    return None
+                face_boundary += s
+        if not face_boundary:
+            continue
+
+        # The sign of the triangle with respect to (x, y, z) is the sign of
+        # K - N*z, so it changes at height K / N.  The winding number
+        # changes by half the face boundary, which is -sign(N).
+        if exact_heights or not filterable:
+            convert = exact if exact_heights else float
+            (P0, P1, P2), (Q0, Q1, Q2), (R0, R1, R2) = [
+                [convert(c) for c in V] for V in triangle]
+            x0, y0 = convert(x), convert(y)
+        else:
+            # Float arithmetic converts these coordinates exactly anyway.
+            (P0, P1, P2), (Q0, Q1, Q2), (R0, R1, R2) = triangle
+            x0, y0 = float(x), float(y)
+        a = (P0 - x0) * (Q1 - y0) - (P1 - y0) * (Q0 - x0)
+        b = (Q0 - x0) * (R1 - y0) - (Q1 - y0) * (R0 - x0)
+        c = (R0 - x0) * (P1 - y0) - (R1 - y0) * (P0 - x0)
+        N = a + b + c
+        if N:
+            height = divide(a * R2 + b * P2 + c * Q2, N)
+        else:
+            # Only possible for float heights, for a tiny triangle.
+            height = (P2 + Q2 + R2) / 3.0
+        crossings.append((height, face_boundary // 2))
+    crossings.sort()
+    return crossings
+
+
+def _drop_axis(point, axis):
+    """
+    Projection of a point onto the coordinate plane normal to *axis*.
+
+    """
+    return tuple(c for i, c in enumerate(point) if i != axis)
 
+
+def _on_planar_segment(P, Q, X):
+    """
+    Whether a point X collinear with P and Q lies on the segment PQ.
+
+    """
+    return (min(P[0], Q[0]) <= X[0] <= max(P[0], Q[0]) and
+            min(P[1], Q[1]) <= X[1] <= max(P[1], Q[1]))
+
+
+def _planar_segments_meet(A, B, C, D):
+    """
+    Whether the closed segments AB and CD in the plane meet.
+
+    """
+    o1, o2 = orientation(A, B, C), orientation(A, B, D)
+    o3, o4 = orientation(C, D, A), orientation(C, D, B)
+    if o1 * o2 < 0 and o3 * o4 < 0:
+        return True
+    return (
+        (not o1 and _on_planar_segment(A, B, C)) or
+        (not o2 and _on_planar_segment(A, B, D)) or
+        (not o3 and _on_planar_segment(C, D, A)) or
+        (not o4 and _on_planar_segment(C, D, B)))
+
+
+def _planar_segment_meets_triangle(A, B, P, Q, R):
+    """
+    Whether the closed segment AB meets the closed triangle PQR, in the
+    plane.  The triangle may be degenerate.
+
+    """
+    if any(_planar_segments_meet(A, B, U, V)
+           for U, V in ((P, Q), (Q, R), (R, P))):
+        return True
+    # Otherwise the segment meets the triangle only if it lies inside it.
+    s = orientation(P, Q, R)
+    return bool(s) and (
+        orientation(P, Q, A) == orientation(Q, R, A) ==
+        orientation(R, P, A) == s)
+
+
+def _segment_meets_triangle(A, B, P, Q, R):
+    """
+    Whether the closed segment AB meets the closed triangle PQR.
+
+    """
+    edges = (P, Q), (Q, R), (R, P)
+    sA = filtered_orientation(P, Q, R, A)
+    sB = filtered_orientation(P, Q, R, B)
+    if sA * sB > 0:
+        return False
+    if sA or sB:
+        # The segment crosses the plane of the triangle at a single point,
+        # which lies in the triangle if and only if the line AB passes
+        # through it.
+        signs = set(filtered_orientation(A, B, U, V) for U, V in edges)
+        return not (1 in signs and -1 in signs)
+
+    # All five points are coplanar, unless the triangle is degenerate.
+    projections = [
+        [_drop_axis(V, axis) for V in (A, B, P, Q, R)] for axis in range(3)]
+    if not any(orientation(*projection[2:]) for projection in projections):
+        # The vertices of the triangle are collinear, and the segment can
+        # only meet the triangle if it's coplanar with that line.
+        if any(filtered_orientation(A, B, U, V) for U, V in edges):
+            return False
+    # At least one of the projections is injective on the common plane,
+    # and none of them separates points that meet.
+    return all(
+        _planar_segment_meets_triangle(*projection)
+        for projection in projections)
+
+
+def triangles_intersect(T1, T2):
+    """
+    Whether two closed triangles in R^3 have a point in common.
+
+    Each triangle is given as a triple of vertex positions, and may be
+    degenerate.  All predicates are evaluated exactly, using the same
+    orientation determinant as triangle_sign, so triangles that merely
+    touch are reported as intersecting.
+
+    """
+    for S, T in ((T1, T2), (T2, T1)):
+        signs = set(filtered_orientation(T[0], T[1], T[2], V) for V in S)
+        if signs == {1} or signs == {-1}:
+            return False
+    # Two triangles meet if and only if an edge of one meets the other.
+    for S, T in ((T1, T2), (T2, T1)):
+        for U, V in ((S[0], S[1]), (S[1], S[2]), (S[2], S[0])):
+            if _segment_meets_triangle(U, V, *T):
+                return True
+    return False
+
+
+def _clip(polygon, axis, value, keep_below, strict=False):
+    """
+    Clip a convex polygon in R^3 by an axis-aligned plane.
+
+    Keep the part of the polygon whose coordinate *axis* is at most *value*
+    (or less than *value*, if *strict* is true) if *keep_below* is true,
+    and at least *value* otherwise.  The polygon is a list of points, and
+    for exact coordinates the result is exact.
+
+    """
+    def inside(point):
+        if keep_below:
+            return point[axis] < value if strict else point[axis] <= value
+        return point[axis] >= value
+
+    result = []
+    for index, Q in enumerate(polygon):
+        P = polygon[index - 1]
+        if inside(P) != inside(Q):
+            t = divide(value - P[axis], Q[axis] - P[axis])
+            crossing = [p + t * (q - p) for p, q in zip(P, Q)]
+            crossing[axis] = value
+            result.append(tuple(crossing))
+        if inside(Q):
+            result.append(Q)
+    return result
+
+
+def _polygon_moments(polygon):
+    """
+    Signed area of the projection of a planar convex polygon in R^3 onto
+    the xy-plane, and the signed integral of z over that projection.
+
+    """
+    area = integral = 0
+    if len(polygon) >= 3:
+        P = polygon[0]
+        for Q, R in zip(polygon[1:-1], polygon[2:]):
+            twice_area = (
+                (Q[0] - P[0]) * (R[1] - P[1]) - (Q[1] - P[1]) * (R[0] - P[0]))
+            area += twice_area
+            integral += twice_area * (P[2] + Q[2] + R[2])
+    return divide(area, 2), divide(integral, 6)
+
+
+def _slab_cell_volumes(task):
+    """
+    Cell volumes for a slab of cells, from the triangles meeting it.
+
+    *task* is a tuple (triangles, origin, spacing, shape, (i0, i1)), with
+    exact origin and spacing; the slab is made up of the cells (i, j, k)
+    with i0 <= i < i1.  Return the volumes as nested lists indexed by
+    [i - i0][j][k].
+
+    """
+    triangles, (ox, oy, oz), (dx, dy, dz), (nx, ny, nz), (i0, i1) = task
+    volumes = [[[0] * nz for _ in range(ny)] for _ in range(i1 - i0)]
+    # Contributions to all the cells of a column from a given layer up.
+    carries = [[[0] * nz for _ in range(ny)] for _ in range(i1 - i0)]
+
+    for triangle in triangles:
+        polygon = [tuple(exact(c) for c in vertex) for vertex in triangle]
+        xs = [vertex[0] for vertex in polygon]
+        ys = [vertex[1] for vertex in polygon]
+        for i in range(
+                max(i0, int((min(xs) - ox) // dx)),
+                min(i1, int((max(xs) - ox) // dx) + 1)):
+            x0 = ox + i * dx
+            strip = _clip(_clip(polygon, 0, x0, False), 0, x0 + dx, True)
+            if len(strip) < 3:
+                continue
+            for j in range(
+                    max(0, int((min(ys) - oy) // dy)),
+                    min(ny, int((max(ys) - oy) // dy) + 1)):
+                y0 = oy + j * dy
+                piece = _clip(_clip(strip, 1, y0, False), 1, y0 + dy, True)
+                area, _ = _polygon_moments(piece)
+                if not area:
+                    continue
+                zs = [vertex[2] for vertex in piece]
+                top = int((max(zs) - oz) // dz)
+                column = volumes[i - i0][j]
+                # The winding number at height z changes by -sign(area)
+                # for z above the piece, so a cell spanning heights z0 to
+                # z1 gains the integral of z1 - clamp(h, z0, z1) over the
+                # piece, weighted by -sign(area), where h is the height of
+                # the piece.
+                for k in range(
+                        max(0, int((min(zs) - oz) // dz)),
+                        min(nz, top + 1)):
+                    z0 = oz + k * dz
+                    z1 = z0 + dz
+                    below, _ = _polygon_moments(
+                        _clip(piece, 2, z0, True, strict=True))
+                    middle_area, middle_integral = _polygon_moments(
+                        _clip(_clip(piece, 2, z0, False), 2, z1, True))
+                    column[k] -= (
+                        below * dz + middle_area * z1 - middle_integral)
+                if top + 1 < nz:
+                    carries[i - i0][j][max(0, top + 1)] -= area * dz
+
+    for column, carry in zip(
+            [column for plane in volumes for column in plane],
+            [column for plane in carries for column in plane]):
+        total = 0
+        for k in range(nz):
+            total += carry[k]
+            column[k] += total
+    return volumes
+
+
+class Float32Positions(object):
+    def __init__(self, positions=()):
+        """
+        Compact sequence of vertex positions, stored as float32 values.
+
+        Each position is read back as a tuple of three Python floats: the
+        stored float32 values, widened exactly to float64.
+
+        """
+        self._values = array.array("f")
+        self.extend(positions)
+
+    def __len__(self):
+        return len(self._values) // 3
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("vertex index out of range")
+        values = self._values
+        return (values[3 * index], values[3 * index + 1],
+                values[3 * index + 2])
+
+    def __iter__(self):
+        values = self._values
+        for start in range(0, len(values), 3):
+            yield (values[start], values[start + 1], values[start + 2])
+
+    def extend(self, positions):
+        """
+        Append positions, rounding their coordinates to float32.
+
+        """
+        for position in positions:
+            x, y, z = position
+            self._values.extend((float(x), float(y), float(z)))
+
+    @property
+    def nbytes(self):
+        """
+        Number of bytes used to store the coordinates.
+
+        """
+        return len(self._values) * self._values.itemsize
+
+
+class _Shell(object):
+    def __init__(self, ids, triangles, planes):
+        """
+        Closed group of triangles of a polyhedron, in the ray frame.
+
+        *ids* are the indices of the triangles in the polyhedron's list,
+        *triangles* their positions and *planes* their triangle_plane
+        values.  The last two are None for polyhedra with float32 storage,
+        which look the positions up when needed instead.  lower and upper
+        are the corners of a box containing the triangles, set by expand.
+
+        """
+        self.ids = ids
+        self.triangles = triangles
+        self.planes = planes
+        self.lower = self.upper = None
+
+    def append(self, index, triangle, plane):
+        """
+        Add a triangle, returning its position in the shell.
+
+        """
+        self.ids.append(index)
+        if self.triangles is not None:
+            self.triangles.append(triangle)
+            self.planes.append(plane)
+        return len(self.ids) - 1
+
+    def remove(self, slot):
+        """
+        Remove the triangle at *slot*, moving the last one into its place.
+
+        Return the index of the moved triangle, or None if there isn't one.
+
+        """
+        index = self.ids.pop()
+        if self.triangles is not None:
+            triangle = self.triangles.pop()
+            plane = self.planes.pop()
+        if slot == len(self.ids):
+            return None
+        self.ids[slot] = index
+        if self.triangles is not None:
+            self.triangles[slot] = triangle
+            self.planes[slot] = plane
+        return index
+
+    def expand(self, points):
+        """
+        Enlarge the box to contain the given points.
+
+        """
+        if not points:
+            return
+        if self.lower is not None:
+            points = [self.lower, self.upper] + list(points)
+        self.lower = tuple(min(point[i] for point in points) for i in range(3))
+        self.upper = tuple(max(point[i] for point in points) for i in range(3))
+
+
+class Polyhedron(object):
+    def __init__(self, triangles, vertex_positions, validation="full",
+                 ray_axis=None, storage=None):
+        """
+        Initialize from list of triangles and vertex positions.
+
+        *validation* selects how the combinatorial data are checked.  With
+        "full" (the default) they're checked immediately, in memory.  With
+        "deferred", the checks are postponed until the first query or the
+        first call to validate, so that construction returns immediately.
+        With "external", they're checked immediately by streaming over the
+        triangles and spilling edges to temporary files, so that surfaces
+        with more edges than fit in memory can still be checked.
+
+        *ray_axis* (0, 1 or 2) is the direction of the rays used to compute
+        winding numbers.  For int and Fraction coordinates, and with float32
+        storage, it's chosen by default by choose_ray_axis to minimise the
+        number of triangles each ray has to examine, and the choice doesn't
+        affect the results.  Other float coordinates default to the z-axis,
+        since for points very close to the surface the rounding of the
+        float predicates can make the results depend on the axis.
+
+        With storage="float32", the vertex positions are rounded to float32
+        and stored compactly in a Float32Positions object, halving the memory
+        needed relative to float64.  Winding numbers are then computed with
+        the filtered predicates (see filtered_triangle_chain), which give
+        exact signs for float coordinates, so the robustness guarantees above
+        hold for the stored positions.  The data computed for queries then
+        refers to triangles by index instead of caching their positions,
+        which keeps the saving after the first query at some cost in speed.
+
+        """
+        if validation not in ("full", "deferred", "external"):
+            raise ValueError(
+                "Unknown validation mode: {!r}".format(validation))
+        if ray_axis not in (None, 0, 1, 2):
+            raise ValueError("Invalid ray axis: {!r}".format(ray_axis))
+        if storage not in (None, "float32"):
+            raise ValueError("Unknown storage mode: {!r}".format(storage))
+        self._requested_ray_axis = ray_axis
+        self.storage = storage
+        if storage == "float32":
+            vertex_positions = Float32Positions(vertex_positions)
+            self._triangle_chain = filtered_triangle_chain
+            self._triangle_sign = filtered_triangle_sign
+        else:
+            self._triangle_chain = triangle_chain
+            self._triangle_sign = triangle_sign
         # Vertex positions in R^3.
         self.vertex_positions = vertex_positions
         # Indices making up each triangle, counterclockwise
         # around the outside of the face.
         self.triangles = triangles
 
+        # Mapping from each directed edge to the index of the triangle
+        # containing it; built on the first edit.
+        self._edge_index = None
+        # True once vertex_positions has been copied for editing.
+        self._owns_vertex_positions = storage == "float32"
+
+        # Convex hull of the vertex positions and its bounding box, computed
+        # on the first query that needs them.
+        self._hull_ready = False
+        # Number of queries answered by the convex hull test alone.
+        self.hull_rejections = 0
+
+        self._validated = False
+        self._analysed = False
+        if validation == "full":
+            self.validate()
+            self._analyse()
+        elif validation == "external":
+            validate_surface_external(triangles, len(vertex_positions))
+            self._validated = True
+
+    def validate(self):
+        """
+        Check the combinatorial data, if that hasn't already been done.
+
+        Raise ValueError if the triangles don't describe a closed oriented
+        surface whose vertices match the vertex positions.
+
+        """
+        if not self._validated:
+            validate_surface(self.triangles, len(self.vertex_positions))
+            self._validated = True
+
+    def _analyse(self):
+        """
+        Compute the derived data used to speed up winding number queries.
+
+        """
+        self.validate()
+
+        # Faces used by the half-space test for convex surfaces; None if
+        # the surface isn't convex.
+        self._check_convexity()
+
+        # Triangle positions converted for the Numba backend, if used.
+        self._numba_ready = False
+
+        # Footprint indices of the triangles in the ray frame, and in the
+        # original frame for vertical columns, built when first needed.
+        self._footprint_index = None
+        self._column_index = None
+
+        # The ray-casting algorithm below is written for vertical rays.  For
+        # other ray directions, we work in a coordinate frame in which the
+        # ray axis becomes the z-axis.  The permutation of axes is cyclic,
+        # so it preserves orientation and winding numbers are unchanged.
+        # Float coordinates are handled by the unfiltered predicates, whose
+        # rounding errors depend on the ray axis, unless they're stored as
+        # float32; for those the default stays the z-axis.
+        self.ray_axis = self._requested_ray_axis
+        if self.ray_axis is None:
+            if self.storage == "float32" or all(
+                    isinstance(c, numbers.Rational)
+                    for position in self.vertex_positions
+                    for c in position):
+                self.ray_axis = choose_ray_axis(self.triangle_positions())
+            else:
+                self.ray_axis = 2
+        positions = [self._ray_frame(p) for p in self.vertex_positions]
+
+        # The triangles in the ray frame, grouped by edge-connected shell.
+        # For each index into self.triangles, _triangle_shells gives the
+        # _Shell holding that triangle and _triangle_slots its position
+        # there, so that edits can find the triangles they touch.
+        self._shells = []
+        self._triangle_shells = [None] * len(self.triangles)
+        self._triangle_slots = [0] * len(self.triangles)
+        for ids in shells(self.triangles):
+            triangles = [
+                tuple(positions[vx] for vx in self.triangles[i])
+                for i in ids]
+            if self.storage == "float32":
+                shell = _Shell(list(ids), None, None)
+            else:
+                shell = _Shell(
+                    list(ids), triangles,
+                    [triangle_plane(*triangle) for triangle in triangles])
+            shell.expand(
+                [vertex for triangle in triangles for vertex in triangle])
+            self._shells.append(shell)
+            for slot, index in enumerate(ids):
+                self._triangle_shells[index] = shell
+                self._triangle_slots[index] = slot
+        # The shells laid out contiguously, built when first needed; see
+        # _flat_shells.
+        self._flat = None
+        self._analysed = True
+
+    def _flat_shells(self):
+        """
+        The shells laid out contiguously, for code indexing all triangles.
+
+        Return a triple (triangles, ids, ranges): the triangle positions in
+        the ray frame, grouped by shell, the corresponding indices into
+        self.triangles, and for each shell a tuple (lower, upper, start,
+        stop) giving its bounding box and its range in the grouped lists.
+
+        """
+        if self._flat is None:
+            triangles, ids, ranges = [], [], []
+            for shell in self._shells:
+                start = len(triangles)
+                triangles.extend(self._shell_positions(shell))
+                ids.extend(shell.ids)
+                ranges.append(
+                    (shell.lower, shell.upper, start, len(triangles)))
+            self._flat = triangles, ids, ranges
+        return self._flat
+
+    def _shell_positions(self, shell):
+        """
+        Positions of the triangles of a shell, in the ray frame.
+
+        """
+        if shell.triangles is not None:
+            return shell.triangles
+        positions, frame = self.vertex_positions, self._ray_frame
+        return [
+            tuple(frame(positions[vx]) for vx in self.triangles[index])
+            for index in shell.ids]
+
+    def _ensure_edge_index(self):
+        """
+        Build the directed edge index used by the editing operations.
+
+        """
+        if self._edge_index is None:
+            self.validate()
+            self.triangles = [tuple(triangle) for triangle in self.triangles]
+            self._edge_index = {}
+            for index, (P, Q, R) in enumerate(self.triangles):
+                for edge in ((P, Q), (Q, R), (R, P)):
+                    self._edge_index[edge] = index
+        return self._edge_index
+
+    def add_vertices(self, vertex_positions):
+        """
+        Append new vertex positions, returning the range of their indices.
+
+        The new vertices are not used by any triangle until they're
+        referenced by a subsequent call to replace_triangles.  Validation
+        deferred at construction is done first, against the original
+        vertex positions, since the unused vertices would fail it.
+
+        """
+        self.validate()
+        if not self._owns_vertex_positions:
+            self.vertex_positions = list(self.vertex_positions)
+            self._owns_vertex_positions = True
+        start = len(self.vertex_positions)
+        self.vertex_positions.extend(vertex_positions)
+        self._hull_ready = False
+        return range(start, len(self.vertex_positions))
+
+    def replace_triangles(self, removed, added):
+        """
+        Replace the triangles in *removed* with those in *added*.
+
+        The boundary of the added patch must match that of the removed
+        patch, so that the surface remains closed.  Only the edges touched
+        by the edit are checked, so the cost is proportional to the size of
+        the edit rather than the size of the surface (after a one-off
+        indexing pass on the first edit).  Vertices left unused by the edit
+        are retained in vertex_positions.  Data already computed for
+        winding number queries is updated only for the shells the edit
+        touches.  Convexity is rechecked by the next query that needs it,
+        unless a reflex edge found by the last check survives the edit.
+
+        Raise ValueError, leaving the polyhedron unchanged, if a removed
+        triangle isn't present or the edit would produce a self edge, a
+        duplicate edge or an unmatched edge.
+
+        """
+        edge_index = self._ensure_edge_index()
+
+        removed_indices = set()
+        change = {}
+        for triangle in removed:
+            P, Q, R = triangle
+            index = edge_index.get((P, Q))
+            if (index is None or index in removed_indices or
+                    edge_index.get((Q, R)) != index or
+                    edge_index.get((R, P)) != index):
+                raise ValueError("Unknown triangle: {!r}".format(triangle))
+            removed_indices.add(index)
+            for edge in ((P, Q), (Q, R), (R, P)):
+                change[edge] = change.get(edge, 0) - 1
+
+        added = [tuple(triangle) for triangle in added]
+        vertex_count = len(self.vertex_positions)
+        for triangle in added:
+            P, Q, R = triangle
+            for vertex in triangle:
+                if not 0 <= vertex < vertex_count:
+                    raise ValueError("Unknown vertex: {!r}".format(vertex))
+            for edge in ((P, Q), (Q, R), (R, P)):
+                if edge[0] == edge[1]:
+                    raise ValueError("Self edge: {!r}".format(edge))
+                change[edge] = change.get(edge, 0) + 1
+
+        def count(edge):
+            return (edge in edge_index) + change.get(edge, 0)
+
+        for P, Q in change:
+            if count((P, Q)) > 1:
+                raise ValueError("Duplicate edge: {!r}".format((P, Q)))
+        for P, Q in change:
+            forward, reverse = count((P, Q)), count((Q, P))
+            if forward != reverse:
+                unmatched = (P, Q) if forward else (Q, P)
+                raise ValueError("Unmatched edge: {!r}".format(unmatched))
+
+        # The edit is valid; apply it.  Removed triangles are replaced by
+        # the last triangle in the list, so that removal is O(1) each.
+        # moved maps the new index of each moved triangle to its old index.
+        triangles = self.triangles
+        moved = {}
+        for index in removed_indices:
+            P, Q, R = triangles[index]
+            for edge in ((P, Q), (Q, R), (R, P)):
+                del edge_index[edge]
+        for index in sorted(removed_indices, reverse=True):
+            last = triangles.pop()
+            old_index = moved.pop(len(triangles), len(triangles))
+            if index < len(triangles):
+                triangles[index] = last
+                moved[index] = old_index
+                P, Q, R = last
+                for edge in ((P, Q), (Q, R), (R, P)):
+                    edge_index[edge] = index
+        added_indices = range(len(triangles), len(triangles) + len(added))
+        for triangle in added:
+            P, Q, R = triangle
+            for edge in ((P, Q), (Q, R), (R, P)):
+                edge_index[edge] = len(triangles)
+            triangles.append(triangle)
+        if self._analysed:
+            renumbered = dict(
+                (old_index, index) for index, old_index in moved.items())
+            self._update_shells(removed_indices, renumbered, added_indices)
+
+    def _update_shells(self, removed_indices, renumbered, added_indices):
+        """
+        Update the data computed by _analyse after replace_triangles.
+
+        *removed_indices* are the indices of the removed triangles before
+        the edit, *renumbered* maps the old index of each triangle moved by
+        the edit to its new index, and *added_indices* are the indices of
+        the added triangles.
+
+        The removed triangles are taken out of their shells, and the shells
+        they leave are merged, with the added triangles, into the largest
+        of them; the result is closed because the edit preserves
+        boundaries.  Merging moves only the smaller shells' triangles, so
+        an edit within one shell costs time proportional to the size of the
+        edit.  A
+        shell split in two by the edit stays whole, and bounding boxes
+        aren't shrunk when triangles are removed; both are correct, but
+        prune less.  Some data remains global and is recomputed lazily
+        rather than updated: the convexity of the surface, the footprint
+        indices and the arrays for the Numba backend.  The ray axis isn't
+        re-chosen.
+
+        """
+        triangle_shells = self._triangle_shells
+        slots = self._triangle_slots
+
+        # Take out the removed triangles, filling each gap with the last
+        # triangle of its shell.  Indices are still the old ones here.
+        affected = {}
+        for index in removed_indices:
+            shell, slot = triangle_shells[index], slots[index]
+            affected[id(shell)] = shell
+            moved = shell.remove(slot)
+            if moved is not None:
+                slots[moved] = slot
+
+        # Triangles moved by the edit take the places of removed ones, so
+        # their new entries overwrite only stale ones.
+        for old_index, index in renumbered.items():
+            shell, slot = triangle_shells[old_index], slots[old_index]
+            shell.ids[slot] = index
+            triangle_shells[index], slots[index] = shell, slot
+        count = len(self.triangles) - len(added_indices)
+        del triangle_shells[count:]
+        del slots[count:]
+
+        # Merge the affected shells into the largest, or a new shell if the
+        # edit only adds triangles.
+        merged = sorted(
+            affected.values(), key=lambda shell: len(shell.ids),
+            reverse=True)
+        if merged:
+            target = merged[0]
+        elif self.storage == "float32":
+            target = _Shell([], None, None)
+            self._shells.append(target)
+        else:
+            target = _Shell([], [], [])
+            self._shells.append(target)
+        for shell in merged[1:]:
+            for slot, index in enumerate(shell.ids):
+                triangle = plane = None
+                if shell.triangles is not None:
+                    triangle, plane = shell.triangles[slot], shell.planes[slot]
+                triangle_shells[index] = target
+                slots[index] = target.append(index, triangle, plane)
+            if shell.ids:
+                target.expand([shell.lower, shell.upper])
+
+        added = []
+        for index in added_indices:
+            triangle = tuple(
+                self._ray_frame(self.vertex_positions[vx])
+                for vx in self.triangles[index])
+            plane = None
+            if target.triangles is not None:
+                plane = triangle_plane(*triangle)
+            triangle_shells.append(target)
+            slots.append(target.append(index, triangle, plane))
+            added.extend(triangle)
+        target.expand(added)
+
+        if len(merged) > 1 or not target.ids:
+            gone = set(id(shell) for shell in merged[1:])
+            if not target.ids:
+                gone.add(id(target))
+            self._shells = [
+                shell for shell in self._shells if id(shell) not in gone]
+
+        # A reflex edge that survives the edit shows that the surface still
+        # isn't convex; otherwise convexity is rechecked by the next query.
+        edge_index = self._edge_index
+
+        def present(triangle):
+            P, Q, R = triangle
+            index = edge_index.get((P, Q))
+            return (index is not None and edge_index.get((Q, R)) == index and
+                    edge_index.get((R, P)) == index)
+
+        reflex = self._reflex_triangles if self._convexity_known else None
+        if reflex is None or not all(present(t) for t in reflex):
+            self._convex_faces = None
+            self._convexity_known = False
+        self._numba_ready = False
+        self._flat = None
+        self._footprint_index = None
+        self._column_index = None
+
     def triangle_positions(self):
         """
         Triples of vertex positions.
@@ -353,6 +2412,7 @@ class Polyhedron(object):
         Return the volume of this polyhedron.
 
         """
+        self.validate()
         acc = 0
         for p1, p2, p3 in self.triangle_positions():
             # Twice the area of the projection onto the x-y plane.
@@ -363,10 +2423,944 @@ class Polyhedron(object):
             acc += det * height
         return acc / 6.0
 
+    def cell_volumes(self, origin, spacing, shape, processes=None):
+        """
+        Volume of the solid inside each cell of a regular grid.
+
+        The grid has *shape* (nx, ny, nz) cells, with cell (i, j, k) the box
+        with lower corner origin + (i, j, k) * spacing and upper corner
+        origin + (i + 1, j + 1, k + 1) * spacing.  Return nested lists
+        volumes, with volumes[i][j][k] the integral of the winding number
+        over cell (i, j, k): for a simple outward-oriented surface, the
+        volume of the part of the cell inside the surface.
+
+        The volumes are computed exactly, as ints or Fractions, by the same
+        divergence-theorem decomposition as volume(), with each triangle
+        clipped to the cells below it.  If the grid contains the surface,
+        the cell volumes add up to volume().  The grid is split into slabs
+        along the x-axis, which are shared between *processes* worker
+        processes if that's greater than 1; the processes module describes
+        the ``if __name__ == "__main__":`` guard that asks of scripts.
+
+        """
+        self.validate()
+        nx, ny, nz = shape
+        origin = tuple(exact(c) for c in origin)
+        spacing = tuple(exact(c) for c in spacing)
+        triangles = [
+            triangle for triangle in self.triangle_positions()
+            if orientation(triangle[0], triangle[1], triangle[2])]
+
+        if processes is None or processes <= 1:
+            slabs = [(0, nx)]
+        else:
+            size = max(1, -(-nx // (4 * processes)))
+            slabs = [(i0, min(nx, i0 + size)) for i0 in range(0, nx, size)]
+        tasks = []
+        for i0, i1 in slabs:
+            x0, x1 = origin[0] + i0 * spacing[0], origin[0] + i1 * spacing[0]
+            tasks.append((
+                [triangle for triangle in triangles
+                 if min(vertex[0] for vertex in triangle) <= x1 and
+                 max(vertex[0] for vertex in triangle) >= x0],
+                origin, spacing, shape, (i0, i1)))
+
+        if len(tasks) <= 1:
+            results = [_slab_cell_volumes(task) for task in tasks]
+        else:
+            pool = process_pool(processes)
+            try:
+                results = pool.map(_slab_cell_volumes, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        return [plane for result in results for plane in result]
+
+    def _compute_hull(self):
+        """
+        Compute the convex hull of the vertex positions.
+
+        """
+        positions = self.vertex_positions
+        if len(positions):
+            self._hull_box = (
+                tuple(min(position[i] for position in positions)
+                      for i in range(3)),
+                tuple(max(position[i] for position in positions)
+                      for i in range(3)),
+            )
+        else:
+            self._hull_box = None
+        faces = convex_hull(positions)
+        self._hull_faces = [] if faces is None else [
+            tuple(positions[vx] for vx in face) for face in faces]
+        self._hull_planes = [
+            triangle_plane(*face) for face in self._hull_faces]
+        self._hull_ready = True
+
+    def _outside_hull(self, point):
+        """
+        Return True if the point is strictly outside the convex hull of the
+        vertex positions, and so has winding number 0.
+
+        As in the Numba kernel, a face only rejects the point if plane_sign
+        certifies its sign, so a float point very close to the plane of a
+        face isn't rejected, and is left to the full computation.
+
+        """
+        if not self._hull_ready:
+            self._compute_hull()
+        if self._hull_box is None:
+            return True
+        lower, upper = self._hull_box
+        for i in range(3):
+            if not lower[i] <= point[i] <= upper[i]:
+                return True
+        for plane in self._hull_planes:
+            result = plane_sign(plane, point)
+            if result is not None and result < 0:
+                return True
+        return False
+
+    def _check_convexity(self):
+        """
+        Compute the faces and planes used by the convex fast path.
+
+        """
+        # With float32 storage, the faces are kept as vertex indices and
+        # their planes aren't cached, to save memory.  A pair of triangles
+        # meeting at a reflex edge is kept too; see _update_shells.
+        self._convex_faces, self._reflex_triangles = _convex_triangles(
+            self.triangles, self.vertex_positions)
+        self._convex_planes = None
+        if self._convex_faces is not None and self.storage != "float32":
+            positions = self.vertex_positions
+            self._convex_faces = [
+                tuple(positions[vx] for vx in face)
+                for face in self._convex_faces]
+            self._convex_planes = [
+                triangle_plane(*face) for face in self._convex_faces]
+        self._convexity_known = True
+        # The Numba backend includes the hull prefilter only for surfaces
+        # that aren't convex.
+        self._numba_ready = False
+
+    def is_convex(self):
+        """
+        Return True if this is the outward-oriented boundary of a convex body.
+
+        """
+        if not self._analysed:
+            self._analyse()
+        if not self._convexity_known:
+            self._check_convexity()
+        return self._convex_faces is not None
+
+    def section(self, value, axis=2):
+        """
+        Cross-section of the surface by an axis-aligned plane.
+
+        The plane is the set of points whose coordinate *axis* is equal to
+        *value*.  Return a list of polygons, with points of the plane given
+        by the remaining two coordinates in cyclic order: (x, y) for axis 2,
+        (y, z) for axis 0 and (z, x) for axis 1.  For any point in the plane
+        that doesn't lie on the surface, the sum of the winding numbers of
+        the polygons around that point is the winding number of the surface.
+
+        Vertices lying in the plane are treated as lying just above it, so
+        that the section is really that of a plane perturbed infinitesimally
+        in the negative direction of the axis.  This handles surfaces that
+        touch the plane or have faces lying in it consistently, but it means
+        that points of those faces (or touching vertices) aren't detected as
+        lying on the surface: the polygons give the winding number of the
+        surface just below them.  Points on a part of the surface that
+        crosses the plane lie on an edge of one of the polygons.
+
+        """
+        self.validate()
+        i, j = (axis + 1) % 3, (axis + 2) % 3
+        positions = self.vertex_positions
+
+        crossings = {}
+
+        def crossing(below, above):
+            key = (below, above) if below < above else (above, below)
+            if key not in crossings:
+                U, V = positions[below], positions[above]
+                if V[axis] == value:
+                    point = (V[i], V[j])
+                else:
+                    t = divide(value - U[axis], V[axis] - U[axis])
+                    point = (U[i] + t * (V[i] - U[i]),
+                             U[j] + t * (V[j] - U[j]))
+                crossings[key] = point
+            return key
+
+        # Each triangle meeting the plane contributes a segment from the
+        # edge where it passes downwards through the plane to the edge where
+        # it passes upwards.  Each edge is shared by exactly two triangles,
+        # once in each direction, so every crossing is the start of exactly
+        # one segment and the end of exactly one segment.
+        successor = {}
+        for triangle in self.triangles:
+            edges = [(triangle[k - 1], triangle[k]) for k in range(3)]
+            sides = [positions[vx][axis] >= value for vx in triangle]
+            if all(sides) or not any(sides):
+                continue
+            for (P, Q), k in zip(edges, range(3)):
+                if sides[k - 1] and not sides[k]:
+                    start = crossing(Q, P)
+                elif sides[k] and not sides[k - 1]:
+                    end = crossing(P, Q)
+            successor[start] = end
+
+        polygons = []
+        while successor:
+            start, key = successor.popitem()
+            loop = [crossings[start]]
+            while key != start:
+                if crossings[key] != loop[-1]:
+                    loop.append(crossings[key])
+                key = successor.pop(key)
+            if len(loop) > 1 and loop[-1] == loop[0]:
+                loop.pop()
+            polygons.append(Polygon(loop))
+        return polygons
+
+    def _ray_frame(self, point):
+        """
+        Permute the coordinates of a point so that the ray axis comes last.
+
+        """
+        if self.ray_axis == 2:
+            return point
+        axis = self.ray_axis
+        return (point[(axis + 1) % 3], point[(axis + 2) % 3], point[axis])
+
     def winding_number(self, point):
         """Determine the winding number of *self* around the given point.
 
         """
-        return sum(
-            triangle_chain(v1, v2, v3, point)
-            for v1, v2, v3 in self.triangle_positions()) // 2
+        if not self._analysed:
+            self._analyse()
+        if not self._convexity_known:
+            self._check_convexity()
+        if self._convex_faces is not None:
+            faces = self._convex_faces
+            if self.storage == "float32":
+                positions = self.vertex_positions
+                faces = [
+                    tuple(positions[vx] for vx in face) for face in faces]
+            result = convex_winding_number(
+                faces, point, self._triangle_sign, self._convex_planes)
+            if result is not None:
+                return result
+        elif self._outside_hull(point):
+            self.hull_rejections += 1
+            return 0
+
+        # Each shell is a closed surface, so a shell whose bounding box
+        # excludes the point contributes nothing.
+        point = self._ray_frame(point)
+        x, y, z = point[0], point[1], point[2]
+        chain = self._triangle_chain
+        total = 0
+        for shell in self._shells:
+            lower, upper = shell.lower, shell.upper
+            if (lower[0] <= x <= upper[0] and lower[1] <= y <= upper[1] and
+                    lower[2] <= z <= upper[2]):
+                if shell.triangles is None:
+                    for v1, v2, v3 in self._shell_positions(shell):
+                        total += chain(v1, v2, v3, point)
+                else:
+                    for (v1, v2, v3), plane in zip(
+                            shell.triangles, shell.planes):
+                        total += chain(v1, v2, v3, point, plane)
+        return total // 2
+
+    def _prepare_numba(self):
+        """
+        Convert the surface for the Numba backend, if that hasn't been done.
+
+        """
+        if not self._analysed:
+            self._analyse()
+        if not self._convexity_known:
+            self._check_convexity()
+        if not self._numba_ready:
+            # The kernels don't implement the filtered predicates.
+            if self.storage == "float32":
+                self._numba_surface = None
+            else:
+                triangles, _, ranges = self._flat_shells()
+                self._numba_surface = _polyhedron_numba.prepare(
+                    triangles, ranges, self._numba_hull())
+            self._numba_ready = True
+
+    def _numba_hull(self):
+        """
+        The hull prefilter data for the Numba backend, in the ray frame,
+        or None for convex surfaces, which winding_number handles with the
+        convex fast path rather than the hull.
+
+        """
+        if self._convex_faces is not None:
+            return None
+        if not self._hull_ready:
+            self._compute_hull()
+        if self._hull_box is None:
+            # No vertices: every point is outside the (empty) hull.
+            return (1, 1, 1), (0, 0, 0), []
+        lower, upper = self._hull_box
+        return (
+            self._ray_frame(lower),
+            self._ray_frame(upper),
+            # Cyclically permuting the coordinates preserves orientation.
+            [tuple(self._ray_frame(vertex) for vertex in face)
+             for face in self._hull_faces],
+        )
+
+    def _pointwise_winding_numbers(self, points, backend, parallel=True):
+        """
+        Winding numbers around each of the points, computed one at a time.
+
+        """
+        if backend == "numba":
+            points = list(points)
+            self._prepare_numba()
+            results = _polyhedron_numba.winding_numbers(
+                self._numba_surface,
+                [self._ray_frame(point) for point in points],
+                parallel=parallel,
+            )
+            if results is not None:
+                winding_numbers, rejections = results
+                self.hull_rejections += rejections
+                return winding_numbers
+        return [self.winding_number(point) for point in points]
+
+    def _threaded_winding_numbers(self, points, backend, threads):
+        """
+        Winding numbers around each of the points, using several threads.
+
+        """
+        # Compute all the lazily computed state up front, so that the
+        # worker threads only ever read it.
+        if not self._analysed:
+            self._analyse()
+        if not self._convexity_known:
+            self._check_convexity()
+        if self._convex_faces is None and not self._hull_ready:
+            self._compute_hull()
+        if backend == "numba":
+            self._prepare_numba()
+
+        # Several chunks per thread, to even out the work, each a whole
+        # number of cache lines of results.
+        size = -(-len(points) // (4 * threads))
+        size = max(-(-size // CACHE_LINE_ITEMS), 1) * CACHE_LINE_ITEMS
+        chunks = [
+            points[start:start + size]
+            for start in range(0, len(points), size)]
+
+        def work(chunk):
+            return self._pointwise_winding_numbers(
+                chunk, backend, parallel=False)
+
+        return [
+            winding_number
+            for results in threaded_map(work, chunks, threads)
+            for winding_number in results]
+
+    def winding_numbers(self, points, method="pointwise", backend=None,
+                        threads=None):
+        """
+        Determine the winding numbers of *self* around each of the points.
+
+        With method="pointwise" (the default), each point is handled
+        separately by winding_number.  With method="sweep", the whole batch
+        is processed by a single plane sweep (see sweep_winding_numbers),
+        which is much faster for large batches of scattered points.  With
+        method="coherent", the points are reordered along a Z-order curve
+        and processed in groups that share their candidate triangles (see
+        coherent_winding_numbers), which suits dense batches in arbitrary
+        order.  Both first reject the points outside the convex hull of the
+        vertices, counting them in hull_rejections, as winding_number does
+        for non-convex surfaces.  The results are always in the order of
+        the given points.
+
+        *backend* is one of BACKENDS, and defaults to DEFAULT_BACKEND for
+        the pointwise method.  The "numba" backend runs the pointwise method
+        as a compiled kernel, in parallel over the points.  It's used only
+        for float64 data and int64 data of bounded magnitude, for which it
+        gives the same results as the pure Python code; other data, and
+        polyhedra with float32 storage, fall back to the "python" backend.
+        The kernel applies the convex hull prefilter too, and counts its
+        rejections in hull_rejections, but for float data it only rejects
+        points that the floating-point error bound certifies are outside
+        the hull; it doesn't use the convex fast path.
+
+        If *threads* is given and greater than 1, the pointwise method
+        splits the points into chunks and shares them between that many
+        Python threads.  The "numba" backend releases the GIL while it
+        works on a chunk; the "python" backend only runs in parallel on a
+        free-threaded build of Python, where the hull_rejections count may
+        then be inexact.  Either way, the results are the same as without
+        threads.
+
+        """
+        if backend is None:
+            backend = DEFAULT_BACKEND if method == "pointwise" else "python"
+        if backend not in BACKENDS:
+            raise ValueError("Unavailable backend: {!r}".format(backend))
+        if threads is not None and (
+                not isinstance(threads, numbers.Integral) or threads < 1):
+            raise ValueError("Invalid thread count: {!r}".format(threads))
+
+        if method == "pointwise":
+            if threads is not None and threads > 1:
+                return self._threaded_winding_numbers(
+                    list(points), backend, threads)
+            return self._pointwise_winding_numbers(points, backend)
+        elif method in ("sweep", "coherent"):
+            if backend != "python":
+                raise ValueError(
+                    "The {} method requires the python backend".format(
+                        method))
+            if threads is not None and threads > 1:
+                raise ValueError(
+                    "The {} method doesn't support threads".format(method))
+            if not self._analysed:
+                self._analyse()
+            # The hull prefilter runs first, as in winding_number, and only
+            # the remaining points go through the batch method.
+            points = list(points)
+            results = [0] * len(points)
+            remaining = []
+            for k, point in enumerate(points):
+                if self._outside_hull(point):
+                    self.hull_rejections += 1
+                else:
+                    remaining.append(k)
+            batch = [self._ray_frame(points[k]) for k in remaining]
+            if method == "sweep":
+                batch_results = sweep_winding_numbers(
+                    batch, self._flat_shells()[0],
+                    chain=self._triangle_chain)
+            else:
+                batch_results = coherent_winding_numbers(
+                    batch, self._footprint(), chain=self._triangle_chain)
+            for k, winding_number in zip(remaining, batch_results):
+                results[k] = winding_number
+            return results
+        else:
+            raise ValueError("Unknown method: {!r}".format(method))
+
+    def _footprint(self):
+        """
+        FootprintIndex of the triangles in the ray frame, built on first use.
+
+        """
+        if not self._analysed:
+            self._analyse()
+        if self._footprint_index is None:
+            self._footprint_index = FootprintIndex(self._flat_shells()[0])
+        return self._footprint_index
+
+    def _column_footprint(self):
+        """
+        FootprintIndex of the triangles in the original frame.
+
+        Return a pair (index, ids), where ids maps the triangle indices
+        used by the index to indices into self.triangles.
+
+        """
+        if not self._analysed:
+            self._analyse()
+        if self.ray_axis == 2:
+            return self._footprint(), self._flat_shells()[1]
+        if self._column_index is None:
+            self._column_index = FootprintIndex(self.triangle_positions())
+        return self._column_index, range(len(self.triangles))
+
+    def column_crossings(self, x, y, exact_heights=True):
+        """
+        Crossings of the vertical line through (x, y) with the surface.
+
+        See the module-level column_crossings; the candidate triangles are
+        found with a footprint index.
+
+        """
+        index, _ = self._column_footprint()
+        return column_crossings(
+            [index.triangles[t] for t in index.candidates(x, x, y, y)], x, y,
+            exact_heights)
+
+    def sample_interior(self, n, seed=None, weighted=False, attempts=100000):
+        """
+        Random points inside the solid bounded by the surface.
+
+        Return a list of *n* independent points, distributed uniformly over
+        the points with nonzero winding number, or if *weighted* is true,
+        with density proportional to the absolute value of the winding
+        number.  *seed* seeds the random number generator.
+
+        Each point is drawn from a fresh vertical column through a cell of
+        the footprint index.  The column's crossings all lie within the
+        height range of the cell's triangles, and its winding numbers are
+        at most half the number of those triangles, which bounds its
+        weighted length inside the solid.  A cell is picked with
+        probability proportional to its bound, and a column through it is
+        accepted with probability its weighted length over the bound, so
+        that columns are picked in proportion to their length inside.
+
+        Raise ValueError if the solid has zero volume, or if none of the
+        first *attempts* columns meets it.
+
+        """
+        rng = random.Random(seed)
+        if not n:
+            return []
+        index, _ = self._column_footprint()
+        cells, totals, total = [], [], 0.0
+        for (i, j), candidates in sorted(index.cells.items()):
+            heights = [
+                float(V[2]) for t in candidates for V in index.triangles[t]]
+            bound = (max(heights) - min(heights)) * (
+                len(candidates) // 2 if weighted else 1)
+            if len(candidates) >= 2 and bound > 0:
+                total += bound
+                totals.append(total)
+                cells.append((i, j, bound))
+        if not total:
+            raise ValueError("Surface bounds no volume")
+
+        points, misses = [], 0
+        while len(points) < n:
+            cell = bisect.bisect(totals, rng.random() * total)
+            i, j, bound = cells[min(cell, len(cells) - 1)]
+            x = index.xlo + (i + rng.random()) * index.xwidth
+            y = index.ylo + (j + rng.random()) * index.ywidth
+            target = rng.random() * bound
+            point = None
+            # Rounding can put the column in a neighbouring cell, whose
+            # triangles the bound doesn't cover.
+            if (index._column(x), index._row(y)) == (i, j):
+                point = self._column_point(
+                    index, (i, j), x, y, target, weighted)
+            if point is not None:
+                points.append(point)
+            elif not points:
+                misses += 1
+                if misses >= attempts:
+                    raise ValueError("Surface bounds no volume")
+        return points
+
+    def _column_point(self, index, cell, x, y, target, weighted):
+        """
+        Point at weighted length *target* up the part of the column through
+        (x, y) inside the solid, or None if the column is shorter than that
+        or passes through a vertex or along an edge.  *cell* is the cell of
+        the footprint *index* containing the column.
+
+        """
+        extents = index.extents
+        crossings = column_crossings(
+            [index.triangles[t] for t in index.cells[cell]
+             if extents[t][0] <= x <= extents[t][1] and
+             extents[t][2] <= y <= extents[t][3]],
+            x, y, exact_heights=False)
+        if crossings is None:
+            return None
+        winding_number, previous = 0, None
+        for height, step in crossings:
+            if winding_number and height > previous:
+                w = abs(winding_number) if weighted else 1
+                length = (height - previous) * w
+                if target < length:
+                    return (x, y, previous + float(target) / w)
+                target -= length
+            winding_number += step
+            previous = height
+        return None
+
+    def _surface_triangle(self, point):
+        """
+        Index of a triangle containing a point on the surface.
+
+        """
+        point = self._ray_frame(point)
+        index = self._footprint()
+        triangles, ids, _ = self._flat_shells()
+        for t in index.candidates(point[0], point[0], point[1], point[1]):
+            v1, v2, v3 = triangles[t]
+            try:
+                self._triangle_chain(v1, v2, v3, point)
+            except ValueError:
+                return ids[t]
+        raise AssertionError("point isn't on the surface")
+
+    def _nearest_triangle(self, point, tolerance):
+        """
+        Index of the nearest triangle within *tolerance* of a point, or None.
+
+        """
+        x, y, z = self._ray_frame(point)
+        index = self._footprint()
+        best, best_distance = None, tolerance * tolerance
+        for t in index.candidates(
+                x - tolerance, x + tolerance, y - tolerance, y + tolerance):
+            P, Q, R = index.triangles[t]
+            if (min(P[2], Q[2], R[2]) - tolerance <= z <=
+                    max(P[2], Q[2], R[2]) + tolerance):
+                distance = squared_distance_to_triangle(P, Q, R, (x, y, z))
+                if distance <= best_distance:
+                    best, best_distance = t, distance
+        return None if best is None else self._flat_shells()[1][best]
+
+    def classify(self, point, tolerance=None, return_triangle=False):
+        """
+        Classify a point, without raising for points on the surface.
+
+        Return the winding number of *self* around the point, or ON_SURFACE
+        if the point lies on the surface.  If *tolerance* is given, points
+        within that distance of the surface are also classified as
+        ON_SURFACE; the triangle spatial index limits the distance checks
+        to triangles near the point.
+
+        If *return_triangle* is true, return a pair (classification,
+        triangle), where triangle is the index in self.triangles of a
+        triangle that the point lies on (or the nearest triangle within
+        the tolerance), and None for points off the surface.
+
+        """
+        if tolerance is not None and tolerance < 0:
+            raise ValueError("Tolerance must be nonnegative")
+        result = self._classify(point, tolerance)
+        return result if return_triangle else result[0]
+
+    def _classify(self, point, tolerance, winding_number=None):
+        """
+        Return the pair (classification, triangle) for classify.
+
+        *winding_number*, if given, is the winding number around the point,
+        already computed.
+
+        """
+        # Analyse first, so that an invalid surface raises here rather
+        # than being mistaken for a point on the surface below.
+        if not self._analysed:
+            self._analyse()
+        if tolerance is not None:
+            triangle = self._nearest_triangle(point, tolerance)
+            if triangle is not None:
+                return ON_SURFACE, triangle
+        if winding_number is not None:
+            return winding_number, None
+        try:
+            return self.winding_number(point), None
+        except ValueError:
+            return ON_SURFACE, self._surface_triangle(point)
+
+    def classify_batch(self, points, tolerance=None, return_triangle=False):
+        """
+        Classify each of the points, as for classify.
+
+        The winding numbers are computed in batches with winding_numbers.
+        A batch containing a point on the surface is split in two and each
+        half retried, so only the points on the surface themselves are
+        classified one at a time.
+
+        """
+        if tolerance is not None and tolerance < 0:
+            raise ValueError("Tolerance must be nonnegative")
+        if not self._analysed:
+            self._analyse()
+        points = list(points)
+        winding_numbers = self._off_surface_winding_numbers(points)
+        results = [
+            self._classify(point, tolerance, winding_number)
+            for point, winding_number in zip(points, winding_numbers)]
+        if return_triangle:
+            return results
+        return [classification for classification, _ in results]
+
+    def _off_surface_winding_numbers(self, points):
+        """
+        Winding numbers around a list of points, as for winding_numbers,
+        but with None for each point on the surface.
+
+        """
+        rejections = self.hull_rejections
+        try:
+            return self.winding_numbers(points)
+        except ValueError:
+            # The points rejected before the failure are counted again
+            # when their half of the batch is retried.
+            self.hull_rejections = rejections
+            if len(points) <= 1:
+                return [None] * len(points)
+        middle = len(points) // 2
+        return (self._off_surface_winding_numbers(points[:middle]) +
+                self._off_surface_winding_numbers(points[middle:]))
+
+    def reclassify(self, points, results, old=None, changes=None):
+        """
+        Update classifications of points after an edit of the surface.
+
+        *results* are the classifications of the points, as returned by
+        classify_batch, against the surface before the edit.  The edit is
+        described either by *old*, the polyhedron before the edit, whose
+        triangles are compared with those of *self*, or by *changes*, a
+        pair (removed, added) of lists of triangle positions.  Exactly one
+        of the two must be given.
+
+        Only the changed triangles are examined (see winding_number_changes),
+        with the same predicates and ray axis as winding_number.  If the
+        coordinates are exact, or the storage is float32, those predicates
+        are exact, and the result is identical to classify_batch(points)
+        on *self*.  Other float coordinates are classified without error
+        bounds, so for points within rounding error of the surface the
+        result may still differ from classify_batch, whose shortcuts don't
+        evaluate the predicates triangle by triangle.  Points on a changed
+        triangle are classified afresh with classify.
+
+        """
+        if (old is None) == (changes is None):
+            raise ValueError("Exactly one of old and changes must be given")
+        points = list(points)
+        results = list(results)
+        if len(points) != len(results):
+            raise ValueError("Expected one result per point")
+        if old is not None:
+            removed, added = changed_triangles(
+                old.triangle_positions(), self.triangle_positions())
+        else:
+            removed, added = changes
+        if not self._analysed:
+            self._analyse()
+        # Cyclically permuting the coordinates preserves orientation.
+        changes = winding_number_changes(
+            [self._ray_frame(point) for point in points],
+            [[self._ray_frame(V) for V in triangle] for triangle in removed],
+            [[self._ray_frame(V) for V in triangle] for triangle in added],
+            chain=self._triangle_chain)
+        updated = []
+        for point, result, change in zip(points, results, changes):
+            if change is None:
+                updated.append(self.classify(point))
+            elif result == ON_SURFACE:
+                # The point lies on a triangle that is still present.
+                updated.append(ON_SURFACE)
+            else:
+                updated.append(result + change)
+        return updated
+
+    def _surface_box(self):
+        """
+        Bounding box (lower, upper) of the vertices used by the triangles,
+        or None if there are no triangles.
+
+        """
+        positions = self._surface_vertices()
+        if not positions:
+            return None
+        return (
+            tuple(min(p[i] for p in positions) for i in range(3)),
+            tuple(max(p[i] for p in positions) for i in range(3)),
+        )
+
+    def _surface_vertices(self):
+        """
+        Positions of the vertices used by the triangles.
+
+        """
+        used = sorted(set(vx for triangle in self.triangles
+                          for vx in triangle))
+        return [self.vertex_positions[vx] for vx in used]
+
+    def surface_intersection(self, other):
+        """
+        Find a point in common between the surfaces of two polyhedra.
+
+        Return a pair (i, j) of indices into self.triangles and
+        other.triangles of two triangles that intersect (or touch), or
+        None if the surfaces are disjoint.  The triangles of *other* are
+        tested only against the triangles of *self* whose bounding boxes
+        meet theirs, found with a footprint index, and the search stops at
+        the first intersecting pair.  The test is exact; see
+        triangles_intersect.
+
+        """
+        index, ids = self._column_footprint()
+        for j, triangle in enumerate(other.triangle_positions()):
+            xs, ys, zs = zip(*triangle)
+            zmin, zmax = min(zs), max(zs)
+            for t in index.candidates(min(xs), max(xs), min(ys), max(ys)):
+                candidate = index.triangles[t]
+                if (max(V[2] for V in candidate) < zmin or
+                        min(V[2] for V in candidate) > zmax):
+                    continue
+                if triangles_intersect(candidate, triangle):
+                    return ids[t], j
+        return None
+
+    def _vertex_classifications(self, other):
+        """
+        Classify the vertices of *other* that lie in the bounding box of
+        *self*, as for classify_batch.  Vertices outside the box have
+        winding number 0, and are omitted.
+
+        """
+        box = self._surface_box()
+        if box is None:
+            return []
+        lower, upper = box
+        points = [
+            point for point in other._surface_vertices()
+            if all(lower[i] <= point[i] <= upper[i] for i in range(3))]
+        return self.classify_batch(points)
+
+    def overlaps(self, other):
+        """
+        Determine whether the solids bounded by two polyhedra overlap.
+
+        The solid bounded by a polyhedron is the set of points with nonzero
+        winding number.  Return True if the surfaces meet, including
+        surfaces that merely touch, or if either solid contains a vertex of
+        the other surface; these are the only ways two solids can overlap.
+        The vertices are classified in batches, and the surfaces are only
+        compared if no vertex gives an answer.
+
+        """
+        box, other_box = self._surface_box(), other._surface_box()
+        if box is None or other_box is None:
+            return False
+        if any(box[1][i] < other_box[0][i] or other_box[1][i] < box[0][i]
+               for i in range(3)):
+            return False
+        for first, second in ((self, other), (other, self)):
+            if any(first._vertex_classifications(second)):
+                return True
+        return self.surface_intersection(other) is not None
+
+    def contains(self, other):
+        """
+        Determine whether the solid bounded by *other* lies inside the solid
+        bounded by *self*, without the surfaces meeting.
+
+        The solid bounded by a polyhedron is the set of points with nonzero
+        winding number.  Return True if the surfaces are disjoint, every
+        vertex of *other* lies inside *self*, and no vertex of *self* lies
+        inside *other*.  The last condition is slightly stronger than
+        necessary: a part of the surface of *self* lying inside *other*,
+        with nonzero winding number on both sides of it, is also rejected.
+
+        """
+        other_box = other._surface_box()
+        if other_box is None:
+            return True
+        box = self._surface_box()
+        if box is None or any(
+                other_box[0][i] < box[0][i] or box[1][i] < other_box[1][i]
+                for i in range(3)):
+            return False
+        inside = self.classify_batch(other._surface_vertices())
+        if any(label == ON_SURFACE or not label for label in inside):
+            return False
+        if any(other._vertex_classifications(self)):
+            return False
+        return self.surface_intersection(other) is None
+
+
+class PolyhedronInstance(object):
+    def __init__(self, polyhedron, matrix, translation=(0, 0, 0)):
+        """
+        Initialize from a shared polyhedron and an affine transformation.
+
+        The instance represents the image of *polyhedron* under the map
+        p -> matrix * p + translation, where *matrix* is a nonsingular 3x3
+        matrix given as a sequence of rows.  The polyhedron, along with any
+        data it caches to speed up queries, is shared rather than copied.
+
+        Queries are answered by mapping the query point back to the
+        polyhedron's coordinates.  If both the matrix and the point have
+        rational entries, this is done in exact arithmetic.  Float points
+        are mapped back in floating-point, so that they're classified with
+        the polyhedron's fast float predicates; like any float
+        computation, this may misclassify points within rounding error of
+        the surface.
+
+        """
+        (a, b, c), (d, e, f), (g, h, i) = matrix
+        cofactors = [
+            [e * i - f * h, c * h - b * i, b * f - c * e],
+            [f * g - d * i, a * i - c * g, c * d - a * f],
+            [d * h - e * g, b * g - a * h, a * e - b * d],
+        ]
+        det = a * cofactors[0][0] + b * cofactors[1][0] + c * cofactors[2][0]
+        if not det:
+            raise ValueError("Singular transformation matrix")
+
+        self.polyhedron = polyhedron
+        self.matrix = matrix
+        self.translation = translation
+        # Inverse of the linear part of the transformation.
+        self._inverse = [[divide(entry, det) for entry in row]
+                         for row in cofactors]
+        # If the inverse is exact, apply it to exact points in exact
+        # arithmetic.
+        self._exact = all(
+            isinstance(entry, numbers.Rational)
+            for row in self._inverse for entry in row)
+        self._float_inverse = [
+            [float(entry) for entry in row] for row in self._inverse]
+        self._float_translation = [float(c) for c in translation]
+        # The transformation reverses orientation if its determinant is
+        # negative, and with it the sign of the winding number.
+        self._orientation = sign(det)
+        self._det = det
+
+    def _pullback(self, point):
+        """
+        Apply the inverse transformation to a point.
+
+        """
+        if self._exact and all(
+                isinstance(coordinate, numbers.Rational)
+                for coordinate in point):
+            inverse = self._inverse
+            offset = [point[k] - self.translation[k] for k in range(3)]
+        else:
+            inverse = self._float_inverse
+            offset = [
+                float(point[k]) - self._float_translation[k]
+                for k in range(3)]
+        return tuple(
+            row[0] * offset[0] + row[1] * offset[1] + row[2] * offset[2]
+            for row in inverse)
+
+    def volume(self):
+        """
+        Return the volume of this instance.
+
+        """
+        return self._det * self.polyhedron.volume()
+
+    def winding_number(self, point):
+        """Determine the winding number of *self* around the given point.
+
+        """
+        return self._orientation * self.polyhedron.winding_number(
+            self._pullback(point))
+
+    def winding_numbers(self, points):
+        """
+        Determine the winding numbers of *self* around each of the points.
+
+        """
+        return [
+            self._orientation * winding_number
+            for winding_number in self.polyhedron.winding_numbers(
+                [self._pullback(point) for point in points])
+        ]
@@ -0,0 +1,28 @@
+"""Pools of worker processes, shared by the polygon, polyhedron and voxelize
+modules.
+
+Workers are started with the "spawn" method where multiprocessing supports
+it (Python 3.4 and later), and forked elsewhere.  Spawned workers import the
+main module afresh, so a script that asks for more than one process must
+guard its entry point with ``if __name__ == "__main__":``; without the guard
+each worker would try to start the script's own work again, and the pool
+fails to start.
+
+"""
+import multiprocessing
+
+
+def process_pool(processes, initializer=None, initargs=()):
+    """
+    Pool of worker processes, started with the "spawn" method if available.
+
+    Forking a process in which Numba's parallel kernels have run can leave
+    the interpreter hanging at exit, so workers are started afresh wherever
+    the platform allows it.  See the module docstring for what that asks
+    of the calling script.
+
+    """
+    get_context = getattr(multiprocessing, "get_context", None)
+    factory = get_context("spawn") if get_context else multiprocessing
+    return factory.Pool(
+        processes, initializer=initializer, initargs=initargs)
@@ -2,6 +2,12 @@
 Tests for Polygon.winding_number.
 
 """
+import fractions
+import math
+import os
+import random
+import shutil
+import tempfile
 import unittest
 
 try:
@@ -11,7 +17,9 @@ except ImportError:
 else:
     NUMPY_AVAILABLE = True
 
-from polygon import Polygon
+from polygon import (
+    Polygon, PolygonLayer, edge_sign, edge_signs, orientation,
+    predicate_counts, reset_predicate_counts, sign, vertex_sign, vertex_signs)
 
 
 class TestPolygon(unittest.TestCase):
@@ -128,6 +136,224 @@ class TestPolygon(unittest.TestCase):
                 with self.assertRaises(ValueError):
                     aitch.winding_number(point)
 
+    def test_measures(self):
+        square = Polygon([(1.0, -1.0), (1.0, 1.0), (-1.0, 1.0), (-1.0, -1.0)])
+        self.assertEqual(square.centroid(), (0.0, 0.0))
+        self.assertEqual(square.perimeter(), 8.0)
+
+        triangle = Polygon([(0, 0), (3, 0), (0, 1)])
+        self.assertEqual(triangle.area(exact=True), fractions.Fraction(3, 2))
+        self.assertEqual(
+            triangle.centroid(exact=True), (1, fractions.Fraction(1, 3)))
+        self.assertAlmostEqual(triangle.perimeter(), 4 + math.sqrt(10))
+
+        # Exact results for Fraction coordinates, which would be rounded
+        # in floating-point.
+        tenth = fractions.Fraction(1, 10)
+        thin = Polygon([(0, 0), (3 * tenth, 0), (3 * tenth, tenth)])
+        self.assertEqual(thin.area(exact=True), fractions.Fraction(3, 200))
+        self.assertEqual(thin.centroid(exact=True), (tenth * 2, tenth / 3))
+
+        # Clockwise polygons have negative area, but the same centroid.
+        clockwise = Polygon(triangle.vertex_positions[::-1])
+        self.assertEqual(clockwise.area(exact=True), -fractions.Fraction(3, 2))
+        self.assertEqual(
+            clockwise.centroid(exact=True), triangle.centroid(exact=True))
+
+        with self.assertRaises(ValueError):
+            Polygon([(0, 0), (1, 1), (2, 2)]).centroid()
+
+        # Float results far from the origin are as accurate as near it.
+        far = Polygon([(1e8, 1e8), (1e8 + 1, 1e8), (1e8 + 1, 1e8 + 1),
+                       (1e8, 1e8 + 1)])
+        self.assertEqual(far.area(), 1.0)
+        self.assertEqual(far.centroid(), (1e8 + 0.5, 1e8 + 0.5))
+        far_triangle = Polygon([(1e8, 0.0), (1e8 + 3, 0.0), (1e8, 1.0)])
+        self.assertEqual(far_triangle.area(), 1.5)
+        self.assertEqual(
+            far_triangle.centroid(exact=True),
+            (10 ** 8 + 1, fractions.Fraction(1, 3)))
+
+    def test_edge_positions_without_copying(self):
+        class Vertices(object):
+            # Supports indexing by integer only.
+            def __init__(self, positions):
+                self.positions = positions
+
+            def __len__(self):
+                return len(self.positions)
+
+            def __getitem__(self, index):
+                if not isinstance(index, int):
+                    raise TypeError("no slicing")
+                return self.positions[index]
+
+        square = Polygon(
+            Vertices([(1.0, -1.0), (1.0, 1.0), (-1.0, 1.0), (-1.0, -1.0)]))
+        self.assertEqual(
+            list(square.edge_positions())[-1], ((-1.0, -1.0), (1.0, -1.0)))
+        self.assertEqual(square.winding_number((0.0, 0.0)), 1)
+        self.assertEqual(square.area(), 4.0)
+
+    def test_exact_orientation(self):
+        def exact_orientation(P, Q, O):
+            (px, py), (qx, qy), (ox, oy) = [
+                [fractions.Fraction(c) for c in point] for point in (P, Q, O)]
+            return (px - ox) * (qy - oy) - (py - oy) * (qx - ox)
+
+        # Nearly collinear points, for which a naive floating-point
+        # evaluation frequently gives the wrong sign.
+        reset_predicate_counts()
+        rng = random.Random(13579)
+        for _ in range(2000):
+            P, Q, O = [
+                (0.1 + t * 0.3, 0.7 + t * 0.2 + rng.choice([0.0, 1e-17]))
+                for t in [rng.uniform(-5, 5) for _ in range(3)]]
+            expected = exact_orientation(P, Q, O)
+            self.assertEqual(orientation(P, Q, O), sign(expected))
+        self.assertEqual(
+            predicate_counts["filtered"] + predicate_counts["exact"], 2000)
+        self.assertGreater(predicate_counts["exact"], 0)
+
+        # Well-separated points are handled by the filter alone.
+        reset_predicate_counts()
+        self.assertEqual(orientation((1.0, 0.0), (0.0, 1.0), (0.0, 0.0)), 1)
+        self.assertEqual(predicate_counts, {"filtered": 1, "exact": 0})
+
+        # Integer and Fraction coordinates are handled exactly, without
+        # touching the counters.
+        big = 2 ** 40
+        self.assertEqual(
+            orientation((big + 1, big), (big, big - 1), (0, 0)), -1)
+        self.assertEqual(
+            orientation(
+                (fractions.Fraction(1, 3), 0), (0, fractions.Fraction(1, 3)),
+                (fractions.Fraction(1, 6), fractions.Fraction(1, 6))), 0)
+        self.assertEqual(predicate_counts, {"filtered": 1, "exact": 0})
+
+        # A point just off the edge of a float square is classified
+        # correctly.
+        square = Polygon([(0.1, 0.1), (0.7, 0.1), (0.7, 0.7), (0.1, 0.7)])
+        edge = Polygon([(0.1, 0.1), (0.7, 0.7), (0.1, 0.7)])
+        with self.assertRaises(ValueError):
+            square.winding_number((0.7, 0.3))
+        self.assertEqual(edge.winding_number((0.3, 0.30000000000000004)), 1)
+        self.assertEqual(edge.winding_number((0.30000000000000004, 0.3)), 0)
+
+    @unittest.skipUnless(NUMPY_AVAILABLE, "Test requires NumPy")
+    def test_numpy_int64_orientation(self):
+        # Products of these coordinates overflow int64.
+        big = 2 ** 40
+        P, Q, O = numpy.array(
+            [[big + 1, big], [big, big - 1], [0, 0]], dtype=numpy.int64)
+        self.assertEqual(orientation(P, Q, O), -1)
+        self.assertEqual(orientation(Q, P, O), 1)
+
+    def test_sign_arrays(self):
+        rng = random.Random(86420)
+        P, Q, O = [
+            [(rng.randint(-1, 1), rng.randint(-1, 1)) for _ in range(500)]
+            for _ in range(3)]
+        # Degenerate cases are common.
+        self.assertIn(0, vertex_signs(P, O))
+        self.assertIn(0, edge_signs(P, Q, O))
+        # Nearly collinear float points, whose signs the error bound often
+        # can't certify.
+        near = [
+            [(0.1 + t * 0.3, 0.7 + t * 0.2 + rng.choice([0.0, 1e-17]))
+             for t in [rng.uniform(-5, 5) for _ in range(500)]]
+            for _ in range(3)]
+        inputs = [
+            (P, Q, O),
+            tuple([(0.1 * x, 0.1 * y) for x, y in points]
+                  for points in (P, Q, O)),
+            tuple([(fractions.Fraction(x, 3), y) for x, y in points]
+                  for points in (P, Q, O)),
+            tuple([(x * 2 ** 40, y * 2 ** 40) for x, y in points]
+                  for points in (P, Q, O)),
+            near,
+        ]
+        if NUMPY_AVAILABLE:
+            inputs.append(tuple(
+                numpy.array(points, dtype=numpy.int64)
+                for points in (P, Q, O)))
+            inputs.append(tuple(
+                numpy.array(points, dtype=numpy.float64)
+                for points in near))
+        for P, Q, O in inputs:
+            for function, arrays, signs in [
+                    (vertex_sign, (P, O), vertex_signs(P, O)),
+                    (edge_sign, (P, Q, O), edge_signs(P, Q, O))]:
+                self.assertEqual(signs.typecode, "b")
+                expected = []
+                for points in zip(*arrays):
+                    try:
+                        expected.append(function(*points))
+                    except ValueError:
+                        expected.append(0)
+                self.assertEqual(list(signs), expected)
+
+        # Every float edge sign is counted once, as filtered or exact.
+        reset_predicate_counts()
+        edge_signs(*near)
+        self.assertEqual(
+            predicate_counts["filtered"] + predicate_counts["exact"], 500)
+        self.assertGreater(predicate_counts["exact"], 0)
+
+        with self.assertRaises(ValueError):
+            vertex_signs(P, O[1:])
+
+    def test_polygon_layer(self):
+        # A grid of unit squares, some in clockwise order, together with
+        # a large overlapping triangle.
+        polygons = []
+        for i in range(12):
+            for j in range(12):
+                square = [(i, j), (i + 1, j), (i + 1, j + 1), (i, j + 1)]
+                polygons.append(square if (i + j) % 3 else square[::-1])
+        polygons.append(Polygon([(0.3, 0.6), (9.7, 2.2), (3.4, 11.9)]))
+        polygons.append([(20, 20)])
+        layer = PolygonLayer(polygons, node_capacity=4)
+        self.assertEqual(len(layer), len(polygons))
+
+        reference = [
+            polygon if isinstance(polygon, Polygon) else Polygon(polygon)
+            for polygon in polygons]
+        points = [
+            (0.25 * x + 0.125, 0.25 * y + 0.125)
+            for x in range(-4, 52) for y in range(-4, 52)]
+        expected = [
+            [i for i, polygon in enumerate(reference)
+             if polygon.winding_number(point)]
+            for point in points]
+        self.assertEqual(
+            [layer.containing(point) for point in points], expected)
+        self.assertEqual(layer.containing_batch(points), expected)
+        self.assertEqual(
+            layer.containing_batch(points, processes=2, chunk_size=500),
+            expected)
+        self.assertEqual(layer.containing((0.55, 0.7)), [0, 144])
+
+        with self.assertRaises(ValueError):
+            layer.containing((1, 0.5))
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "layer.bin")
+            layer.save(path)
+            loaded = PolygonLayer.load(path)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(len(loaded), len(polygons))
+        self.assertEqual(
+            loaded.polygon(3).vertex_positions,
+            [(float(x), float(y)) for x, y in polygons[3]])
+        self.assertEqual(loaded.containing_batch(points), expected)
+
+        self.assertEqual(PolygonLayer([]).containing((0, 0)), [])
+        with self.assertRaises(ValueError):
+            PolygonLayer([[]])
+
     @unittest.skipUnless(NUMPY_AVAILABLE, "Test requires NumPy")
     def test_numpy_compatibility(self):
         square = Polygon(
@@ -144,3 +370,6 @@ class TestPolygon(unittest.TestCase):
         origin = numpy.array([0.0, 0.0], dtype=numpy.float64)
         self.assertEqual(square.winding_number(origin), 1)
         self.assertEqual(square.area(), 4.0)
+        self.assertEqual(square.centroid(), (0.0, 0.0))
+        self.assertEqual(square.perimeter(), 8.0)
+        self.assertEqual(square.area(exact=True), 4)
@@ -2,6 +2,12 @@
 Tests for Polyhedron winding number calculation.
 
 """
+import fractions
+import itertools
+import os
+import random
+import subprocess
+import sys
 import unittest
 
 try:
@@ -11,7 +17,20 @@ except ImportError:
 else:
     NUMPY_AVAILABLE = True
 
-from polyhedron import Polyhedron
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from polyhedron import (
+    BACKENDS, ON_SURFACE, Float32Positions, FootprintIndex, Polyhedron,
+    PolyhedronInstance, changed_triangles, chunked, convex_faces, convex_hull,
+    determinant, edge_sign, edge_signs, filtered_edge_sign,
+    filtered_orientation, filtered_triangle_chain, filtered_triangle_sign,
+    morton_order, plane_sign, plane_triangle_sign, shells, sign,
+    squared_distance_to_triangle, stream_winding_numbers, threaded_map,
+    triangle_chain, triangle_plane, triangle_sign, triangle_signs,
+    triangles_intersect, vertex_sign, vertex_signs, winding_number_changes)
 
 
 # Sample polyhedra ############################################################
@@ -242,7 +261,40 @@ twice_wrapped_octahedron = Polyhedron(
 )
 
 
+def box(lower, upper):
+    """
+    Axis-aligned box with the given opposite corners, oriented outwards.
+
+    """
+    return Polyhedron(
+        vertex_positions=[
+            tuple(u if c > 0 else l for l, u, c in zip(lower, upper, corner))
+            for corner in cube.vertex_positions],
+        triangles=cube.triangles,
+    )
+
+
+def general_winding_number(poly, point):
+    """
+    Winding number computed by the general algorithm, without shortcuts.
+
+    """
+    return sum(
+        triangle_chain(v1, v2, v3, point)
+        for v1, v2, v3 in poly.triangle_positions()) // 2
+
+
 class TestPolyhedron(unittest.TestCase):
+    def assertMatchesGeneral(self, poly, points):
+        for point in points:
+            try:
+                expected = general_winding_number(poly, point)
+            except ValueError:
+                with self.assertRaises(ValueError):
+                    poly.winding_number(point)
+            else:
+                self.assertEqual(poly.winding_number(point), expected)
+
     def test_invalid_polyhedra(self):
         with self.assertRaises(ValueError):
             # Tetrahedron with one face incorrectly oriented.
@@ -295,6 +347,62 @@ class TestPolyhedron(unittest.TestCase):
                 ],
             )
 
+    def test_validation_modes(self):
+        invalid_triangle_lists = [
+            # Tetrahedron with one face incorrectly oriented.
+            [[0, 1, 3], [0, 1, 2], [0, 3, 2], [1, 2, 3]],
+            # Tetrahedron with a duplicated face.
+            [[0, 1, 3], [0, 2, 1], [0, 3, 2], [1, 2, 3], [1, 2, 3]],
+            # Tetrahedron with a missing face.
+            [[0, 1, 3], [0, 2, 1], [0, 3, 2]],
+            # Self edge.
+            [[0, 1, 3], [0, 2, 1], [0, 3, 2], [1, 2, 3], [1, 1, 2]],
+            # Vertex out of range.
+            [[0, 1, 3], [0, 2, 1], [0, 3, 2], [1, 2, 3], [1, 2, 4],
+             [4, 2, 1]],
+            # Unused vertex.
+            [[0, 1, 3], [0, 3, 1]],
+        ]
+        for triangles in invalid_triangle_lists:
+            with self.assertRaises(ValueError):
+                Polyhedron(
+                    vertex_positions=tetrahedron.vertex_positions,
+                    triangles=triangles,
+                    validation="external",
+                )
+
+            poly = Polyhedron(
+                vertex_positions=tetrahedron.vertex_positions,
+                triangles=triangles,
+                validation="deferred",
+            )
+            with self.assertRaises(ValueError):
+                poly.classify((0.5, 0.5, 0.5))
+            with self.assertRaises(ValueError):
+                poly.classify_batch([(0.5, 0.5, 0.5)])
+            with self.assertRaises(ValueError):
+                poly.winding_number((0.5, 0.5, 0.5))
+            with self.assertRaises(ValueError):
+                poly.validate()
+
+        point = (0.25, 0.5, 0.5)
+        for poly in [nested_cube, torus, empty]:
+            for validation in ["deferred", "external"]:
+                checked = Polyhedron(
+                    vertex_positions=poly.vertex_positions,
+                    triangles=poly.triangles,
+                    validation=validation,
+                )
+                self.assertEqual(
+                    checked.winding_number(point), poly.winding_number(point))
+
+        with self.assertRaises(ValueError):
+            Polyhedron(
+                vertex_positions=cube.vertex_positions,
+                triangles=cube.triangles,
+                validation="none",
+            )
+
     def test_tetrahedron(self):
         xs = ys = zs = [0.25 * v for v in range(-1, 6)]
         points = [(x, y, z) for x in xs for y in ys for z in zs]
@@ -583,6 +691,1489 @@ class TestPolyhedron(unittest.TestCase):
         for point in points:
             self.assertEqual(empty.winding_number(point), 0)
 
+    def test_replace_triangles(self):
+        poly = Polyhedron(
+            vertex_positions=list(cube.vertex_positions),
+            triangles=list(cube.triangles),
+        )
+        # Raise the centre of the top face (z = 1) to make a pyramid roof.
+        (apex,) = poly.add_vertices([(0, 0, 2)])
+        poly.replace_triangles(
+            removed=[[1, 5, 7], [7, 3, 1]],
+            added=[[1, 5, apex], [5, 7, apex], [7, 3, apex], [3, 1, apex]],
+        )
+        self.assertEqual(len(poly.triangles), 14)
+        self.assertEqual(poly.volume(), 8.0 + 4.0 / 3.0)
+        self.assertEqual(poly.winding_number((0, 0, 1.5)), 1)
+        self.assertEqual(poly.winding_number((0.9, 0.9, 1.5)), 0)
+        with self.assertRaises(ValueError):
+            poly.winding_number((0, 0, 2))
+
+        # Undo the edit.
+        poly.replace_triangles(
+            removed=[[5, apex, 1], [apex, 5, 7], [7, 3, apex], [apex, 3, 1]],
+            added=[[1, 5, 7], [7, 3, 1]],
+        )
+        self.assertEqual(poly.volume(), 8.0)
+        self.assertEqual(poly.winding_number((0, 0, 1.5)), 0)
+
+        # The fixture itself is untouched.
+        self.assertEqual(len(cube.triangles), 12)
+        self.assertEqual(len(cube.vertex_positions), 8)
+
+    def test_edits_with_deferred_validation(self):
+        poly = Polyhedron(
+            vertex_positions=list(cube.vertex_positions),
+            triangles=list(cube.triangles),
+            validation="deferred",
+        )
+        (apex,) = poly.add_vertices([(0, 0, 2)])
+        poly.replace_triangles(
+            removed=[[1, 5, 7], [7, 3, 1]],
+            added=[[1, 5, apex], [5, 7, apex], [7, 3, apex], [3, 1, apex]],
+        )
+        self.assertEqual(poly.volume(), 8.0 + 4.0 / 3.0)
+        self.assertEqual(poly.winding_number((0, 0, 1.5)), 1)
+
+        # An invalid surface is still reported, before it's changed.
+        poly = Polyhedron(
+            vertex_positions=list(cube.vertex_positions),
+            triangles=list(cube.triangles[1:]),
+            validation="deferred",
+        )
+        with self.assertRaises(ValueError):
+            poly.add_vertices([(0, 0, 2)])
+        self.assertEqual(len(poly.vertex_positions), 8)
+
+    def test_edits_after_analysis(self):
+        for storage in [None, "float32"]:
+            self.check_edits_after_analysis(storage)
+
+    def check_edits_after_analysis(self, storage):
+        poly = Polyhedron(
+            vertex_positions=list(nested_cube.vertex_positions),
+            triangles=list(nested_cube.triangles),
+            storage=storage,
+        )
+        far_box = box((4, 4, 4), (5, 5, 5))
+        (apex,) = poly.add_vertices([(1.5, 1.5, 4)])
+        offset = len(poly.vertex_positions)
+        poly.add_vertices(far_box.vertex_positions)
+        inner = [[x + 8, y + 8, z + 8] for x, y, z in cube.triangles]
+        edits = [
+            # Flip the diagonal of the top face of the inner cube.
+            ([[9, 13, 15], [15, 11, 9]], [[9, 13, 11], [13, 15, 11]]),
+            # Put a pyramid roof on the outer cube.
+            ([[1, 5, 7], [7, 3, 1]],
+             [[1, 5, apex], [5, 7, apex], [7, 3, apex], [3, 1, apex]]),
+            # Add a separate shell.
+            ([], [[vx + offset for vx in t] for t in far_box.triangles]),
+            # Touch two shells at once, which merges them.
+            (cube.triangles[:2] + [
+                [vx + offset for vx in t] for t in far_box.triangles[:2]],
+             [list(t) for t in cube.triangles[:2]] + [
+                [vx + offset for vx in t] for t in far_box.triangles[:2]]),
+            # Remove the inner cube.
+            ([t for t in inner if t not in ([9, 13, 15], [15, 11, 9])] +
+             [[9, 13, 11], [13, 15, 11]], []),
+        ]
+        xs = ys = zs = [0.5 * v for v in range(-1, 12)]
+        points = [(x, y, z) for x in xs for y in ys for z in zs]
+        off_surface = [
+            point for point in points if all(c % 1 for c in point)]
+        for removed, added in edits:
+            poly.winding_number((0.25, 0.25, 0.25))
+            poly.replace_triangles(removed, added)
+            # The same surface analysed from scratch, without the unused
+            # vertices.
+            used = sorted(set(vx for t in poly.triangles for vx in t))
+            renumber = dict((vx, n) for n, vx in enumerate(used))
+            fresh = Polyhedron(
+                vertex_positions=[poly.vertex_positions[vx] for vx in used],
+                triangles=[[renumber[vx] for vx in t] for t in poly.triangles],
+            )
+
+            # The shells still partition the triangles, in the ray frame,
+            # with bounding boxes containing their triangles, and the
+            # index of each triangle's shell and position is up to date.
+            self.assertEqual(
+                sorted(index for shell in poly._shells for index in shell.ids),
+                list(range(len(poly.triangles))))
+            for shell in poly._shells:
+                for slot, index in enumerate(shell.ids):
+                    self.assertIs(poly._triangle_shells[index], shell)
+                    self.assertEqual(poly._triangle_slots[index], slot)
+                    triangle = poly._shell_positions(shell)[slot]
+                    self.assertEqual(triangle, tuple(
+                        poly._ray_frame(poly.vertex_positions[vx])
+                        for vx in poly.triangles[index]))
+                    if storage == "float32":
+                        self.assertIsNone(shell.planes)
+                    else:
+                        self.assertEqual(
+                            shell.planes[slot], triangle_plane(*triangle))
+                    for vertex in triangle:
+                        self.assertTrue(all(
+                            shell.lower[i] <= vertex[i] <= shell.upper[i]
+                            for i in range(3)))
+
+            expected = fresh.winding_numbers(off_surface, backend="python")
+            for backend in BACKENDS:
+                self.assertEqual(
+                    poly.winding_numbers(off_surface, backend=backend),
+                    expected)
+            for method in ["sweep", "coherent"]:
+                self.assertEqual(
+                    poly.winding_numbers(off_surface, method=method),
+                    expected)
+            results = poly.classify_batch(points, return_triangle=True)
+            self.assertEqual(
+                [classification for classification, _ in results],
+                fresh.classify_batch(points))
+            for point, (_, triangle) in zip(points, results):
+                if triangle is not None:
+                    v1, v2, v3 = [
+                        poly.vertex_positions[vx]
+                        for vx in poly.triangles[triangle]]
+                    with self.assertRaises(ValueError):
+                        triangle_chain(v1, v2, v3, point)
+            self.assertEqual(
+                poly.column_crossings(0.5, 0.5),
+                fresh.column_crossings(0.5, 0.5))
+        self.assertEqual(len(poly._shells), 1)
+        self.assertFalse(poly.is_convex())
+
+    def test_invalid_edits(self):
+        poly = Polyhedron(
+            vertex_positions=list(cube.vertex_positions),
+            triangles=list(cube.triangles),
+        )
+        triangles = list(poly.triangles)
+
+        with self.assertRaises(ValueError):
+            # Triangle not present.
+            poly.replace_triangles(removed=[[1, 7, 5]], added=[[1, 7, 5]])
+
+        with self.assertRaises(ValueError):
+            # Removing a face without replacement leaves unmatched edges.
+            poly.replace_triangles(removed=[[1, 5, 7]], added=[])
+
+        with self.assertRaises(ValueError):
+            # Adding a face that's already present.
+            poly.replace_triangles(removed=[], added=[[5, 7, 1]])
+
+        with self.assertRaises(ValueError):
+            # Replacement with a different boundary.
+            poly.replace_triangles(
+                removed=[[1, 5, 7], [7, 3, 1]],
+                added=[[1, 5, 7], [7, 3, 0]],
+            )
+
+        with self.assertRaises(ValueError):
+            # Self edge.
+            poly.replace_triangles(removed=[], added=[[1, 1, 2]])
+
+        with self.assertRaises(ValueError):
+            # Nonexistent vertex.
+            poly.replace_triangles(removed=[], added=[[1, 2, 8], [8, 2, 1]])
+
+        # Failed edits leave the polyhedron unchanged.
+        self.assertEqual(poly.triangles, [tuple(t) for t in triangles])
+        self.assertEqual(poly.volume(), 8.0)
+
+        # Flipping the diagonal of the top face is fine.
+        poly.replace_triangles(
+            removed=[[1, 5, 7], [7, 3, 1]],
+            added=[[1, 5, 3], [5, 7, 3]],
+        )
+        self.assertEqual(poly.volume(), 8.0)
+        self.assertEqual(poly.winding_number((0, 0, 0)), 1)
+
+    def test_convexity_detection(self):
+        for poly in [tetrahedron, octahedron, cube]:
+            self.assertTrue(poly.is_convex())
+
+        non_convex = [
+            twice_wrapped_octahedron, pair_of_cubes, aligned_stacked_cuboids,
+            misaligned_stacked_cuboids, hollow_cube, nested_cube, torus,
+            empty, triangle,
+        ]
+        for poly in non_convex:
+            self.assertFalse(poly.is_convex())
+
+        # Inside-out cube.
+        inverted_cube = Polyhedron(
+            vertex_positions=cube.vertex_positions,
+            triangles=[face[::-1] for face in cube.triangles],
+        )
+        self.assertFalse(inverted_cube.is_convex())
+
+        # Float coordinates.
+        float_cube = Polyhedron(
+            vertex_positions=[
+                tuple(0.1 * c for c in position)
+                for position in cube.vertex_positions
+            ],
+            triangles=cube.triangles,
+        )
+        self.assertTrue(float_cube.is_convex())
+
+        # Float cubes with vertices moved by a few units in the last place,
+        # where the filtered predicates must agree with exact arithmetic.
+        rng = random.Random(13579)
+        for _ in range(200):
+            positions = [
+                tuple(0.1 * c + rng.choice([-2, 0, 0, 1]) * 2.0 ** -55
+                      for c in position)
+                for position in cube.vertex_positions]
+            exact_positions = [
+                tuple(fractions.Fraction(c) for c in position)
+                for position in positions]
+            self.assertEqual(
+                convex_faces(cube.triangles, positions) is None,
+                convex_faces(cube.triangles, exact_positions) is None)
+
+        # Convexity is rechecked by the first query after an edit: a pyramid
+        # on top of the cube keeps it convex, while a dent in the top face
+        # doesn't.
+        for apex_position, expected in [((0, 0, 2), True), ((0, 0, 0), False)]:
+            poly = Polyhedron(
+                vertex_positions=list(cube.vertex_positions),
+                triangles=list(cube.triangles),
+            )
+            self.assertTrue(poly.is_convex())
+            (apex,) = poly.add_vertices([apex_position])
+            poly.replace_triangles(
+                removed=[[1, 5, 7], [7, 3, 1]],
+                added=[
+                    [1, 5, apex], [5, 7, apex], [7, 3, apex], [3, 1, apex]],
+            )
+            self.assertEqual(poly.winding_number((0.5, 0.5, -0.5)), 1)
+            self.assertEqual(poly._convex_faces is not None, expected)
+            self.assertEqual(poly.is_convex(), expected)
+
+            # An edit away from the dent leaves it, and with it the
+            # knowledge that the surface isn't convex.
+            poly.replace_triangles(
+                removed=[[1, 0, 4], [4, 5, 1]],
+                added=[[1, 0, 5], [0, 4, 5]],
+            )
+            self.assertEqual(poly._convexity_known, not expected)
+            self.assertEqual(poly.is_convex(), expected)
+
+    def test_convex_fast_path(self):
+        xs = ys = zs = [0.25 * v for v in range(-5, 6)]
+        points = [(x, y, z) for x in xs for y in ys for z in zs]
+        for poly in [tetrahedron, octahedron, cube]:
+            self.assertMatchesGeneral(poly, points)
+            self.assertEqual(
+                poly.winding_numbers([(0.3, 0.3, 0.3), (2, 2, 2)]), [1, 0])
+
+    def test_convex_hull(self):
+        points = list(cube.vertex_positions) + [(0, 0, 0), (1, 1, 0)]
+        faces = convex_hull(points)
+        self.assertEqual(len(faces), 12)
+        self.assertEqual(
+            set(vx for face in faces for vx in face), set(range(8)))
+        signs = []
+        for face in faces:
+            P, Q, R = [points[vx] for vx in face]
+            self.assertEqual(triangle_sign(P, Q, R, (0.5, 0.5, 0.5)), 1)
+            signs.append(triangle_sign(P, Q, R, (1.5, 0.5, 0.5)))
+        self.assertEqual(signs.count(-1), 2)
+
+        # Float points, many of them nearly coplanar or nearly on the hull,
+        # give the same hull as their exact values.
+        random.seed(28)
+        points = [
+            (x, y, 1.0 - x - y)
+            for x, y in [(random.random(), random.random())
+                         for _ in range(200)]]
+        points.extend(
+            tuple(random.uniform(0.1, 0.3) for _ in range(3))
+            for _ in range(50))
+        points.append((-1.0, -1.0, -1.0))
+        exact_points = [
+            tuple(fractions.Fraction(c) for c in point) for point in points]
+
+        def volume(faces):
+            return sum(
+                determinant(*[exact_points[vx] for vx in face] +
+                            [exact_points[-1]])
+                for face in faces)
+
+        faces = convex_hull(points)
+        self.assertEqual(volume(faces), volume(convex_hull(exact_points)))
+        edges = [(face[i - 1], face[i]) for face in faces for i in range(3)]
+        self.assertEqual(
+            sorted(edges), sorted((Q, P) for P, Q in edges))
+        for face in faces:
+            for point in exact_points:
+                self.assertGreaterEqual(
+                    determinant(*[exact_points[vx] for vx in face] + [point]),
+                    0)
+
+        # Degenerate point sets.
+        self.assertIsNone(convex_hull([]))
+        self.assertIsNone(convex_hull([(0, 0, 0), (1, 1, 1), (2, 2, 2)]))
+        self.assertIsNone(
+            convex_hull([(0, 0, 0), (1, 0, 0), (0, 1, 0), (1, 1, 0)]))
+
+    def test_hull_prefilter(self):
+        poly = Polyhedron(
+            vertex_positions=torus.vertex_positions,
+            triangles=torus.triangles,
+        )
+        self.assertEqual(poly.hull_rejections, 0)
+        # Inside the bounding box and the hull, but outside the torus.
+        self.assertEqual(poly.winding_number((1.5, 1.5, 0.5)), 0)
+        self.assertEqual(poly.hull_rejections, 0)
+        # Outside the bounding box.
+        self.assertEqual(poly.winding_number((1.5, 1.5, 1.5)), 0)
+        self.assertEqual(poly.hull_rejections, 1)
+
+        poly = Polyhedron(
+            vertex_positions=misaligned_stacked_cuboids.vertex_positions,
+            triangles=misaligned_stacked_cuboids.triangles,
+        )
+        # Inside the bounding box, but outside the hull.
+        self.assertEqual(
+            poly.winding_numbers([(2.5, 0.5, 0.5), (0.5, 2.5, 2.5)]), [0, 0])
+        self.assertEqual(poly.hull_rejections, 2)
+
+        # The sweep and coherent methods apply the prefilter too.
+        xs = ys = zs = [0.5 * v + 0.25 for v in range(-1, 8)]
+        points = [(x, y, z) for x in xs for y in ys for z in zs]
+        expected = poly.winding_numbers(points, backend="python")
+        for method in ["sweep", "coherent"]:
+            copy = Polyhedron(
+                vertex_positions=poly.vertex_positions,
+                triangles=poly.triangles,
+            )
+            self.assertEqual(
+                copy.winding_numbers(points, method=method), expected)
+            self.assertEqual(
+                copy.hull_rejections, poly.hull_rejections - 2)
+
+        # For float data, a hull face only rejects a point if the error
+        # bound certifies its sign.  Points on the slanted faces of the
+        # hull are within rounding error of their planes, so aren't
+        # rejected, whichever side of the plane they're rounded to.
+        positions = [
+            tuple(0.1 * c + 0.07 for c in position)
+            for position in misaligned_stacked_cuboids.vertex_positions]
+        poly = Polyhedron(
+            vertex_positions=positions,
+            triangles=misaligned_stacked_cuboids.triangles,
+        )
+        rng = random.Random(0)
+        for face in convex_hull(positions):
+            P, Q, R = [positions[vx] for vx in face]
+            for _ in range(50):
+                a, b = rng.random(), rng.random()
+                if a + b > 1:
+                    a, b = 1 - a, 1 - b
+                point = tuple(
+                    P[i] + a * (Q[i] - P[i]) + b * (R[i] - P[i])
+                    for i in range(3))
+                self.assertFalse(poly._outside_hull(point))
+
+    def test_shells(self):
+        self.assertEqual(len(shells(cube.triangles)), 1)
+        self.assertEqual(len(shells(torus.triangles)), 1)
+        self.assertEqual(len(shells(pair_of_cubes.triangles)), 2)
+        self.assertEqual(len(shells(nested_cube.triangles)), 2)
+        self.assertEqual(len(shells(empty.triangles)), 0)
+        self.assertEqual(
+            shells(hollow_cube.triangles),
+            [list(range(12)), list(range(12, 24))],
+        )
+
+        # A row of cubes, one of which contains the query point.
+        row = Polyhedron(
+            vertex_positions=[
+                (x + 3 * i, y, z)
+                for i in range(10)
+                for x, y, z in cube.vertex_positions
+            ],
+            triangles=[
+                [vx + 8 * i for vx in triangle]
+                for i in range(10)
+                for triangle in cube.triangles
+            ],
+        )
+        self.assertEqual(len(shells(row.triangles)), 10)
+        self.assertEqual(row.winding_number((12.5, 0.5, 0.5)), 1)
+        self.assertEqual(row.winding_number((13.5, 0.5, 0.5)), 0)
+        with self.assertRaises(ValueError):
+            row.winding_number((13, 0.5, 0.5))
+
+    def test_section(self):
+        square = cube.section(0.5)
+        self.assertEqual(len(square), 1)
+        self.assertEqual(square[0].area(), 4.0)
+        self.assertEqual(square[0].winding_number((0.5, 0.5)), 1)
+        with self.assertRaises(ValueError):
+            square[0].winding_number((1.0, 0.5))
+        self.assertEqual(cube.section(2), [])
+
+        # The section of the torus by a horizontal plane is an annulus.
+        annulus = torus.section(0.5)
+        self.assertEqual(len(annulus), 2)
+        self.assertEqual(sum(polygon.area() for polygon in annulus), 8.0)
+
+        # The sections must agree with the polyhedron's winding numbers at
+        # points of the plane that aren't on the surface, including planes
+        # through vertices and faces.
+        polys = [
+            tetrahedron, octahedron, cube, pair_of_cubes, torus, hollow_cube,
+            nested_cube, aligned_stacked_cuboids, misaligned_stacked_cuboids,
+            twice_wrapped_octahedron,
+        ]
+        values = [0.25 * v for v in range(-5, 14)]
+        for poly in polys:
+            for axis in range(3):
+                for value in [-1, -0.5, 0, 0.5, 1, 2, 2.5]:
+                    polygons = poly.section(value, axis=axis)
+                    for u in values:
+                        for v in values:
+                            point = [None] * 3
+                            point[axis] = value
+                            point[(axis + 1) % 3] = u
+                            point[(axis + 2) % 3] = v
+                            try:
+                                expected = poly.winding_number(point)
+                            except ValueError:
+                                continue
+                            actual = sum(
+                                polygon.winding_number((u, v))
+                                for polygon in polygons)
+                            self.assertEqual(actual, expected)
+
+    def test_matches_general_algorithm(self):
+        xs = ys = zs = [0.25 * v for v in range(-5, 14)]
+        points = [(x, y, z) for x in xs for y in ys for z in zs]
+        polys = [
+            tetrahedron, octahedron, cube, pair_of_cubes,
+            aligned_stacked_cuboids, misaligned_stacked_cuboids,
+            hollow_cube, nested_cube, torus, empty, triangle,
+            twice_wrapped_octahedron,
+        ]
+        for poly in polys:
+            self.assertMatchesGeneral(poly, points)
+
+    def test_instances(self):
+        # Transformations given as (matrix, translation).
+        transforms = [
+            # Identity.
+            ([[1, 0, 0], [0, 1, 0], [0, 0, 1]], (0, 0, 0)),
+            # Translation.
+            ([[1, 0, 0], [0, 1, 0], [0, 0, 1]], (10, -3, 2)),
+            # Rotation about the z-axis, with translation.
+            ([[0, -1, 0], [1, 0, 0], [0, 0, 1]], (1, 2, 3)),
+            # Shear and scale.
+            ([[2, 1, 0], [0, 1, 0], [0, 1, 3]], (0, 0, 1)),
+            # Reflection in the xy-plane.
+            ([[1, 0, 0], [0, 1, 0], [0, 0, -1]], (0, 0, 0)),
+            # Permutation of axes (orientation-reversing).
+            ([[0, 1, 0], [1, 0, 0], [0, 0, 1]], (0.5, 0, 0)),
+        ]
+        xs = ys = zs = [fractions.Fraction(v, 2) for v in range(-2, 7)]
+        points = [(x, y, z) for x in xs for y in ys for z in zs]
+        float_points = [
+            (float(x) + 0.123, float(y) + 0.271, float(z) + 0.314)
+            for x, y, z in points]
+        for poly in [cube, torus, tetrahedron]:
+            for matrix, translation in transforms:
+                instance = PolyhedronInstance(poly, matrix, translation)
+
+                # Compare with an explicitly transformed copy.
+                transformed = Polyhedron(
+                    triangles=poly.triangles,
+                    vertex_positions=[
+                        tuple(
+                            sum(row[k] * position[k] for k in range(3)) +
+                            translation[i]
+                            for i, row in enumerate(matrix)
+                        )
+                        for position in poly.vertex_positions
+                    ],
+                )
+                self.assertEqual(instance.volume(), transformed.volume())
+                expected = []
+                for point in points:
+                    try:
+                        expected.append(transformed.winding_number(point))
+                    except ValueError:
+                        with self.assertRaises(ValueError):
+                            instance.winding_number(point)
+                        expected.append(None)
+                    else:
+                        self.assertEqual(
+                            instance.winding_number(point), expected[-1])
+                inside = [
+                    point for point, winding_number in zip(points, expected)
+                    if winding_number is not None]
+                self.assertEqual(
+                    instance.winding_numbers(inside),
+                    [winding_number for winding_number in expected
+                     if winding_number is not None],
+                )
+
+                # Float points are mapped back in floating-point, which
+                # agrees with the exact results away from the surface.
+                self.assertEqual(
+                    instance.winding_numbers(float_points),
+                    transformed.winding_numbers(float_points))
+
+        with self.assertRaises(ValueError):
+            PolyhedronInstance(cube, [[1, 0, 0], [0, 1, 0], [1, 1, 0]])
+
+    def test_stream_winding_numbers(self):
+        xs = ys = zs = [0.5 * v + 0.25 for v in range(-3, 7)]
+        points = [(x, y, z) for x in xs for y in ys for z in zs]
+        fraction_points = [
+            tuple(fractions.Fraction(c) for c in point)
+            for point in points[::7]]
+        for backend in BACKENDS:
+            for poly in [cube, torus, nested_cube, pair_of_cubes, empty]:
+                expected = poly.winding_numbers(points)
+                for size in [1, 5, 100]:
+                    chunks = chunked(poly.triangle_positions(), size)
+                    self.assertEqual(
+                        stream_winding_numbers(points, chunks, backend),
+                        expected)
+                # Data the kernel can't handle exactly.
+                chunks = chunked(poly.triangle_positions(), 5)
+                self.assertEqual(
+                    stream_winding_numbers(fraction_points, chunks, backend),
+                    expected[::7])
+
+            with self.assertRaises(ValueError):
+                stream_winding_numbers(
+                    [(0, 0, 0), (0, 0, 1)],
+                    chunked(cube.triangle_positions(), 4), backend)
+
+        with self.assertRaises(ValueError):
+            stream_winding_numbers(points, [], backend="fortran")
+
+    def test_sweep(self):
+        xs = ys = zs = [0.5 * v + 0.25 for v in range(-3, 7)]
+        points = [(x, y, z) for x in xs for y in ys for z in zs]
+        polys = [
+            cube, torus, nested_cube, hollow_cube, pair_of_cubes,
+            misaligned_stacked_cuboids, twice_wrapped_octahedron, empty,
+        ]
+        for poly in polys:
+            self.assertEqual(
+                poly.winding_numbers(points, method="sweep"),
+                poly.winding_numbers(points),
+            )
+
+        # Points lying on vertices, edges and faces of the tetrahedron.
+        xs = ys = zs = [0.25 * v for v in range(-1, 6)]
+        points = [(x, y, z) for x in xs for y in ys for z in zs]
+        for point in points:
+            if tetrahedron_classify(point) == "boundary":
+                with self.assertRaises(ValueError):
+                    tetrahedron.winding_numbers([point], method="sweep")
+        interior = [
+            point for point in points
+            if tetrahedron_classify(point) != "boundary"]
+        self.assertEqual(
+            tetrahedron.winding_numbers(interior, method="sweep"),
+            tetrahedron.winding_numbers(interior),
+        )
+
+        with self.assertRaises(ValueError):
+            cube.winding_numbers(points, method="unknown")
+
+    def test_ray_axis(self):
+        # A stack of thin horizontal plates: vertical rays would cross
+        # every plate, so a horizontal ray axis should be chosen.
+        corners = [(0, 0, 0), (0, 0, 1), (0, 4, 0), (0, 4, 1),
+                   (6, 0, 0), (6, 0, 1), (6, 4, 0), (6, 4, 1)]
+        plates = dict(
+            vertex_positions=[
+                (x, y, z + 3 * k) for k in range(3) for x, y, z in corners],
+            triangles=[
+                [x + 8 * k, y + 8 * k, z + 8 * k]
+                for k in range(3) for x, y, z in cube.triangles],
+        )
+        stack = Polyhedron(**plates)
+        values = [0.5 * v + 0.25 for v in range(-2, 18)]
+        points = [(x, y, z) for x in values[:15] for y in values[:11]
+                  for z in values]
+        expected = [
+            int(0 < x < 6 and 0 < y < 4 and 0 < z < 9 and z % 3 < 1)
+            for x, y, z in points]
+        self.assertEqual(stack.winding_numbers(points), expected)
+        self.assertEqual(stack.ray_axis, 0)
+        self.assertEqual(
+            stack.winding_numbers(points, method="sweep"), expected)
+        self.assertMatchesGeneral(stack, points[::7])
+
+        for axis in range(3):
+            poly = Polyhedron(ray_axis=axis, **plates)
+            self.assertEqual(
+                poly.winding_numbers(points, backend="python"), expected)
+            self.assertEqual(poly.ray_axis, axis)
+
+        cube.winding_number((5, 5, 5))
+        self.assertEqual(cube.ray_axis, 2)
+
+        # Float coordinates keep the z-axis unless they're stored as
+        # float32, for which the filtered predicates are exact.
+        float_plates = dict(
+            plates, vertex_positions=[
+                tuple(float(c) for c in position)
+                for position in plates["vertex_positions"]])
+        poly = Polyhedron(**float_plates)
+        self.assertEqual(poly.winding_numbers(points), expected)
+        self.assertEqual(poly.ray_axis, 2)
+        poly = Polyhedron(storage="float32", **float_plates)
+        self.assertEqual(poly.winding_numbers(points), expected)
+        self.assertEqual(poly.ray_axis, 0)
+
+        with self.assertRaises(ValueError):
+            Polyhedron(ray_axis=3, **plates)
+
+    def test_backends(self):
+        xs = ys = zs = [0.5 * v + 0.25 for v in range(-3, 7)]
+        points = [(x, y, z) for x in xs for y in ys for z in zs]
+        integer_points = [(x, y, z) for x in range(-1, 4)
+                          for y in range(-1, 4) for z in range(-1, 4)]
+        polys = [
+            cube, torus, nested_cube, hollow_cube, pair_of_cubes,
+            twice_wrapped_octahedron, empty,
+        ]
+        for backend in BACKENDS:
+            for poly in polys:
+                self.assertEqual(
+                    poly.winding_numbers(points, backend=backend),
+                    poly.winding_numbers(points, backend="python"),
+                )
+            self.assertEqual(
+                torus.winding_numbers([(1, 1, -1), (4, 4, 4)],
+                                      backend=backend),
+                [0, 0],
+            )
+            with self.assertRaises(ValueError):
+                cube.winding_numbers(integer_points, backend=backend)
+
+            # The hull prefilter rejects the same points with each backend.
+            for poly in [misaligned_stacked_cuboids, torus, empty]:
+                off_surface = [
+                    point for point in integer_points
+                    if poly.classify(point) != ON_SURFACE]
+                for batch in [points, off_surface]:
+                    copy = Polyhedron(
+                        vertex_positions=poly.vertex_positions,
+                        triangles=poly.triangles,
+                    )
+                    copy.winding_numbers(batch, backend=backend)
+                    python_copy = Polyhedron(
+                        vertex_positions=poly.vertex_positions,
+                        triangles=poly.triangles,
+                    )
+                    python_copy.winding_numbers(batch, backend="python")
+                    self.assertEqual(
+                        copy.hull_rejections, python_copy.hull_rejections)
+
+        with self.assertRaises(ValueError):
+            cube.winding_numbers(points, backend="fortran")
+
+    def test_coherent(self):
+        xs = ys = zs = [0.5 * v + 0.25 for v in range(-3, 7)]
+        points = [(x, y, z) for x in xs for y in ys for z in zs]
+        points = points[::-1] + points[1::3]
+        polys = [
+            cube, torus, nested_cube, hollow_cube, pair_of_cubes,
+            misaligned_stacked_cuboids, twice_wrapped_octahedron, empty,
+        ]
+        for poly in polys:
+            self.assertEqual(
+                poly.winding_numbers(points, method="coherent"),
+                poly.winding_numbers(points, backend="python"),
+            )
+
+        xs = ys = zs = [0.25 * v for v in range(-1, 6)]
+        points = [(x, y, z) for x in xs for y in ys for z in zs]
+        for point in points:
+            if tetrahedron_classify(point) == "boundary":
+                with self.assertRaises(ValueError):
+                    tetrahedron.winding_numbers([point], method="coherent")
+        interior = [
+            point for point in points
+            if tetrahedron_classify(point) != "boundary"]
+        self.assertEqual(
+            tetrahedron.winding_numbers(interior, method="coherent"),
+            tetrahedron.winding_numbers(interior, backend="python"),
+        )
+
+    def test_morton_order(self):
+        self.assertEqual(morton_order([]), [])
+        points = [(x, y, 0) for y in range(4) for x in range(4)]
+        order = morton_order(points)
+        self.assertEqual(
+            [points[i][:2] for i in order[:8]],
+            [(0, 0), (1, 0), (0, 1), (1, 1),
+             (2, 0), (3, 0), (2, 1), (3, 1)],
+        )
+        self.assertEqual(sorted(order), list(range(16)))
+
+    def test_footprint_index(self):
+        index = FootprintIndex(torus.triangle_positions())
+        for xmin, xmax, ymin, ymax in [
+                (0, 0, 0, 0), (-5, 5, -5, 5), (0.5, 1.5, 2, 2.5),
+                (10, 11, 10, 11)]:
+            expected = [
+                t for t, (v1, v2, v3) in enumerate(torus.triangle_positions())
+                if min(v1[0], v2[0], v3[0]) <= xmax and
+                xmin <= max(v1[0], v2[0], v3[0]) and
+                min(v1[1], v2[1], v3[1]) <= ymax and
+                ymin <= max(v1[1], v2[1], v3[1])]
+            self.assertEqual(
+                index.candidates(xmin, xmax, ymin, ymax), expected)
+        self.assertEqual(FootprintIndex([]).candidates(0, 1, 0, 1), [])
+
+    def test_threads(self):
+        xs = ys = zs = [0.5 * v + 0.25 for v in range(-3, 7)]
+        points = [(x, y, z) for x in xs for y in ys for z in zs]
+        polys = [
+            cube, torus, nested_cube, hollow_cube, pair_of_cubes,
+            twice_wrapped_octahedron, empty,
+        ]
+        for backend in BACKENDS:
+            for poly in polys:
+                expected = poly.winding_numbers(points, backend="python")
+                for threads in [1, 2, 3, 8]:
+                    self.assertEqual(
+                        poly.winding_numbers(
+                            points, backend=backend, threads=threads),
+                        expected,
+                    )
+            self.assertEqual(
+                cube.winding_numbers([], backend=backend, threads=4), [])
+
+            # The first point on the surface determines the error.
+            with self.assertRaises(ValueError):
+                cube.winding_numbers(
+                    points + [(1, 0, 0)], backend=backend, threads=4)
+
+        for threads in [0, -1, 1.5]:
+            with self.assertRaises(ValueError):
+                cube.winding_numbers(points, threads=threads)
+        with self.assertRaises(ValueError):
+            cube.winding_numbers(points, method="sweep", threads=2)
+
+    @unittest.skipUnless("numba" in BACKENDS, "Numba not available")
+    def test_process_pool_after_numba(self):
+        # Worker processes forked after Numba's parallel kernels had run
+        # used to leave the interpreter hanging at exit.
+        script = "\n".join([
+            "from polygon import Polygon, PolygonLayer",
+            "from test_polyhedron import cube",
+            "cube.winding_numbers([(0.5, 0.5, 0.5)], backend='numba')",
+            "layer = PolygonLayer([Polygon([(0, 0), (2, 0), (0, 2)])])",
+            "print(layer.containing_batch(",
+            "    [(0.5, 0.5), (3, 3)], processes=2, chunk_size=1))",
+        ])
+        output = subprocess.check_output(
+            [sys.executable, "-c", script],
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=300)
+        self.assertEqual(output.decode().split(), ["[[0],", "[]]"])
+
+    def test_threaded_map(self):
+        def check(chunk):
+            if chunk < 0:
+                raise ValueError(chunk)
+            return 2 * chunk
+
+        for threads in [1, 2, 5, 20]:
+            self.assertEqual(
+                threaded_map(check, list(range(10)), threads),
+                [2 * n for n in range(10)],
+            )
+            with self.assertRaises(ValueError) as cm:
+                threaded_map(check, [0, 1, -2, 3, -4, 5], threads)
+            self.assertEqual(cm.exception.args, (-2,))
+
+    def test_float32_storage(self):
+        xs = ys = zs = [0.5 * v + 0.25 for v in range(-3, 7)]
+        points = [(x, y, z) for x in xs for y in ys for z in zs]
+        polys = [
+            cube, torus, nested_cube, hollow_cube, pair_of_cubes,
+            twice_wrapped_octahedron, empty,
+        ]
+        for poly in polys:
+            compact = Polyhedron(
+                triangles=poly.triangles,
+                vertex_positions=poly.vertex_positions,
+                storage="float32",
+            )
+            self.assertEqual(
+                compact.vertex_positions.nbytes,
+                12 * len(poly.vertex_positions))
+            self.assertEqual(
+                list(compact.vertex_positions),
+                [tuple(map(float, p)) for p in poly.vertex_positions])
+            for method in ["pointwise", "sweep", "coherent"]:
+                self.assertEqual(
+                    compact.winding_numbers(points, method=method),
+                    poly.winding_numbers(points, backend="python"),
+                )
+
+        # Coordinates are rounded to float32, and points on the rounded
+        # surface are detected exactly.
+        compact = Polyhedron(
+            triangles=tetrahedron.triangles,
+            vertex_positions=[
+                (0.1 * x, 0.1 * y, 0.1 * z)
+                for x, y, z in tetrahedron.vertex_positions],
+            storage="float32",
+        )
+        P, Q, R = list(compact.triangle_positions())[0]
+        self.assertNotEqual(max(P + Q + R), 0.1)
+        for point in [P, Q, tuple((p + q) / 2 for p, q in zip(P, Q))]:
+            with self.assertRaises(ValueError):
+                compact.winding_number(point)
+
+        # Edits keep the compact storage.
+        compact.add_vertices([(1, 2, 3)])
+        self.assertIsInstance(compact.vertex_positions, Float32Positions)
+        self.assertEqual(compact.vertex_positions[-1], (1.0, 2.0, 3.0))
+
+        with self.assertRaises(ValueError):
+            Polyhedron(
+                triangles=cube.triangles,
+                vertex_positions=cube.vertex_positions,
+                storage="float16",
+            )
+
+    @unittest.skipUnless(tracemalloc, "Test requires tracemalloc")
+    def test_float32_memory(self):
+        # A cube with each face divided into a 10 x 10 grid, and a row of
+        # separate boxes; after a query, the polyhedron with float32
+        # storage, including the data computed for queries, should take
+        # much less memory than with float64 positions.
+        n = 10
+        grid = dict(((x, y, z), None) for x in range(n + 1)
+                    for y in range(n + 1) for z in range(n + 1)
+                    if 0 in (x, y, z) or n in (x, y, z))
+        positions = sorted(grid)
+        index = dict((position, vx) for vx, position in enumerate(positions))
+        triangles = []
+        for axis in range(3):
+            for side in (0, n):
+                for i in range(n):
+                    for j in range(n):
+                        corners = []
+                        for a, b in [(i, j), (i + 1, j), (i + 1, j + 1),
+                                     (i, j + 1)]:
+                            position = [0, 0, 0]
+                            position[axis] = side
+                            position[(axis + 1) % 3] = a
+                            position[(axis + 2) % 3] = b
+                            corners.append(index[tuple(position)])
+                        P, Q, R, S = corners if side else corners[::-1]
+                        triangles += [(P, Q, R), (P, R, S)]
+        surfaces = [(triangles, positions)]
+
+        triangles, positions = [], []
+        for k in range(50):
+            part = box((2 * k, 0, 0), (2 * k + 1, 1, 1))
+            triangles += [
+                [vx + len(positions) for vx in t] for t in part.triangles]
+            positions += part.vertex_positions
+        surfaces.append((triangles, positions))
+
+        for triangles, positions in surfaces:
+            used = {}
+            for storage in [None, "float32"]:
+                tracemalloc.start()
+                try:
+                    poly = Polyhedron(
+                        triangles=triangles,
+                        vertex_positions=[
+                            tuple(float(c) for c in position)
+                            for position in positions],
+                        storage=storage,
+                    )
+                    self.assertEqual(poly.winding_number((0.5, 0.5, 0.5)), 1)
+                    used[storage] = tracemalloc.get_traced_memory()[0]
+                finally:
+                    tracemalloc.stop()
+                del poly
+            self.assertLess(used["float32"], used[None] // 2)
+
+    def test_filtered_predicates(self):
+        def exact_point(point):
+            return [fractions.Fraction(c) for c in point]
+
+        # Nearly degenerate configurations, where rounding errors in a
+        # naive floating-point evaluation can give the wrong sign.
+        rng = random.Random(24680)
+        for _ in range(2000):
+            base = [rng.choice([0.1, 0.3, 0.7, 1e10]) for _ in range(3)]
+            direction = [rng.choice([0.1, 0.2, -0.3]) for _ in range(3)]
+            P, Q, R, O = [
+                tuple(b + t * d + rng.choice([0.0, 0.0, 1e-17]) * e
+                      for b, d, e in zip(base, direction, (1, 2, 3)))
+                for t in [rng.uniform(-2, 2) for _ in range(4)]]
+            exact = [exact_point(point) for point in (P, Q, R, O)]
+            self.assertEqual(
+                filtered_orientation(P, Q, R, O),
+                sign(determinant(*exact)))
+            try:
+                expected = edge_sign(exact[0], exact[1], exact[3])
+            except ValueError:
+                with self.assertRaises(ValueError):
+                    filtered_edge_sign(P, Q, O)
+            else:
+                self.assertEqual(filtered_edge_sign(P, Q, O), expected)
+            try:
+                expected = triangle_chain(*exact)
+            except ValueError:
+                with self.assertRaises(ValueError):
+                    filtered_triangle_chain(P, Q, R, O)
+            else:
+                self.assertEqual(filtered_triangle_chain(P, Q, R, O), expected)
+
+        if NUMPY_AVAILABLE:
+            O = numpy.array([0.1, 0.1, 0.1])
+            self.assertEqual(
+                filtered_triangle_chain(
+                    (1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0), O),
+                1)
+
+    def test_classify(self):
+        xs = ys = zs = [0.5 * v for v in range(-3, 4)]
+        points = [(x, y, z) for x in xs for y in ys for z in zs]
+        for poly in [cube, torus, hollow_cube, pair_of_cubes]:
+            results = poly.classify_batch(points, return_triangle=True)
+            self.assertEqual(
+                results, [poly.classify(point, return_triangle=True)
+                          for point in points])
+            self.assertEqual(
+                poly.classify_batch(points),
+                [classification for classification, _ in results])
+            for point, (classification, triangle) in zip(points, results):
+                try:
+                    expected = poly.winding_number(point)
+                except ValueError:
+                    self.assertEqual(classification, ON_SURFACE)
+                    v1, v2, v3 = [
+                        poly.vertex_positions[vx]
+                        for vx in poly.triangles[triangle]]
+                    with self.assertRaises(ValueError):
+                        triangle_chain(v1, v2, v3, point)
+                else:
+                    self.assertEqual(classification, expected)
+                    self.assertIsNone(triangle)
+
+        # Points near the surface.
+        self.assertEqual(cube.classify((1.05, 0, 0)), 0)
+        self.assertEqual(cube.classify((1.05, 0, 0), tolerance=0.1),
+                         ON_SURFACE)
+        self.assertEqual(cube.classify((0.95, 0, 0), tolerance=0.01), 1)
+        classification, triangle = cube.classify(
+            (0.95, 0.2, 0.3), tolerance=0.1, return_triangle=True)
+        self.assertEqual(classification, ON_SURFACE)
+        self.assertEqual(
+            [cube.vertex_positions[vx][0] for vx in cube.triangles[triangle]],
+            [1, 1, 1])
+        self.assertEqual(
+            cube.classify((1.05, 1.05, 1.05), tolerance=0.1), ON_SURFACE)
+        self.assertEqual(
+            cube.classify((1.1, 1.1, 1.1), tolerance=0.1), 0)
+        self.assertEqual(
+            cube.classify_batch(
+                [(5, 5, 5), (0, 0, 0), (1, 0.5, 0), (0, 0, 1.01)],
+                tolerance=0.1),
+            [0, 1, ON_SURFACE, ON_SURFACE])
+
+        with self.assertRaises(ValueError):
+            cube.classify((0, 0, 0), tolerance=-1)
+
+        # A point on the surface doesn't stop the rest of the batch from
+        # being computed in batches.
+        poly = Polyhedron(
+            vertex_positions=torus.vertex_positions,
+            triangles=torus.triangles,
+        )
+        batches = []
+
+        def winding_numbers(points):
+            batches.append(len(points))
+            return Polyhedron.winding_numbers(poly, points)
+
+        poly.winding_numbers = winding_numbers
+        points = [(0.5, 0.5, 0.5 + k / 64.0) for k in range(64)]
+        self.assertEqual(
+            poly.classify_batch(points), [1] * 32 + [ON_SURFACE] + [0] * 31)
+        self.assertEqual(max(batches[1:]), 32)
+        self.assertLessEqual(len(batches), 13)
+
+        # Retrying a batch doesn't count its hull rejections twice.
+        poly = Polyhedron(
+            vertex_positions=misaligned_stacked_cuboids.vertex_positions,
+            triangles=misaligned_stacked_cuboids.triangles,
+        )
+        poly.winding_numbers = lambda points: Polyhedron.winding_numbers(
+            poly, points, backend="python")
+        points = [(2.5, 0.5, 0.5), (0.5, 2.5, 2.5)] * 8 + [(0, 0.5, 0.5)]
+        self.assertEqual(
+            poly.classify_batch(points), [0] * 16 + [ON_SURFACE])
+        self.assertEqual(poly.hull_rejections, 16)
+
+    def test_squared_distance_to_triangle(self):
+        P, Q, R = (0, 0, 0), (2, 0, 0), (0, 2, 0)
+        for point, expected in [
+                ((0.5, 0.5, 3), 9), ((0, 0, 0), 0), ((3, 0, 0), 1),
+                ((-1, -1, 0), 2), ((2, 2, 0), 2), ((1, -1, 1), 2)]:
+            self.assertEqual(
+                squared_distance_to_triangle(P, Q, R, point), expected)
+        # Degenerate triangle.
+        self.assertEqual(
+            squared_distance_to_triangle(P, Q, (1, 0, 0), (1, 1, 0)), 1)
+
+    def test_column_crossings(self):
+        self.assertEqual(
+            cube.column_crossings(0.5, 0.25), [(-1, 1), (1, -1)])
+        self.assertEqual(cube.column_crossings(2, 0), [])
+        # Through a vertex, and along an edge, of the cube.
+        self.assertIsNone(cube.column_crossings(1, 1))
+        self.assertIsNone(cube.column_crossings(0, 1))
+
+        for poly in [torus, twice_wrapped_octahedron, hollow_cube]:
+            for x, y in [(0.3, 0.2), (1.1, 0.7), (-0.4, 0.15)]:
+                crossings = poly.column_crossings(x, y)
+                approximate = poly.column_crossings(
+                    x, y, exact_heights=False)
+                self.assertEqual(
+                    [step for _, step in approximate],
+                    [step for _, step in crossings])
+                for (height, _), (exact_height, _) in zip(
+                        approximate, crossings):
+                    self.assertIsInstance(height, float)
+                    self.assertAlmostEqual(height, float(exact_height))
+                heights = [height for height, _ in crossings]
+                self.assertEqual(heights, sorted(heights))
+                for z in [h + 0.01 for h in heights] + [-10]:
+                    self.assertEqual(
+                        sum(step for height, step in crossings if height < z),
+                        poly.winding_number((x, y, z)))
+
+    def test_triangle_plane(self):
+        def outcome(function, *args):
+            try:
+                return function(*args)
+            except ValueError:
+                return "coplanar"
+
+        random.seed(2718)
+        cases = []
+        for _ in range(300):
+            P, Q, R, O = [
+                tuple(random.randint(-5, 5) for _ in range(3))
+                for _ in range(4)]
+            cases.append((P, Q, R, O))
+            cases.append((P, Q, R, tuple(fractions.Fraction(c, 3) for c in O)))
+            cases.append((P, Q, R, tuple(c + 0.5 for c in O)))
+            scale = 10.0 ** random.randint(-5, 5)
+            offset = 10.0 ** random.randint(0, 8)
+            P, Q, R, O = [
+                tuple(offset + scale * random.random() for _ in range(3))
+                for _ in range(4)]
+            cases.append((P, Q, R, O))
+            # Points very close to the plane of the triangle.
+            for t in [0.0, 1e-17, -1e-15, 1e-12]:
+                u, v = random.random(), random.random()
+                near = tuple(
+                    p + u * (q - p) + v * (r - p) + t * offset
+                    for p, q, r in zip(P, Q, R))
+                cases.append((P, Q, R, near))
+
+        uncertified = 0
+        for P, Q, R, O in cases:
+            plane = triangle_plane(P, Q, R)
+            self.assertEqual(
+                outcome(plane_triangle_sign, P, Q, R, plane, O),
+                outcome(triangle_sign, P, Q, R, O))
+            self.assertEqual(
+                outcome(plane_triangle_sign, P, Q, R, plane, O,
+                        filtered_triangle_sign),
+                outcome(filtered_triangle_sign, P, Q, R, O))
+            result = plane_sign(plane, O)
+            if result is None:
+                uncertified += 1
+            else:
+                self.assertEqual(result, sign(determinant(
+                    *[[fractions.Fraction(c) for c in V]
+                      for V in (P, Q, R, O)])))
+        # Only points very close to the plane need the fallback.
+        self.assertLess(uncertified, 600)
+        self.assertGreater(uncertified, 0)
+
+        # Exact data for exact coordinates, and nothing for other types.
+        third = fractions.Fraction(1, 3)
+        exact_plane, _ = triangle_plane(
+            (0, 0, 0), (third, 0, 0), (0, third, 0))
+        self.assertEqual(exact_plane, (0, 0, third * third, 0))
+        self.assertIsNone(triangle_plane((0, 0, 0), (1, 0, 0), (0, 1, 1j)))
+        self.assertIsNone(plane_sign(None, (0, 0, 0)))
+        self.assertIsNone(plane_sign(
+            triangle_plane((0, 0, 0), (10 ** 400, 0, 0), (0, 1, 0)),
+            (0.0, 0.0, 1.0)))
+
+    def test_sample_interior(self):
+        samples = cube.sample_interior(2000, seed=1)
+        self.assertEqual(len(samples), 2000)
+        self.assertEqual(cube.winding_numbers(samples), [1] * 2000)
+        for i in range(3):
+            upper = sum(1 for point in samples if point[i] > 0)
+            self.assertTrue(850 < upper < 1150)
+        self.assertEqual(cube.sample_interior(2000, seed=1), samples)
+        self.assertNotEqual(cube.sample_interior(2000, seed=2), samples)
+
+        for poly in [torus, hollow_cube, twice_wrapped_octahedron,
+                     pair_of_cubes]:
+            samples = poly.sample_interior(500, seed=3)
+            self.assertEqual(len(samples), 500)
+            self.assertNotIn(0, poly.winding_numbers(samples))
+
+        # The inner cube of nested_cube has winding number 2 and a
+        # twenty-seventh of the volume.
+        def inner_fraction(samples):
+            return sum(
+                1 for point in samples
+                if all(1 < c < 2 for c in point)) / float(len(samples))
+
+        self.assertAlmostEqual(
+            inner_fraction(nested_cube.sample_interior(4000, seed=4)),
+            1.0 / 27, delta=0.015)
+        self.assertAlmostEqual(
+            inner_fraction(
+                nested_cube.sample_interior(4000, seed=4, weighted=True)),
+            2.0 / 28, delta=0.015)
+
+        self.assertEqual(empty.sample_interior(0), [])
+        with self.assertRaises(ValueError):
+            empty.sample_interior(10)
+        with self.assertRaises(ValueError):
+            triangle.sample_interior(10, attempts=100)
+
+    def test_sample_interior_uniformity(self):
+        # Chi-squared test over the 27 unit cubes of the hollow and nested
+        # cubes: the expected counts are proportional to the winding
+        # numbers.  With 26 degrees of freedom the statistic has mean 26
+        # and standard deviation about 7.
+        n = 5400
+        for poly, weighted, centre in [
+                (hollow_cube, False, 0), (nested_cube, False, 1),
+                (nested_cube, True, 2)]:
+            samples = poly.sample_interior(n, seed=5, weighted=weighted)
+            counts = {}
+            for point in samples:
+                cell = tuple(int(c) for c in point)
+                counts[cell] = counts.get(cell, 0) + 1
+            weights = {
+                cell: centre if cell == (1, 1, 1) else 1
+                for cell in itertools.product(range(3), repeat=3)}
+            total = sum(weights.values())
+            statistic = 0.0
+            for cell, weight in weights.items():
+                if weight:
+                    expected = n * weight / float(total)
+                    statistic += (
+                        (counts.get(cell, 0) - expected) ** 2 / expected)
+                else:
+                    self.assertNotIn(cell, counts)
+            self.assertLess(statistic, 70)
+
+            # Every sample comes from its own column.
+            self.assertEqual(
+                len(set((x, y) for x, y, _ in samples)), len(samples))
+
+    def test_cell_volumes(self):
+        def overlap(lower, upper):
+            return max(0, min(upper, 1) - max(lower, -1))
+
+        # Cells of the cube that are cut by its faces, at various offsets.
+        third = fractions.Fraction(1, 3)
+        origin, spacing, shape = (-1.2, -2 * third, -1), (0.4, third, 0.5), (
+            6, 6, 5)
+        volumes = cube.cell_volumes(origin, spacing, shape)
+        for i in range(6):
+            for j in range(6):
+                for k in range(5):
+                    expected = 1
+                    for axis, n in enumerate((i, j, k)):
+                        lower = (fractions.Fraction(origin[axis]) +
+                                 n * fractions.Fraction(spacing[axis]))
+                        expected *= overlap(
+                            lower, lower + fractions.Fraction(spacing[axis]))
+                    self.assertEqual(volumes[i][j][k], expected)
+
+        # Cell volumes add up to the volume, weighted by winding number.
+        for poly in [cube, tetrahedron, octahedron, torus, hollow_cube,
+                     nested_cube, twice_wrapped_octahedron, pair_of_cubes]:
+            volumes = poly.cell_volumes((-1.3, -1.1, -1.2), (0.7, 0.6, 0.5),
+                                        (7, 8, 9))
+            total = sum(
+                volume for plane in volumes for column in plane
+                for volume in column)
+            exact_volume = sum(
+                ((p2[1] - p3[1]) * (p1[0] - p3[0]) -
+                 (p2[0] - p3[0]) * (p1[1] - p3[1])) * (p1[2] + p2[2] + p3[2])
+                for p1, p2, p3 in [
+                    [[fractions.Fraction(c) for c in V] for V in triangle]
+                    for triangle in poly.triangle_positions()]) / 6
+            self.assertEqual(total, exact_volume)
+            self.assertAlmostEqual(float(total), poly.volume())
+        self.assertEqual(
+            poly.cell_volumes((-1.3, -1.1, -1.2), (0.7, 0.6, 0.5),
+                              (7, 8, 9), processes=2),
+            volumes)
+
+        # A cell of the nested cube inside both cubes counts twice.
+        volumes = nested_cube.cell_volumes((0, 0, 0), (1, 1, 1), (3, 3, 3))
+        self.assertEqual(volumes[1][1][1], 2)
+        self.assertEqual(volumes[0][1][1], 1)
+        self.assertEqual(empty.cell_volumes((0, 0, 0), (1, 1, 1), (1, 1, 2)),
+                         [[[0, 0]]])
+
+    def test_triangles_intersect(self):
+        T = (0, 0, 0), (4, 0, 0), (0, 4, 0)
+        cases = [
+            # Crossing, and disjoint, non-coplanar triangles.
+            (((1, 1, -1), (1, 1, 1), (5, 5, 0)), True),
+            (((1, 1, 1), (1, 1, 2), (5, 5, 1)), False),
+            (((3, 3, -1), (3, 3, 1), (5, 5, 0)), False),
+            # Touching at a vertex, along an edge, and edge to edge.
+            (((0, 0, 0), (-1, 0, 1), (0, -1, 1)), True),
+            (((1, 1, 0), (1, 1, 3), (2, 2, 3)), True),
+            (((2, 2, -1), (2, 2, 1), (5, 5, 0)), True),
+            (((2, 2, 0), (5, 5, 1), (5, 5, -1)), True),
+            # Coplanar triangles: overlapping, disjoint, nested, touching.
+            (((1, 1, 0), (5, 1, 0), (1, 5, 0)), True),
+            (((3, 3, 0), (5, 3, 0), (3, 5, 0)), False),
+            (((1, 1, 0), (2, 1, 0), (1, 2, 0)), True),
+            (((-1, -1, 0), (9, -1, 0), (-1, 9, 0)), True),
+            (((2, 2, 0), (5, 2, 0), (2, 5, 0)), True),
+            # Degenerate triangles.
+            (((1, 1, -1), (1, 1, 0), (1, 1, 1)), True),
+            (((1, 1, 1), (1, 1, 2), (1, 1, 3)), False),
+            (((1, 1, 0), (1, 1, 0), (1, 1, 0)), True),
+            (((3, 3, 0), (3, 3, 0), (3, 3, 0)), False),
+            (((-1, 1, 0), (1, 1, 0), (5, 1, 0)), True),
+            (((-2, 1, 1), (5, 1, 1), (7, 1, 1)), False),
+        ]
+        for S, expected in cases:
+            for first, second in ((S, T), (T, S)):
+                self.assertEqual(
+                    triangles_intersect(first, second), expected)
+                self.assertEqual(
+                    triangles_intersect(first[1:] + first[:1], second),
+                    expected)
+                floats = [tuple(float(c) for c in V) for V in first]
+                self.assertEqual(
+                    triangles_intersect(floats, second), expected)
+        # A fine miss, decided exactly.
+        self.assertFalse(triangles_intersect(
+            T, ((0.1, 0.1, 1e-300), (1.0, 0.1, 1e-300), (0.1, 1.0, 1.0))))
+        self.assertTrue(triangles_intersect(
+            T, ((0.1, 0.1, 0.0), (1.0, 0.1, 1e-300), (0.1, 1.0, 1.0))))
+
+    def test_containment_and_overlap(self):
+        big = box((0, 0, 0), (6, 6, 6))
+        small = box((2, 2, 2), (3, 3, 3))
+        # Long bars crossing each other, with no vertex of either inside
+        # the other.
+        bar_x = box((-1, 2, 2), (7, 3, 3))
+        bar_y = box((1, -1, 1), (2, 7, 4))
+        cases = [
+            (big, small, True, True),
+            (small, big, True, False),
+            (big, box((4, 4, 4), (8, 8, 8)), True, False),
+            (big, box((7, 7, 7), (8, 8, 8)), False, False),
+            (big, box((6, 0, 0), (7, 6, 6)), True, False),
+            (big, box((0, 0, 0), (1, 1, 1)), True, False),
+            (bar_x, bar_y, True, False),
+            (big, bar_x, True, False),
+            (nested_cube, box((1.25, 1.25, 1.25), (1.75, 1.75, 1.75)),
+             True, True),
+            # Inside the cavity of the hollow cube, and inside its wall.
+            (hollow_cube, box((1.25, 1.25, 1.25), (1.75, 1.75, 1.75)),
+             False, False),
+            (hollow_cube, box((0.25, 0.25, 0.25), (0.75, 2.75, 2.75)),
+             True, True),
+            (box((-2, -2, -2), (2, 2, 2)), twice_wrapped_octahedron,
+             True, True),
+            (torus, box((1.25, 1.25, -1), (1.75, 1.75, 2)), False, False),
+            (torus, box((0.25, 0.25, 0.25), (0.75, 2.75, 0.75)),
+             True, True),
+            (big, empty, False, True),
+            (empty, small, False, False),
+        ]
+        for first, second, overlaps, contains in cases:
+            self.assertEqual(first.overlaps(second), overlaps)
+            self.assertEqual(second.overlaps(first), overlaps)
+            self.assertEqual(first.contains(second), contains)
+
+        self.assertIsNone(big.surface_intersection(small))
+        self.assertIsNone(
+            bar_x.surface_intersection(box((7, 7, 7), (8, 8, 8))))
+        i, j = bar_x.surface_intersection(bar_y)
+        self.assertTrue(triangles_intersect(
+            [bar_x.vertex_positions[v] for v in bar_x.triangles[i]],
+            [bar_y.vertex_positions[v] for v in bar_y.triangles[j]]))
+
+    def test_reclassify(self):
+        roof = Polyhedron(
+            vertex_positions=list(cube.vertex_positions),
+            triangles=list(cube.triangles),
+        )
+        (apex,) = roof.add_vertices([(0, 0, 2)])
+        removed = [[1, 5, 7], [7, 3, 1]]
+        added = [[1, 5, apex], [5, 7, apex], [7, 3, apex], [3, 1, apex]]
+        roof.replace_triangles(removed=removed, added=added)
+        changes = (
+            [[roof.vertex_positions[v] for v in t] for t in removed],
+            [[roof.vertex_positions[v] for v in t] for t in added],
+        )
+        old_removed, new_added = changed_triangles(
+            cube.triangle_positions(), roof.triangle_positions())
+        self.assertEqual(
+            sorted(old_removed), sorted(tuple(t) for t in changes[0]))
+        self.assertEqual(
+            sorted(new_added), sorted(tuple(t) for t in changes[1]))
+        self.assertEqual(
+            winding_number_changes(
+                [(0, 0, 1.5), (0, 0, 0.5), (0.9, 0.9, 1.5), (0, 0, 2)],
+                *changes),
+            [1, 0, 0, None])
+
+        moved_positions = list(torus.vertex_positions)
+        moved_positions[5] = (2.5, 2.5, 1.5)
+        moved_torus = Polyhedron(
+            vertex_positions=moved_positions, triangles=torus.triangles)
+
+        # Points on a half-integer grid, many of them on the surfaces, and
+        # points at random.
+        random.seed(28)
+        grid = [i * 0.5 - 1.5 for i in range(10)]
+        points = [(x, y, z) for x in grid for y in grid for z in grid]
+        points.extend(
+            tuple(random.uniform(-1.5, 3.5) for _ in range(3))
+            for _ in range(200))
+
+        cases = [
+            (cube, roof),
+            (roof, cube),
+            (torus, moved_torus),
+            (torus, nested_cube),
+            (empty, hollow_cube),
+            (cube, cube),
+        ]
+        for old, new in cases:
+            results = old.classify_batch(points)
+            self.assertEqual(
+                new.reclassify(points, results, old=old),
+                new.classify_batch(points))
+
+        results = cube.classify_batch(points)
+        self.assertEqual(
+            roof.reclassify(points, results, changes=changes),
+            roof.classify_batch(points))
+
+        with self.assertRaises(ValueError):
+            roof.reclassify(points, results)
+        with self.assertRaises(ValueError):
+            roof.reclassify(points, results, old=cube, changes=changes)
+        with self.assertRaises(ValueError):
+            roof.reclassify(points, results[1:], old=cube)
+
+    def test_reclassify_float(self):
+        # Float meshes, with points within rounding error of the surfaces,
+        # which the float predicates may classify either way.
+        positions = [
+            tuple(0.1 * c + 0.07 for c in position)
+            for position in torus.vertex_positions]
+        moved_positions = list(positions)
+        moved_positions[5] = (0.32, 0.32, 0.22)
+        rng = random.Random(3)
+        points = []
+        for vertices in [positions, moved_positions]:
+            for triangle in torus.triangles:
+                P, Q, R = [vertices[vx] for vx in triangle]
+                for _ in range(20):
+                    a, b = rng.random(), rng.random()
+                    if a + b > 1:
+                        a, b = 1 - a, 1 - b
+                    points.append(tuple(
+                        P[i] + a * (Q[i] - P[i]) + b * (R[i] - P[i])
+                        for i in range(3)))
+        points.extend(
+            tuple(rng.uniform(-0.1, 0.4) for _ in range(3))
+            for _ in range(200))
+
+        for storage in [None, "float32"]:
+            old = Polyhedron(
+                vertex_positions=positions, triangles=torus.triangles,
+                storage=storage)
+            new = Polyhedron(
+                vertex_positions=moved_positions, triangles=torus.triangles,
+                storage=storage)
+            results = old.classify_batch(points)
+            self.assertEqual(
+                new.reclassify(points, results, old=old),
+                new.classify_batch(points))
+
+    def test_sign_arrays(self):
+        def scalar_signs(function, *point_arrays):
+            result = []
+            for points in zip(*point_arrays):
+                try:
+                    result.append(function(*points))
+                except ValueError:
+                    result.append(0)
+            return result
+
+        # Small coordinates, so that degenerate cases are common.
+        rng = random.Random(97531)
+        P, Q, R, O = [
+            [tuple(rng.randint(-1, 1) for _ in range(3)) for _ in range(500)]
+            for _ in range(4)]
+        inputs = [
+            (P, Q, R, O),
+            tuple([tuple(0.5 * c for c in point) for point in points]
+                  for points in (P, Q, R, O)),
+            tuple([tuple(fractions.Fraction(c, 3) for c in point)
+                   for point in points] for points in (P, Q, R, O)),
+        ]
+        if NUMPY_AVAILABLE:
+            inputs.append(tuple(
+                numpy.array(points, dtype=numpy.int64)
+                for points in (P, Q, R, O)))
+            inputs.append(tuple(
+                numpy.array(points, dtype=numpy.float64) / 7
+                for points in (P, Q, R, O)))
+        for P, Q, R, O in inputs:
+            signs = vertex_signs(P, O)
+            self.assertEqual(signs.typecode, "b")
+            self.assertEqual(list(signs), scalar_signs(vertex_sign, P, O))
+            self.assertEqual(
+                list(edge_signs(P, Q, O)), scalar_signs(edge_sign, P, Q, O))
+            self.assertEqual(
+                list(triangle_signs(P, Q, R, O)),
+                scalar_signs(triangle_sign, P, Q, R, O))
+
+        self.assertEqual(list(vertex_signs([], [])), [])
+        with self.assertRaises(ValueError):
+            edge_signs(P, Q, O[:-1])
+
     @unittest.skipUnless(NUMPY_AVAILABLE, "Test requires NumPy")
     def test_numpy_float64_compatibility(self):
         # This is a repetition of test_cube, but using NumPy float64
@@ -0,0 +1,164 @@
+"""
+Tests for tiled voxelization.
+
+"""
+import array
+import fractions
+import os
+import shutil
+import tempfile
+import unittest
+
+from polyhedron import ON_SURFACE
+from test_polyhedron import cube, torus, twice_wrapped_octahedron
+from voxelize import read_rle_tile, voxelize
+
+
+def expected_labels(poly, origin, spacing, shape, surface_label):
+    """
+    Labels computed voxel by voxel with Polyhedron.classify.
+
+    """
+    half = fractions.Fraction(1, 2)
+    labels = []
+    for i in range(shape[0]):
+        for j in range(shape[1]):
+            for k in range(shape[2]):
+                centre = tuple(
+                    fractions.Fraction(o) + (n + half) * fractions.Fraction(s)
+                    for o, s, n in zip(origin, spacing, (i, j, k)))
+                label = poly.classify(centre)
+                labels.append(surface_label if label == ON_SURFACE else label)
+    return labels
+
+
+class TestVoxelize(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read_raw(self, path):
+        with open(path, "rb") as f:
+            return list(array.array("b", f.read()))
+
+    def test_raw(self):
+        cases = [
+            (cube, (-1.5, -1.5, -1.5), (0.25, 0.25, 0.25), (12, 12, 12)),
+            # Voxel centres on the faces, edges and vertices of the cube.
+            (cube, (-1.75, -1.75, -1.75), (0.5, 0.5, 0.5), (7, 7, 7)),
+            (torus, (-0.3, -0.3, -0.3), (0.4, 0.4, 0.2), (10, 9, 7)),
+            (twice_wrapped_octahedron, (-1.25, -1.25, -1.25),
+             (0.5, 0.5, 0.5), (5, 5, 5)),
+        ]
+        for n, (poly, origin, spacing, shape) in enumerate(cases):
+            path = os.path.join(self.directory, "volume{}.raw".format(n))
+            timings = voxelize(
+                poly, origin, spacing, shape, path, tile_size=4,
+                surface_label=5)
+            self.assertEqual(
+                sorted(timings),
+                [(i, j) for i in range(0, shape[0], 4)
+                 for j in range(0, shape[1], 4)])
+            self.assertEqual(
+                self.read_raw(path),
+                expected_labels(poly, origin, spacing, shape, 5))
+
+    def test_rle_and_processes(self):
+        origin, spacing, shape = (-0.3, -0.3, -0.3), (0.4, 0.4, 0.2), (9, 9, 8)
+        raw_path = os.path.join(self.directory, "volume.raw")
+        rle_path = os.path.join(self.directory, "volume")
+        voxelize(torus, origin, spacing, shape, raw_path, tile_size=4)
+        voxelize(torus, origin, spacing, shape, rle_path, tile_size=4,
+                 processes=2, format="rle")
+
+        labels = self.read_raw(raw_path)
+        columns = {}
+        for name in os.listdir(rle_path):
+            if name.endswith(".rle"):
+                columns.update(read_rle_tile(os.path.join(rle_path, name)))
+        self.assertEqual(len(columns), 81)
+        for (i, j), runs in columns.items():
+            column = [label for label, length in runs for _ in range(length)]
+            start = (i * shape[1] + j) * shape[2]
+            self.assertEqual(column, labels[start:start + shape[2]])
+
+        parallel_path = os.path.join(self.directory, "parallel.raw")
+        voxelize(torus, origin, spacing, shape, parallel_path, tile_size=4,
+                 processes=2)
+        self.assertEqual(self.read_raw(parallel_path), labels)
+
+    def test_resume(self):
+        origin, spacing, shape = (-1.5, -1.5, -1.5), (0.25, 0.25, 0.25), (
+            12, 12, 12)
+        path = os.path.join(self.directory, "volume.raw")
+        timings = voxelize(cube, origin, spacing, shape, path, tile_size=8)
+        self.assertEqual(len(timings), 4)
+        labels = self.read_raw(path)
+
+        # Simulate an interruption after the first tile: only that tile is
+        # recorded as complete, and the rest of the volume is lost.
+        with open(path + ".progress") as f:
+            header, first_line = f.readline(), f.readline()
+        with open(path + ".progress", "w") as f:
+            f.write(header + first_line)
+        first_tile = tuple(int(field) for field in first_line.split()[:2])
+        with open(path, "r+b") as f:
+            f.write(b"\x07" * (12 * 12 * 12))
+
+        resumed = voxelize(cube, origin, spacing, shape, path, tile_size=8)
+        self.assertEqual(sorted(resumed), sorted(timings))
+        self.assertEqual(resumed[first_tile], timings[first_tile])
+        for (i, j, k), label in zip(
+                [(i, j, k) for i in range(12) for j in range(12)
+                 for k in range(12)],
+                self.read_raw(path)):
+            if (i // 8 * 8, j // 8 * 8) == first_tile:
+                self.assertEqual(label, 7)
+            else:
+                self.assertEqual(label, labels[(i * 12 + j) * 12 + k])
+
+    def test_default_surface_label(self):
+        # Voxel centres on the faces, edges and vertices of the cube.
+        origin, spacing, shape = (-1.75, -1.75, -1.75), (0.5, 0.5, 0.5), (
+            7, 7, 7)
+        path = os.path.join(self.directory, "volume.raw")
+        voxelize(cube, origin, spacing, shape, path, tile_size=4)
+        labels = self.read_raw(path)
+        self.assertEqual(
+            labels, expected_labels(cube, origin, spacing, shape, -128))
+        self.assertEqual(sorted(set(labels)), [-128, 0, 1])
+
+    def test_resume_with_different_parameters(self):
+        origin, spacing, shape = (-1.5, -1.5, -1.5), (0.25, 0.25, 0.25), (
+            12, 12, 12)
+        path = os.path.join(self.directory, "volume.raw")
+        voxelize(cube, origin, spacing, shape, path, tile_size=8)
+        for poly, kwargs in [
+                (cube, dict(origin=(-1.25, -1.5, -1.5))),
+                (cube, dict(spacing=(0.5, 0.25, 0.25))),
+                (cube, dict(shape=(12, 12, 10))),
+                (cube, dict(tile_size=4)),
+                (cube, dict(surface_label=5)),
+                (torus, {})]:
+            arguments = dict(
+                origin=origin, spacing=spacing, shape=shape, path=path,
+                tile_size=8)
+            arguments.update(kwargs)
+            with self.assertRaises(ValueError):
+                voxelize(poly, **arguments)
+
+        # A fresh output with different parameters is fine.
+        os.remove(path + ".progress")
+        voxelize(torus, origin, spacing, (12, 12, 10), path, tile_size=4)
+        self.assertEqual(len(self.read_raw(path)), 12 * 12 * 10)
+
+    def test_invalid_format(self):
+        with self.assertRaises(ValueError):
+            voxelize(cube, (0, 0, 0), (1, 1, 1), (2, 2, 2),
+                     os.path.join(self.directory, "volume"), format="png")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,386 @@
+"""
+Tiled, out-of-core voxelization of a closed surface.
+
+The voxel grid is split into tiles of columns in the xy-plane, and each tile
+is processed independently: the triangles whose footprints meet the tile are
+found with a FootprintIndex, and each column of voxels is labelled from the
+crossings of its vertical centre line with the surface (see
+polyhedron.column_crossings), so the work for a column is proportional to
+the number of crossings rather than the number of voxels.  Tiles can be
+shared between worker processes.
+
+Two output formats are supported:
+
+- "raw": a single file of int8 labels in C order, with shape (nx, ny, nz),
+  so that each column is contiguous.  Workers write their columns directly
+  into a memory map of the file, and the result can be opened with
+  numpy.memmap(path, dtype=numpy.int8, mode="r", shape=shape).
+
+- "rle": a directory holding one file per tile, in which each column is
+  run-length encoded; read it with read_rle_tile.
+
+Completed tiles are recorded, with their timings, in a progress file next to
+the output, so that an interrupted run can be resumed by calling voxelize
+again with the same arguments.  The progress file starts with a description
+of the surface and the grid, and a run with different arguments is refused.
+
+"""
+import array
+import hashlib
+import mmap
+import os
+import sys
+import timeit
+
+from polyhedron import (
+    FootprintIndex, column_crossings, divide, exact, filtered_triangle_chain)
+from processes import process_pool
+
+
+# Default label for voxels whose centres lie on the surface: the one int8
+# value that isn't used for winding numbers.
+SURFACE_LABEL = -128
+
+
+def _column_labels(triangles, x, y, z0, dz, nz, surface_label):
+    """
+    Labels of the nz voxels of the column through (x, y), as runs.
+
+    Return a list of pairs (label, length) covering the column, where the
+    label of a voxel is the winding number around its centre, or
+    surface_label for centres on the surface.
+
+    """
+    crossings = column_crossings(triangles, x, y)
+    if crossings is None:
+        # Degenerate column: classify each voxel centre separately.
+        labels = []
+        for k in range(nz):
+            point = (x, y, z0 + (k + divide(1, 2)) * dz)
+            try:
+                label = sum(
+                    filtered_triangle_chain(v1, v2, v3, point)
+                    for v1, v2, v3 in triangles) // 2
+            except ValueError:
+                label = surface_label
+            if labels and labels[-1][0] == label:
+                labels[-1] = label, labels[-1][1] + 1
+            else:
+                labels.append((label, 1))
+        return labels
+
+    # Voxel k has centre z0 + (k + 1/2) * dz, so a crossing at height h
+    # affects the voxels from index floor(t) + 1 upwards, where
+    # t = (h - z0) / dz - 1/2; if t is an integer, voxel t lies on the
+    # surface.
+    runs = []
+    surface = []
+    label, start = 0, 0
+    for height, step in crossings:
+        t = divide(height - z0, dz) - divide(1, 2)
+        # Floor division is exact for Fractions, unlike math.floor on
+        # Python 2, which converts to float first.
+        floor = t // 1
+        first = max(0, min(nz, int(floor) + 1))
+        if first > start:
+            runs.append((label, first - start))
+            start = first
+        label += step
+        if t == floor and 0 <= t < nz:
+            surface.append(int(t))
+    if nz > start:
+        runs.append((label, nz - start))
+    for index in surface:
+        _relabel(runs, index, surface_label)
+    return _merge(runs)
+
+
+def _relabel(runs, index, label):
+    """
+    Change the label of a single voxel in a list of runs.
+
+    """
+    position = 0
+    for i, (old_label, length) in enumerate(runs):
+        if position + length > index:
+            offset = index - position
+            pieces = [
+                (old_label, offset), (label, 1),
+                (old_label, length - offset - 1)]
+            runs[i:i + 1] = [piece for piece in pieces if piece[1]]
+            return
+        position += length
+
+
+def _merge(runs):
+    """
+    Merge adjacent runs with equal labels.
+
+    """
+    merged = []
+    for label, length in runs:
+        if merged and merged[-1][0] == label:
+            merged[-1] = label, merged[-1][1] + length
+        else:
+            merged.append((label, length))
+    return merged
+
+
+def _tiles(shape, tile_size):
+    """
+    Corners (i0, j0) of the tiles covering the columns of the grid.
+
+    """
+    nx, ny, _ = shape
+    return [
+        (i0, j0) for i0 in range(0, nx, tile_size)
+        for j0 in range(0, ny, tile_size)]
+
+
+# Per-process state for workers: the footprint index of the surface and the
+# voxelization parameters.
+_worker_state = None
+
+
+def _initialize_worker(state):
+    """
+    Initializer for worker processes.
+
+    """
+    global _worker_state
+    index = FootprintIndex(state["triangles"])
+    _worker_state = dict(state, index=index)
+
+
+def _process_tile(tile):
+    """
+    Label the columns of one tile, writing them to the output.
+
+    Return the pair (tile, seconds taken).
+
+    """
+    start_time = timeit.default_timer()
+    state = _worker_state
+    (ox, oy, oz), (dx, dy, dz) = state["origin"], state["spacing"]
+    (nx, ny, nz), tile_size = state["shape"], state["tile_size"]
+    index = state["index"]
+    i0, j0 = tile
+    i1, j1 = min(nx, i0 + tile_size), min(ny, j0 + tile_size)
+    half = divide(1, 2)
+    xs = [ox + (i + half) * dx for i in range(i0, i1)]
+    ys = [oy + (j + half) * dy for j in range(j0, j1)]
+
+    # Triangles meeting the tile, indexed again for the column queries.
+    tile_index = FootprintIndex([
+        index.triangles[t]
+        for t in index.candidates(xs[0], xs[-1], ys[0], ys[-1])])
+
+    columns = []
+    for x in xs:
+        for y in ys:
+            triangles = [
+                tile_index.triangles[t]
+                for t in tile_index.candidates(x, x, y, y)]
+            columns.append(_column_labels(
+                triangles, x, y, oz, dz, nz, state["surface_label"]))
+    for runs in columns:
+        for label, _ in runs:
+            if not -128 <= label <= 127:
+                raise ValueError(
+                    "Label {} doesn't fit in int8".format(label))
+
+    if state["format"] == "raw":
+        with open(state["path"], "r+b") as f:
+            volume = mmap.mmap(f.fileno(), 0)
+            try:
+                column = iter(columns)
+                for i in range(i0, i1):
+                    for j in range(j0, j1):
+                        offset = (i * ny + j) * nz
+                        for label, length in next(column):
+                            # Python 2's mmap only accepts str here.
+                            volume[offset:offset + length] = bytes(
+                                bytearray([label % 256]) * length)
+                            offset += length
+                volume.flush()
+            finally:
+                volume.close()
+    else:
+        values = array.array("i")
+        for runs in columns:
+            values.append(len(runs))
+            for run in runs:
+                values.extend(run)
+        _write_rle_tile(state["path"], tile, (i1 - i0, j1 - j0), values)
+    return tile, timeit.default_timer() - start_time
+
+
+def _rle_tile_path(directory, tile):
+    return os.path.join(directory, "tile_{}_{}.rle".format(*tile))
+
+
+def _write_rle_tile(directory, tile, size, values):
+    """
+    Write the encoded columns of a tile, replacing any partial file.
+
+    """
+    path = _rle_tile_path(directory, tile)
+    header = array.array("i", [tile[0], tile[1], size[0], size[1]])
+    if sys.byteorder == "big":
+        header.byteswap()
+        values.byteswap()
+    with open(path + ".tmp", "wb") as f:
+        header.tofile(f)
+        values.tofile(f)
+    os.rename(path + ".tmp", path)
+
+
+def read_rle_tile(path):
+    """
+    Read a tile written in the "rle" format.
+
+    Return a dictionary mapping each column (i, j) of the tile to its list
+    of (label, length) runs, from the bottom of the column upwards.
+
+    """
+    with open(path, "rb") as f:
+        values = array.array("i", f.read())
+    if sys.byteorder == "big":
+        values.byteswap()
+    i0, j0, width, height = values[:4]
+    columns = {}
+    position = 4
+    for i in range(i0, i0 + width):
+        for j in range(j0, j0 + height):
+            count = values[position]
+            runs = values[position + 1:position + 1 + 2 * count]
+            columns[i, j] = list(zip(runs[::2], runs[1::2]))
+            position += 1 + 2 * count
+    return columns
+
+
+def _progress_path(path, format):
+    if format == "raw":
+        return path + ".progress"
+    return os.path.join(path, "progress")
+
+
+def _progress_header(state):
+    """
+    First line of the progress file, identifying the surface and the grid.
+
+    """
+    digest = hashlib.sha1(repr(state["triangles"]).encode("utf-8"))
+    parameters = [
+        ("surface", digest.hexdigest()),
+        ("origin", ",".join(str(c) for c in state["origin"])),
+        ("spacing", ",".join(str(c) for c in state["spacing"])),
+        ("shape", ",".join(str(n) for n in state["shape"])),
+        ("tile_size", state["tile_size"]),
+        ("format", state["format"]),
+        ("surface_label", state["surface_label"]),
+    ]
+    return " ".join("{}={}".format(*item) for item in parameters) + "\n"
+
+
+def _read_progress(progress_path, header):
+    """
+    Tiles already completed, as a dictionary mapping tile to timing.
+
+    Raise ValueError if the progress file was written for a different
+    surface or grid.
+
+    """
+    completed = {}
+    if os.path.exists(progress_path):
+        with open(progress_path) as f:
+            if f.readline() != header:
+                raise ValueError(
+                    "Progress file {} was written with different "
+                    "parameters".format(progress_path))
+            for line in f:
+                fields = line.split()
+                if len(fields) == 3:
+                    completed[int(fields[0]), int(fields[1])] = float(
+                        fields[2])
+    return completed
+
+
+def voxelize(polyhedron, origin, spacing, shape, path, tile_size=64,
+             processes=None, format="raw", surface_label=SURFACE_LABEL):
+    """
+    Voxelize a polyhedron into a label volume on disk.
+
+    The grid has *shape* (nx, ny, nz) voxels, with voxel (i, j, k) centred
+    at origin + ((i, j, k) + 1/2) * spacing.  Its label is the winding
+    number of the polyhedron around the centre, or *surface_label* if the
+    centre lies on the surface.  Labels must fit in int8; the default
+    surface label, -128, is then distinct from every winding number
+    allowed.  Rational origin and spacing give exact results.
+
+    The columns are processed in tiles of *tile_size* by *tile_size*, in
+    *processes* worker processes if that's greater than 1, in which case a
+    script calling this needs an ``if __name__ == "__main__":`` guard (see
+    the processes module).  *format* is
+    "raw", for a file at *path*, or "rle", for a directory at *path*; see
+    the module docstring.  Tiles recorded as complete by an earlier call
+    with the same surface and arguments are skipped; ValueError is raised
+    if the output at *path* was started with different ones.
+
+    Return a dictionary mapping each tile's corner (i0, j0) to the time in
+    seconds taken to process it.
+
+    """
+    if format not in ("raw", "rle"):
+        raise ValueError("Unknown format: {!r}".format(format))
+    nx, ny, nz = shape
+    polyhedron.validate()
+    state = dict(
+        triangles=list(polyhedron.triangle_positions()),
+        origin=tuple(exact(c) for c in origin),
+        spacing=tuple(exact(c) for c in spacing),
+        shape=(nx, ny, nz),
+        tile_size=tile_size,
+        path=path,
+        format=format,
+        surface_label=surface_label,
+    )
+
+    if format == "rle" and not os.path.isdir(path):
+        os.makedirs(path)
+    progress_path = _progress_path(path, format)
+    header = _progress_header(state)
+    timings = _read_progress(progress_path, header)
+    if not os.path.exists(progress_path):
+        # A fresh run: any existing output is stale.
+        if format == "raw":
+            with open(path, "wb") as f:
+                f.truncate(nx * ny * nz)
+        with open(progress_path, "w") as progress:
+            progress.write(header)
+    remaining = [
+        tile for tile in _tiles(shape, tile_size) if tile not in timings]
+    if not nx * ny * nz:
+        return timings
+
+    with open(progress_path, "a") as progress:
+        def record(tile, seconds):
+            timings[tile] = seconds
+            progress.write("{} {} {!r}\n".format(tile[0], tile[1], seconds))
+            progress.flush()
+
+        if processes is None or processes <= 1:
+            _initialize_worker(state)
+            for tile in remaining:
+                record(*_process_tile(tile))
+        else:
+            pool = process_pool(
+                processes, initializer=_initialize_worker, initargs=(state,))
+            try:
+                for tile, seconds in pool.imap_unordered(
+                        _process_tile, remaining):
+                    record(tile, seconds)
+            finally:
+                pool.close()
+                pool.join()
+    return timings